@@ -0,0 +1,364 @@
+import xml.etree.ElementTree as ET
+import asyncio
+import contextlib
+import io
+import random
+import re
+import time
+
+import aiohttp
+
+import bulk_states
+from bulk_metrics import endpoint_name
+from bulk_transport import IDEMPOTENT_METHODS, REFUSED_STATUSES, \
+    RETRY_STATUSES, THROTTLE_CODES, compress_body
+from SalesforceBulkQuery import (BulkDocuments, BulkBatchFailed,
+                                 BulkJobTimeout, read_result_csv,
+                                 concat_chunks)
+
+
+class AsyncSalesforceBulk(BulkDocuments):
+    """
+    asyncio version of SalesforceBulk. The job operations are coroutines
+    sharing one aiohttp connection pool, so many jobs can be created, polled
+    and downloaded concurrently from a single thread. Use it as an async
+    context manager, or call close() when done.
+
+    Job and batch XML documents, headers and errors come from BulkDocuments,
+    the request free base it shares with SalesforceBulk; every request is
+    made here, so nothing blocks the event loop.
+    """
+
+    def __init__(self, sessionId=None, host=None, API_version="39.0",
+                 pool_size=10, max_retries=5, backoff=0.5, max_backoff=60,
+                 **kwargs):
+        super(AsyncSalesforceBulk, self).__init__(
+            sessionId=sessionId, host=host, API_version=API_version, **kwargs)
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def client_session(self):
+        # the aiohttp session, opened on first use
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def request(self, method, url, headers=None, body=None,
+                      idempotent=None):
+        """
+        Send a request and return (status, headers, content), retrying
+        throttled and 5xx responses the same way RequestsTransport does:
+        POSTs only on 429, 503 and throttles unless idempotent is True.
+        """
+        async with self.send(method, url, headers, body, idempotent) as resp:
+            content = await resp.read()
+            return resp.status, resp.headers, content
+
+    @contextlib.asynccontextmanager
+    async def send(self, method, url, headers=None, body=None,
+                   idempotent=None):
+        """
+        Send a request with the retry policy of request() and yield the
+        successful response before its body is read, so it can be streamed.
+        Error responses are read and raised once retries run out.
+        """
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        statuses = RETRY_STATUSES if idempotent else REFUSED_STATUSES
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            async with self.client_session().request(
+                    method, url, headers=headers, data=body) as resp:
+                if resp.status < 400:
+                    try:
+                        yield resp
+                    finally:
+                        self.instrumentation.request(
+                            method, url, resp.status,
+                            time.perf_counter() - start, len(body or b''),
+                            resp.content.total_bytes,
+                            resp.headers.get('Sforce-Limit-Info'))
+                    return
+                content = await resp.read()
+                self.instrumentation.request(
+                    method, url, resp.status, time.perf_counter() - start,
+                    len(body or b''), len(content),
+                    resp.headers.get('Sforce-Limit-Info'))
+                retry = resp.status in statuses or \
+                    any(code.encode() in content for code in THROTTLE_CODES)
+                if attempt >= self.max_retries or not retry:
+                    msg = "Bulk API HTTP Error result: {0}".format(content)
+                    self.raise_error(msg, resp.status)
+                retry_after = resp.headers.get('Retry-After')
+
+            try:
+                delay = min(float(retry_after), self.max_backoff)
+            except (TypeError, ValueError):
+                delay = random.uniform(
+                    0, min(self.backoff * (2 ** attempt), self.max_backoff))
+            self.instrumentation.count('request_retries',
+                                       endpoint=endpoint_name(url))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def parse_status(self, element):
+        result = {}
+        for child in element:
+            result[child.tag.split('}')[-1]] = child.text
+        return result
+
+    async def create_job(self, object_name=None, operation=None,
+                         contentType='CSV', concurrency=None,
+                         external_id_name=None, pk_chunking=False,
+                         parent=None):
+        assert(object_name is not None)
+        assert(operation is not None)
+
+        doc = self.create_job_doc(object_name=object_name,
+                                  operation=operation,
+                                  contentType=contentType,
+                                  concurrency=concurrency,
+                                  external_id_name=external_id_name)
+
+        extra_headers = {}
+        if pk_chunking:
+            extra_headers['Sforce-Enable-PKChunking'] = \
+                self.pk_chunking_header(pk_chunking, parent)
+
+        status, headers, content = await self.request(
+            "POST", self.endpoint + "/job",
+            headers=self.headers(extra_headers), body=doc)
+
+        tree = ET.fromstring(content)
+        job_id = tree.findtext("{%s}id" % self.jobNS)
+        self.jobs[job_id] = job_id
+        if pk_chunking:
+            self.pk_chunked_jobs.add(job_id)
+
+        return job_id
+
+    async def create_query_job(self, object_name, include_deleted=False,
+                               **kwargs):
+        operation = "queryAll" if include_deleted else "query"
+        return await self.create_job(object_name, operation, **kwargs)
+
+    async def close_job(self, job_id):
+        doc = self.create_close_job_doc()
+        url = self.endpoint + "/job/%s" % job_id
+        await self.request("POST", url, headers=self.headers(), body=doc,
+                           idempotent=True)
+
+    async def query(self, job_id, soql, pk_chunking=False, parent=None):
+        if job_id is None:
+            job_id = await self.create_job(
+                re.search(re.compile(r"from (\w+)", re.I), soql).group(1),
+                "query", pk_chunking=pk_chunking, parent=parent)
+        return await self.post_batch(job_id, soql)
+
+    async def post_batch(self, job_id, data):
+        """
+        Add a batch of CSV data, or a query, to a job and return its id.
+        """
+        uri = self.endpoint + "/job/%s/batch" % job_id
+        headers = self.headers({"Content-Type": "text/csv"})
+        if self.compress:
+            data, encoding = compress_body(data)
+            headers.update(encoding)
+        status, resp_headers, content = await self.request(
+            "POST", uri, headers=headers, body=data)
+
+        tree = ET.fromstring(content)
+        batch_id = tree.findtext("{%s}id" % self.jobNS)
+
+        self.batches[batch_id] = job_id
+
+        return batch_id
+
+    async def batch_status(self, job_id=None, batch_id=None, reload=False):
+        if not reload and batch_id in self.batch_statuses:
+            return self.batch_statuses[batch_id]
+
+        job_id = job_id or self.lookup_job_id(batch_id)
+
+        uri = self.endpoint + "/job/%s/batch/%s" % (job_id, batch_id)
+        status, headers, content = await self.request(
+            "GET", uri, headers=self.headers())
+
+        result = self.parse_status(ET.fromstring(content))
+        self.batch_statuses[batch_id] = result
+        return result
+
+    async def get_batch_list(self, job_id):
+        uri = self.endpoint + "/job/%s/batch" % job_id
+        status, headers, content = await self.request(
+            "GET", uri, headers=self.headers())
+
+        result = []
+        tree = ET.fromstring(content)
+        for info in tree.iter("{%s}batchInfo" % self.jobNS):
+            status = self.parse_status(info)
+            self.batches[status['id']] = job_id
+            self.batch_statuses[status['id']] = status
+            result.append(status)
+        return result
+
+    async def wait_for_batch(self, job_id, batch_id, timeout=None,
+                             min_interval=1, max_interval=30, backoff=2):
+        """
+        Wait for a batch to complete with the same adaptive backoff as
+        BulkPoller, without blocking the event loop.
+        """
+        started = time.time()
+        interval = min_interval
+        processed = -1
+        while True:
+            self.instrumentation.count('bulk_polls')
+            status = await self.batch_status(job_id, batch_id, reload=True)
+            state = status.get('state')
+            if state in bulk_states.ERROR_STATES:
+                raise BulkBatchFailed(job_id, batch_id,
+                                      status.get('stateMessage'))
+            if state == bulk_states.COMPLETED:
+                return status
+
+            if timeout is not None and time.time() - started > timeout:
+                raise BulkJobTimeout([job_id], timeout)
+            now_processed = int(status.get('numberRecordsProcessed') or 0)
+            if now_processed > processed:
+                interval = max(min_interval, interval / backoff)
+            else:
+                interval = min(max_interval, interval * backoff)
+            processed = now_processed
+            await asyncio.sleep(interval)
+
+    async def get_batch_result_ids(self, job_id, batch_id):
+        uri = self.endpoint + \
+            "/job/%s/batch/%s/result" % (job_id, batch_id)
+        status, headers, content = await self.request(
+            "GET", uri, headers=self.headers())
+
+        tree = ET.fromstring(content)
+        return [el.text for el in tree.iter("{%s}result" % self.jobNS)]
+
+    async def iter_batch_result_chunks(self, job_id, batch_id,
+                                       chunksize=100000):
+        """
+        Async generator of DataFrames of at most chunksize rows covering
+        every result file of a batch, parsed as the response streams in.
+        """
+        for result_id in await self.get_batch_result_ids(job_id, batch_id):
+            uri = self.endpoint + \
+                "/job/%s/batch/%s/result/%s" % (job_id, batch_id, result_id)
+            async with self.send("GET", uri, headers=self.headers()) as resp:
+                header = None
+                lines = []
+                buffer = b''
+                quoted = False
+                received = 0
+                async for data in resp.content.iter_any():
+                    received += len(data)
+                    buffer += data
+                    parts = buffer.split(b'\n')
+                    buffer = parts.pop()
+                    for line in parts:
+                        line += b'\n'
+                        if header is None:
+                            header = line
+                            continue
+                        lines.append(line)
+                        # an odd number of quotes means a quoted value
+                        # carries on to the next line
+                        if line.count(b'"') % 2:
+                            quoted = not quoted
+                        if len(lines) >= chunksize and not quoted:
+                            yield self.parse_result_lines(header, lines)
+                            lines = []
+                if buffer:
+                    if header is None:
+                        header = buffer
+                    else:
+                        lines.append(buffer)
+                self.instrumentation.count('request_bytes_received',
+                                           received,
+                                           endpoint=endpoint_name(uri))
+                if lines:
+                    yield self.parse_result_lines(header, lines)
+
+    def parse_result_lines(self, header, lines):
+        stream = io.BytesIO(header + b''.join(lines))
+        return concat_chunks(read_result_csv(stream, len(lines)))
+
+    async def run_query(self, object_name, soql, chunksize=100000,
+                        timeout=None, **poll_options):
+        """
+        Create a query job, wait for it and return its results as one
+        DataFrame.
+        """
+        started = time.perf_counter()
+        job_id = await self.create_query_job(object_name, contentType='CSV')
+        batch_id = await self.query(job_id, soql)
+        await self.close_job(job_id)
+        await self.wait_for_batch(job_id, batch_id, timeout=timeout,
+                                  **poll_options)
+        chunks = []
+        async for chunk in self.iter_batch_result_chunks(job_id, batch_id,
+                                                         chunksize):
+            chunks.append(chunk)
+        res = concat_chunks(chunks)
+        self.instrumentation.rows('bulk_query', len(res),
+                                  time.perf_counter() - started)
+        return res
+
+
+async def run_query_jobs(bulk, queries, max_concurrency=5, **kwargs):
+    """
+    Run many (object_name, soql) query jobs at once, at most max_concurrency
+    at a time. Each running job holds open Bulk API batches, so keep the cap
+    within what the org's bulk limits allow. queries may be a list, giving a
+    list of DataFrames, or a dict, giving a dict with the same keys.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(object_name, soql):
+        async with semaphore:
+            return await bulk.run_query(object_name, soql, **kwargs)
+
+    if isinstance(queries, dict):
+        keys = list(queries)
+        results = await asyncio.gather(
+            *[run_one(*queries[key]) for key in keys])
+        return dict(zip(keys, results))
+    return await asyncio.gather(*[run_one(*query) for query in queries])
+
+
+def run_bulk_queries(sessionId, host, queries, max_concurrency=5,
+                     instrumentation=None, **kwargs):
+    """
+    Blocking wrapper around run_query_jobs for callers without an event loop.
+    """
+    async def main():
+        async with AsyncSalesforceBulk(sessionId=sessionId, host=host,
+                                       pool_size=max_concurrency * 2,
+                                       instrumentation=instrumentation) as bulk:
+            return await run_query_jobs(bulk, queries, max_concurrency,
+                                        **kwargs)
+    return asyncio.run(main())
@@ -1,15 +1,24 @@
 import xml.etree.ElementTree as ET
 import io
-from httplib2 import Http
+import os
 import re
-import csv
-import pandas as pd
 import time
-from time import sleep
-from pandas import DataFrame
-import csv
-import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
 import bulk_states
+from bulk_transport import RequestsTransport, compress_body
+from bulk_metrics import NULL, endpoint_name
+from sf_records import drop_parent_placeholders
+from lazy_imports import lazy_module
+
+pd = lazy_module('pandas')
+
+# the body of a bulk query result with no rows, in place of a CSV header
+NO_RECORDS = b'Records not found for this query'
+# Bulk API operation names are case sensitive, keyed here by lower case
+BULK_OPERATIONS = {op.lower(): op for op in (
+    'insert', 'update', 'upsert', 'delete', 'hardDelete', 'query',
+    'queryAll')}
 
 class BulkApiError(Exception):
 
@@ -38,57 +47,55 @@ class BulkBatchFailed(BulkApiError):
                                                             state_message)
         super(BulkBatchFailed, self).__init__(message)
 
-class SalesforceBulk(object):
+
+class BulkJobTimeout(BulkApiError):
+
+    def __init__(self, job_ids, timeout):
+        self.job_ids = job_ids
+        self.timeout = timeout
+
+        message = 'Jobs {0} did not finish within {1} seconds'.format(
+            ', '.join(job_ids), timeout)
+        super(BulkJobTimeout, self).__init__(message)
+
+class BulkDocuments(object):
+    """
+    The request free part of a Bulk API 1.0 client: job and batch
+    bookkeeping, request headers, the job XML documents and error raising.
+    SalesforceBulk and AsyncSalesforceBulk add the requests on top.
+    """
+    jobNS = 'http://www.force.com/2009/06/asyncapi/dataload'
 
     def __init__(self, sessionId=None, host=None, API_version="39.0",
-                 exception_class=BulkApiError):
+                 exception_class=BulkApiError, instrumentation=None,
+                 compress=True):
         self.endpoint = "https://" + host + "/services/async/%s" % API_version
         self.sessionId = sessionId
-        self.jobNS = 'http://www.force.com/2009/06/asyncapi/dataload'
         self.jobs = {}  # dict of job_id => job_id
         self.batches = {}  # dict of batch_id => job_id
         self.batch_statuses = {}
+        self.pk_chunked_jobs = set()
         self.exception_class = exception_class
-        
+        # bulk_metrics sink for request, poll and throughput metrics
+        self.instrumentation = instrumentation or NULL
+        # gzip batch bodies on the way up, results come back gzipped anyway
+        self.compress = compress
+
     def headers(self, values={}):
         default = {"X-SFDC-Session": self.sessionId,
-                   "Content-Type": "application/xml; charset=UTF-8"}
+                   "Content-Type": "application/xml; charset=UTF-8",
+                   "Accept-Encoding": "gzip"}
         for k, val in values.items():
             default[k] = val
         return default
         
-    def create_job(self, object_name=None, operation=None, contentType='CSV',
-                   concurrency=None, external_id_name=None):
-        assert(object_name is not None)
-        assert(operation is not None)
-
-        doc = self.create_job_doc(object_name=object_name,
-                                  operation=operation,
-                                  contentType=contentType,
-                                  concurrency=concurrency,
-                                  external_id_name=external_id_name)
-
-        http = Http()
-        resp, content = http.request(self.endpoint + "/job",
-                                     "POST",
-                                     headers=self.headers(),
-                                     body=doc)
-
-        self.check_status(resp, content)
-
-        tree = ET.fromstring(content)
-        job_id = tree.findtext("{%s}id" % self.jobNS)
-        self.jobs[job_id] = job_id
-
-        return job_id
-    
-    def close_job(self, job_id):
-        doc = self.create_close_job_doc()
-        http = Http()
-        url = self.endpoint + "/job/%s" % job_id
-        resp, content = http.request(url, "POST", headers=self.headers(),
-                                     body=doc)
-        self.check_status(resp, content)
+    def pk_chunking_header(self, pk_chunking=True, parent=None):
+        options = []
+        if pk_chunking is not True:
+            options.append('chunkSize=%d' % int(pk_chunking))
+        if parent:
+            options.append('parent=%s' % parent)
+        return '; '.join(options) if options else 'TRUE'
     
     def create_job_doc(self, object_name=None, operation=None,
                        contentType='CSV', concurrency=None, external_id_name=None):
@@ -123,13 +130,183 @@ class SalesforceBulk(object):
         tree = ET.ElementTree(root)
         tree.write(buf, encoding="UTF-8")
         return buf.getvalue().decode('UTF-8')
+
+    def lookup_job_id(self, batch_id):
+        try:
+            return self.batches[batch_id]
+        except KeyError:
+            raise Exception(
+                "Batch id '%s' is unknown, can't retrieve job_id" % batch_id)
+
+    def raise_error(self, message, status_code=None):
+        if status_code:
+            message = "[{0}] {1}".format(status_code, message)
+
+        if self.exception_class == BulkApiError:
+            raise self.exception_class(message, status_code=status_code)
+        else:
+            raise self.exception_class(message)
+
+
+class SalesforceBulk(BulkDocuments):
+
+    def __init__(self, sessionId=None, host=None, API_version="39.0",
+                 exception_class=BulkApiError, transport=None, pool_size=10,
+                 max_retries=5, store=None, instrumentation=None,
+                 compress=True, session_refresher=None):
+        super(SalesforceBulk, self).__init__(
+            sessionId=sessionId, host=host, API_version=API_version,
+            exception_class=exception_class, instrumentation=instrumentation,
+            compress=compress)
+        # shared keep-alive connection pool used by every request
+        # session_refresher(stale_session_id) returns a new session id
+        # after Salesforce rejects this one
+        self.session_refresher = session_refresher
+        self.transport = transport or RequestsTransport(
+            pool_size=pool_size, max_retries=max_retries,
+            instrumentation=self.instrumentation,
+            session_refresher=self.refresh_session if session_refresher
+            else None)
+        # optional bulk_checkpoint.JobStore recording jobs for resuming
+        self.store = store
         
+    def refresh_session(self, stale_session_id):
+        self.sessionId = self.session_refresher(stale_session_id)
+        return self.sessionId
+
+    def create_job(self, object_name=None, operation=None, contentType='CSV',
+                   concurrency=None, external_id_name=None, pk_chunking=False,
+                   parent=None):
+        """
+        pk_chunking may be True to let Salesforce pick the chunk size or an
+        int chunk size. parent names the parent object when querying a
+        sharing or history table, e.g. AccountShare with parent Account.
+        """
+        assert(object_name is not None)
+        assert(operation is not None)
+
+        doc = self.create_job_doc(object_name=object_name,
+                                  operation=operation,
+                                  contentType=contentType,
+                                  concurrency=concurrency,
+                                  external_id_name=external_id_name)
+
+        extra_headers = {}
+        if pk_chunking:
+            extra_headers['Sforce-Enable-PKChunking'] = \
+                self.pk_chunking_header(pk_chunking, parent)
+
+        resp = self.transport.request("POST", self.endpoint + "/job",
+                                      headers=self.headers(extra_headers),
+                                      body=doc)
+
+        self.check_status(resp, resp.content)
+
+        tree = ET.fromstring(resp.content)
+        job_id = tree.findtext("{%s}id" % self.jobNS)
+        self.jobs[job_id] = job_id
+        if pk_chunking:
+            self.pk_chunked_jobs.add(job_id)
+        if self.store is not None:
+            self.store.record_job(job_id, object_name, operation,
+                                  pk_chunked=pk_chunking)
+
+        return job_id
+
+    def reattach(self, job_id):
+        """
+        Resume tracking a job created earlier, possibly by another process.
+        Raises BulkApiError if Salesforce no longer knows the job.
+        """
+        self.jobs[job_id] = job_id
+        if self.store is not None:
+            job = self.store.job(job_id)
+            if job is not None and job['pk_chunked']:
+                self.pk_chunked_jobs.add(job_id)
+        self.get_batch_list(job_id)
+        return job_id
+
+    def resumable_query_job(self, object_name, soqls, query_key,
+                            pk_chunking=False, parent=None,
+                            include_deleted=False):
+        """
+        Return the unfinished job the store recorded for query_key, posting
+        any of soqls it never received and closing it if needed, or create,
+        fill and close a new one. Requires a store.
+        """
+        job_id = self.store.find_job(query_key)
+        if job_id is not None:
+            try:
+                self.reattach(job_id)
+                dead = self.is_job_failed(job_id)
+            except BulkApiError:
+                dead = True
+            if dead:
+                self.store.finish_job(job_id)
+                job_id = None
+
+        if job_id is None:
+            job_id = self.create_query_job(object_name, contentType='CSV',
+                                           pk_chunking=pk_chunking,
+                                           parent=parent,
+                                           include_deleted=include_deleted)
+            self.store.set_query_key(job_id, query_key)
+
+        posted = set(b['soql'] for b in self.store.batches(job_id))
+        for soql in soqls:
+            if soql not in posted:
+                self.query(job_id, soql)
+        if not self.store.job(job_id)['closed']:
+            self.close_job(job_id)
+        return job_id
+
+    def job_status(self, job_id):
+        uri = self.endpoint + "/job/%s" % job_id
+        resp = self.transport.request("GET", uri, headers=self.headers())
+        self.check_status(resp, resp.content)
+
+        tree = ET.fromstring(resp.content)
+        return {child.tag.split('}')[-1]: child.text for child in tree}
+
+    def is_job_failed(self, job_id):
+        """
+        True if the job was aborted or failed, or one of its batches failed,
+        so it will never produce a complete result.
+        """
+        if self.job_status(job_id).get('state') in \
+                bulk_states.JOB_ERROR_STATES:
+            return True
+        return any(status['state'] == bulk_states.FAILED
+                   for status in self.get_batch_list(job_id))
+
+    def close_job(self, job_id):
+        doc = self.create_close_job_doc()
+        url = self.endpoint + "/job/%s" % job_id
+        # closing a closed job changes nothing, so it is safe to retry
+        resp = self.transport.request("POST", url, headers=self.headers(),
+                                      body=doc, idempotent=True)
+        self.check_status(resp, resp.content)
+        if self.store is not None:
+            self.store.close_job(job_id)
+    
     def is_batch_done(self, job_id, batch_id):
         batch_state = self.batch_state(job_id, batch_id, reload=True)
         if batch_state in bulk_states.ERROR_STATES:
             status = self.batch_status(job_id, batch_id)
             raise BulkBatchFailed(job_id, batch_id, status['stateMessage'])
         return batch_state == bulk_states.COMPLETED
+
+    def poller(self, **kwargs):
+        return BulkPoller(self, **kwargs)
+
+    def wait_for_batch(self, job_id, batch_id, timeout=None, **kwargs):
+        """
+        Block until a batch completes, polling with adaptive backoff. Raises
+        BulkBatchFailed if it fails and BulkJobTimeout after timeout seconds.
+        """
+        poller = self.poller(timeout=timeout, **kwargs)
+        poller.watch(job_id, [batch_id])
+        poller.run()
     
     def batch_status(self, job_id=None, batch_id=None, reload=False):
         if not reload and batch_id in self.batch_statuses:
@@ -137,24 +314,46 @@ class SalesforceBulk(object):
 
         job_id = job_id or self.lookup_job_id(batch_id)
 
-        http = Http()
         uri = self.endpoint + \
             "/job/%s/batch/%s" % (job_id, batch_id)
-        resp, content = http.request(uri, headers=self.headers())
-        self.check_status(resp, content)
+        resp = self.transport.request("GET", uri, headers=self.headers())
+        self.check_status(resp, resp.content)
 
-        tree = ET.fromstring(content)
+        tree = ET.fromstring(resp.content)
         result = {}
         for child in tree:
             result[re.sub("{.*?}", "", child.tag)] = child.text
 
         self.batch_statuses[batch_id] = result
         return result
+
+    def get_batch_list(self, job_id):
+        """
+        Return the status dicts of every batch in a job with a single
+        request. Also refreshes the cached batch statuses.
+        """
+        uri = self.endpoint + "/job/%s/batch" % job_id
+        resp = self.transport.request("GET", uri, headers=self.headers())
+        self.check_status(resp, resp.content)
+
+        tree = ET.fromstring(resp.content)
+        result = []
+        for info in tree.iter("{%s}batchInfo" % self.jobNS):
+            status = {}
+            for child in info:
+                status[child.tag.split('}')[-1]] = child.text
+            self.batches[status['id']] = job_id
+            self.batch_statuses[status['id']] = status
+            if self.store is not None:
+                self.store.record_batch(job_id, status['id'],
+                                        state=status.get('state'))
+            result.append(status)
+        return result
     
     def check_status(self, resp, content):
-        if resp.status >= 400:
+        if resp.status_code >= 400:
             msg = "Bulk API HTTP Error result: {0}".format(content)
-            self.raise_error(msg, resp.status)
+            self.raise_error(msg, resp.status_code)
 
     def batch_state(self, job_id, batch_id, reload=False):
         status = self.batch_status(job_id, batch_id, reload=reload)
@@ -164,74 +363,659 @@ class SalesforceBulk(object):
             return None
         
     # Register a new Bulk API job - returns the job id
-    def create_query_job(self, object_name, **kwargs):
-        return self.create_job(object_name, "query", **kwargs)
+    def create_query_job(self, object_name, include_deleted=False, **kwargs):
+        # queryAll also returns deleted and archived records
+        operation = "queryAll" if include_deleted else "query"
+        return self.create_job(object_name, operation, **kwargs)
     
     # Add a BulkQuery to the job - returns the batch id
-    def query(self, job_id, soql):
+    def query(self, job_id, soql, pk_chunking=False, parent=None):
         if job_id is None:
             job_id = self.create_job(
                 re.search(re.compile("from (\w+)", re.I), soql).group(1),
-                "query")
-        http = Http()
+                "query", pk_chunking=pk_chunking, parent=parent)
+        batch_id = self.post_batch(job_id, soql)
+        if self.store is not None:
+            self.store.record_batch(job_id, batch_id, soql)
+        return batch_id
+
+    # Add a batch of CSV data (or a query) to the job - returns the batch id
+    def post_batch(self, job_id, data):
         uri = self.endpoint + "/job/%s/batch" % job_id
         headers = self.headers({"Content-Type": "text/csv"})
-        resp, content = http.request(uri, method="POST", body=soql,
-                                     headers=headers)
+        if self.compress:
+            data, encoding = compress_body(data)
+            headers.update(encoding)
+        resp = self.transport.request("POST", uri, headers=headers,
+                                      body=data)
 
-        self.check_status(resp, content)
+        self.check_status(resp, resp.content)
 
-        tree = ET.fromstring(content)
+        tree = ET.fromstring(resp.content)
         batch_id = tree.findtext("{%s}id" % self.jobNS)
 
         self.batches[batch_id] = job_id
+        if self.store is not None:
+            self.store.record_batch(job_id, batch_id)
 
         return batch_id
     
+    def get_batch_results(self, job_id, batch_id):
+        """
+        Return the per-row results of a completed insert/update/upsert/delete
+        batch as a DataFrame with Id, Success, Created and Error columns, in
+        the order the rows were sent.
+        """
+        uri = self.endpoint + \
+            "/job/%s/batch/%s/result" % (job_id, batch_id)
+        resp = self.transport.request("GET", uri, headers=self.headers(),
+                                      stream=True)
+        if resp.status_code >= 400:
+            self.check_status(resp, resp.content)
+        resp.raw.decode_content = True
+        try:
+            return concat_chunks(read_result_csv(resp.raw))
+        finally:
+            self.instrumentation.count('request_bytes_received',
+                                       resp.raw.tell(),
+                                       endpoint=endpoint_name(uri))
+            resp.close()
+
+    def upload_frame(self, df, object_name, operation,
+                     external_id_name=None, concurrency='Parallel',
+                     max_workers=4, batch_size=10000, timeout=None,
+                     hangtime=0):
+        """
+        Upload a DataFrame as one bulk job. Rows are serialized to CSV
+        batches within the 10,000 record / 10MB limits as they are
+        submitted by max_workers threads, so only the batches in flight are
+        held as CSV (one at a time with hangtime seconds between them if
+        hangtime is set), and monitored together. Returns a DataFrame
+        on df's index with sf_id, sf_success, sf_created and sf_error
+        columns for every row.
+        """
+        started = time.perf_counter()
+        job_id = self.create_job(object_name, api_operation(operation),
+                                 concurrency=concurrency,
+                                 external_id_name=external_id_name)
+
+        def submit(batch):
+            start, stop, data = batch
+            return start, stop, self.post_batch(job_id, data)
+
+        batches = csv_batches(df, max_records=min(batch_size, 10000))
+        try:
+            if hangtime:
+                submitted = []
+                for batch in batches:
+                    submitted.append(submit(batch))
+                    time.sleep(hangtime)
+            else:
+                submitted = list(bounded_map(submit, batches, max_workers))
+        finally:
+            self.close_job(job_id)
+
+        failed = {}
+        poller = self.poller(timeout=timeout)
+        poller.watch(job_id, [batch_id for _, _, batch_id in submitted],
+                     on_error=lambda job_id, batch_id, status:
+                     failed.__setitem__(batch_id, status.get('stateMessage')))
+        poller.run()
+
+        def results(batch):
+            start, stop, batch_id = batch
+            index = df.index[start:stop]
+            if batch_id in failed:
+                return pd.DataFrame({'sf_id': '', 'sf_success': False,
+                                  'sf_created': False,
+                                  'sf_error': failed[batch_id]}, index=index)
+            res = self.get_batch_results(job_id, batch_id)
+            return pd.DataFrame({'sf_id': res['Id'].values,
+                              'sf_success': (res['Success'] == 'true').values,
+                              'sf_created': (res['Created'] == 'true').values,
+                              'sf_error': res['Error'].values}, index=index)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            frames = list(pool.map(results, submitted))
+        self.instrumentation.rows('bulk_' + operation.lower(), len(df),
+                                  time.perf_counter() - started)
+        if not frames:
+            return pd.DataFrame(columns=['sf_id', 'sf_success', 'sf_created',
+                                      'sf_error'], index=df.index)
+        return pd.concat(frames)
+
+    def get_batch_result_ids(self, job_id, batch_id):
+        """
+        Return the list of result ids for a completed batch. Large batches are
+        split by Salesforce into several result files.
+        """
+        uri = self.endpoint + \
+            "/job/%s/batch/%s/result" % (job_id, batch_id)
+        r = self.transport.request("GET", uri, headers=self.headers())
+        self.check_status(r, r.content)
+
+        tree = ET.fromstring(r.content)
+        return [el.text for el in tree.iter("{%s}result" % self.jobNS)]
+
+    def iter_batch_result_chunks(self, job_id, batch_id, chunksize=100000):
+        """
+        Yield DataFrames of at most chunksize rows covering every result file
+        of a batch. Each result is parsed straight off the HTTP stream so only
+        one chunk is held in memory at a time.
+        """
+        for result_id in self.get_batch_result_ids(job_id, batch_id):
+            uri = self.endpoint + \
+                "/job/%s/batch/%s/result/%s" % (job_id, batch_id, result_id)
+            download = self.transport.request("GET", uri,
+                                              headers=self.headers(),
+                                              stream=True)
+            if download.status_code >= 400:
+                self.check_status(download, download.content)
+            download.raw.decode_content = True
+            try:
+                for chunk in read_result_csv(download.raw, chunksize):
+                    yield chunk
+            finally:
+                self.instrumentation.count('request_bytes_received',
+                                           download.raw.tell(),
+                                           endpoint=endpoint_name(uri))
+                download.close()
+
+    def iter_job_result_chunks(self, job_id, chunksize=100000, max_workers=4,
+                               timeout=None, **poll_options):
+        """
+        Yield result DataFrames for every batch of a job, e.g. the batches
+        Salesforce creates for a PK chunked query. All batches are polled
+        with one batch list request and each batch is handed to a pool of
+        max_workers download threads once it completes. Chunks are yielded
+        as batches finish downloading, not in batch order. At most
+        max_workers batches are downloading or waiting to be yielded at a
+        time; completed batches beyond that queue up by id only, so a slow
+        consumer holds back downloads instead of buffering the whole job.
+        """
+        def download(batch_id):
+            return list(self.iter_batch_result_chunks(job_id, batch_id,
+                                                      chunksize))
+
+        started = time.perf_counter()
+        rows = 0
+        pending = set()
+        completed = deque()
+        polling = True
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            poller = self.poller(timeout=timeout, **poll_options)
+            poller.watch(job_id, on_complete=lambda job_id, batch_id, status:
+                         completed.append(batch_id))
+            while True:
+                delay = poller.step() if polling else None
+                polling = delay is not None
+                while completed and len(pending) < max_workers:
+                    pending.add(pool.submit(download, completed.popleft()))
+                if not polling and not pending:
+                    break
+                if not pending:
+                    time.sleep(delay)
+                    continue
+                done, pending = wait(pending, timeout=delay,
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    for chunk in future.result():
+                        rows += len(chunk)
+                        yield chunk
+        self.instrumentation.rows('bulk_query', rows,
+                                  time.perf_counter() - started)
+
+    def download_result_file(self, job_id, batch_id, result_id, path):
+        """
+        Save one result file to path as raw CSV. Progress is recorded in the
+        store as it downloads, and a partly written file is resumed with a
+        Range request; if the server ignores the range the file is written
+        again from the start.
+        """
+        offset, complete = 0, False
+        if self.store is not None:
+            offset, complete = self.store.result_progress(batch_id, result_id)
+        if not os.path.exists(path):
+            offset, complete = 0, False
+        if complete:
+            return path
+        offset = min(offset, os.path.getsize(path)) if offset else 0
+
+        uri = self.endpoint + \
+            "/job/%s/batch/%s/result/%s" % (job_id, batch_id, result_id)
+        # byte offsets only line up with the file on disk uncompressed
+        headers = self.headers({"Accept-Encoding": "identity"})
+        if offset:
+            headers["Range"] = "bytes=%d-" % offset
+        resp = self.transport.request("GET", uri, headers=headers,
+                                      stream=True)
+        try:
+            if resp.status_code == 416:
+                written = offset
+            else:
+                if resp.status_code >= 400:
+                    self.check_status(resp, resp.content)
+                if resp.status_code != 206:
+                    offset = 0
+                written = offset
+                with open(path, 'r+b' if offset else 'wb') as f:
+                    f.seek(offset)
+                    f.truncate()
+                    for data in resp.iter_content(1024 * 1024):
+                        f.write(data)
+                        written += len(data)
+                        self.instrumentation.count(
+                            'request_bytes_received', len(data),
+                            endpoint=endpoint_name(uri))
+                        if self.store is not None:
+                            f.flush()
+                            self.store.record_result(job_id, batch_id,
+                                                     result_id, path, written)
+        finally:
+            resp.close()
+        if self.store is not None:
+            self.store.record_result(job_id, batch_id, result_id, path,
+                                     written, complete=True)
+        return path
+
+    def download_job_results(self, job_id, directory, max_workers=4,
+                             timeout=None, **poll_options):
+        """
+        Save every result file of a job as CSV files in directory, starting
+        each batch's download as soon as it completes. With a store, files
+        already saved by an earlier run are skipped and partial ones
+        resumed, and a job with a failed batch is marked finished so it
+        isn't resumed again. Returns the file paths in batch order.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        def download(batch_id):
+            return [self.download_result_file(
+                        job_id, batch_id, result_id,
+                        os.path.join(directory, '%s_%s.csv' % (batch_id,
+                                                               result_id)))
+                    for result_id in self.get_batch_result_ids(job_id,
+                                                               batch_id)]
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            poller = self.poller(timeout=timeout, **poll_options)
+            poller.watch(job_id, on_complete=lambda job_id, batch_id, status:
+                         futures.append(pool.submit(download, batch_id)))
+            try:
+                poller.run()
+            except BulkBatchFailed:
+                if self.store is not None:
+                    self.store.finish_job(job_id)
+                raise
+            paths = [path for future in futures for path in future.result()]
+        return sorted(paths)
+
     def get_batch_result_iter(self, job_id, batch_id, parse_csv=False,
-                              logger=None):
+                              logger=None, chunksize=None):
         """
-        Return a line interator over the contents of a batch result document. If
-        csv=True then parses the first line as the csv header and the iterator
-        returns dicts.
+        Return the contents of all batch result documents as a DataFrame. If
+        chunksize is set, returns an iterator of DataFrames of at most
+        chunksize rows instead so memory stays flat on large extracts.
         """
         status = self.batch_status(job_id, batch_id)
         if status['state'] != 'Completed':
             return None
         elif logger:
             if 'numberRecordsProcessed' in status:
-                logger("Bulk batch %d processed %s records" %
+                logger("Bulk batch %s processed %s records" %
                        (batch_id, status['numberRecordsProcessed']))
             if 'numberRecordsFailed' in status:
                 failed = int(status['numberRecordsFailed'])
                 if failed > 0:
-                    logger("Bulk batch %d had %d failed records" %
+                    logger("Bulk batch %s had %d failed records" %
                            (batch_id, failed))
 
-        uri = self.endpoint + \
-            "/job/%s/batch/%s/result" % (job_id, batch_id)
-        r = requests.get(uri, headers=self.headers(), stream=True)
-        print(r.text)
-        
-        result_id = r.text.split("<result>")[1].split("</result>")[0]
+        chunks = count_rows(self.iter_batch_result_chunks(
+            job_id, batch_id, chunksize or 100000), self.instrumentation,
+            'bulk_query')
+        if chunksize:
+            return chunks
+        return concat_chunks(chunks)
 
-        uri = self.endpoint + \
-            "/job/%s/batch/%s/result/%s" % (job_id, batch_id, result_id)
-        download = requests.get(uri, headers=self.headers(), stream=True)
-        print('Downloaded Results')
-        
-        decoded_content = download.content.decode('utf-8')
-        print('Decoded Results')
-        
-        dictR = csv.DictReader(decoded_content.splitlines(), delimiter=',')
-        i = 0
-        items = {}
-        for row in dictR:
-            items[i] = row
-            i += 1
-            print('\rRow : %s' % i, end="")
-        print('\nCreated Dictionary')
-            
-        res = DataFrame.from_dict(items, orient='index')
-        print('Created Dataframe')
-        return res
\ No newline at end of file
+
+def count_rows(chunks, instrumentation, operation):
+    """
+    Pass chunks through, reporting the rows and rows/sec to instrumentation
+    once they run out.
+    """
+    started = time.perf_counter()
+    rows = 0
+    for chunk in chunks:
+        rows += len(chunk)
+        yield chunk
+    instrumentation.rows(operation, rows, time.perf_counter() - started)
+
+
+def read_result_csv(stream, chunksize=100000):
+    """
+    Incrementally parse a bulk result CSV from a file-like stream, yielding
+    DataFrames of at most chunksize rows. Values are kept as strings, blanks
+    as '', matching what the Bulk API returned. An empty query result, which
+    the Bulk API sends as NO_RECORDS instead of a CSV, yields nothing.
+    """
+    head = stream.read(len(NO_RECORDS))
+    if head == NO_RECORDS:
+        return
+    try:
+        reader = pd.read_csv(HeadStream(head, stream), chunksize=chunksize,
+                             dtype=str, keep_default_na=False,
+                             na_filter=False, encoding='utf-8')
+        for chunk in reader:
+            yield chunk
+    except pd.errors.EmptyDataError:
+        return
+
+
+class HeadStream(io.RawIOBase):
+    """
+    Reads head, bytes already taken off the front of stream, and then the
+    rest of stream, which is left open.
+    """
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.head[:len(buffer)]
+        self.head = self.head[len(data):]
+        if not data:
+            data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def csv_batches(df, max_records=10000, max_bytes=10000000, sample_rows=1000,
+                headroom=0.9):
+    """
+    Yield (start, stop, csv bytes) for consecutive row ranges of df, each
+    within the Bulk API limits of max_records rows and max_bytes per batch.
+    Ranges are sized from the CSV bytes per row of a sample, then of the
+    batch before, aiming at headroom * max_bytes, so each is normally
+    serialized once; one that still comes out too large is halved.
+    """
+    start = 0
+    if len(df):
+        sample = df.iloc[:sample_rows].to_csv(index=False).encode('utf-8')
+        row_bytes = len(sample) / min(sample_rows, len(df))
+    while start < len(df):
+        rows = max(1, int(max_bytes * headroom / row_bytes))
+        stop = min(start + max_records, start + rows, len(df))
+        while True:
+            data = df.iloc[start:stop].to_csv(index=False).encode('utf-8')
+            if len(data) <= max_bytes or stop - start == 1:
+                break
+            stop = start + (stop - start) // 2
+        yield start, stop, data
+        row_bytes = len(data) / (stop - start)
+        start = stop
+
+
+def api_operation(operation):
+    # the Bulk API spelling of an operation given in any case, e.g. HardDelete
+    return BULK_OPERATIONS.get(operation.lower(), operation)
+
+
+def bounded_map(function, items, max_workers):
+    """
+    Yield function(item) for each of items in order, run by max_workers
+    threads. Unlike pool.map, the next item is only taken once a result has
+    been handed on, so a generator of large items such as csv_batches is
+    never read more than max_workers items ahead.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(function, item))
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def concat_chunks(chunks):
+    frames = list(chunks)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_result_chunks(chunks, path, file_format=None):
+    """
+    Write an iterator of DataFrames to a single CSV or Parquet file, one chunk
+    at a time. The format is taken from the file extension unless given.
+    Parquet output requires pyarrow. The file gets every column of every
+    chunk: when a later chunk brings a new one, e.g. a sparse lookup first
+    populated on a later page, the rows already written are rewritten with
+    it, and a null lookup's placeholder column is dropped once its dotted
+    columns turn up. Returns the number of rows written.
+    """
+    if file_format is None:
+        file_format = 'parquet' if str(path).lower().endswith(
+            ('.parquet', '.pq')) else 'csv'
+    if file_format == 'csv':
+        return write_csv_chunks(chunks, path)
+    elif file_format == 'parquet':
+        return write_parquet_chunks(chunks, path)
+    raise ValueError("Unsupported file format: %s" % file_format)
+
+
+def result_columns(columns, new):
+    # the union of two column lists in order of appearance, less the
+    # placeholder columns of null lookups whose dotted columns exist
+    union = list(columns) + [c for c in new if c not in columns]
+    return list(drop_parent_placeholders(pd.DataFrame(columns=union)).columns)
+
+
+def write_csv_chunks(chunks, path):
+    rows = 0
+    columns = None
+    f = open(path, 'w', newline='', encoding='utf-8')
+    try:
+        for chunk in chunks:
+            widened = result_columns(columns or [], chunk.columns)
+            if columns is not None and widened != columns:
+                f.close()
+                rewrite_csv(path, widened)
+                f = open(path, 'a', newline='', encoding='utf-8')
+            chunk.reindex(columns=widened).to_csv(f, index=False,
+                                                  header=columns is None)
+            columns = widened
+            rows += len(chunk)
+    finally:
+        f.close()
+    return rows
+
+
+def rewrite_csv(path, columns):
+    # rewrites a CSV written so far with a new set of columns
+    tmp = path + '.tmp'
+    with open(path, 'rb') as src, \
+            open(tmp, 'w', newline='', encoding='utf-8') as dst:
+        pd.DataFrame(columns=columns).to_csv(dst, index=False)
+        for chunk in read_result_csv(src):
+            chunk.reindex(columns=columns).to_csv(dst, index=False,
+                                                  header=False)
+    os.replace(tmp, path)
+
+
+def write_parquet_chunks(chunks, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    def merged_schema(schema, table):
+        # columns that have held values keep their type, the others (null
+        # typed, or all missing so far) take the type of this chunk
+        fields = []
+        for field in table.schema:
+            if field.name in schema.names and (
+                    field.name in typed or
+                    table.column(field.name).null_count == len(table)):
+                fields.append(schema.field(field.name))
+            else:
+                fields.append(field)
+        return pa.schema(fields, metadata=table.schema.metadata)
+
+    def rewrite(source, target, schema):
+        # copies the rows written so far into a new file with schema
+        writer = pq.ParquetWriter(target, schema)
+        for batch in pq.ParquetFile(source).iter_batches():
+            old = pa.Table.from_batches([batch])
+            writer.write_table(pa.table(
+                [old.column(name) if name in old.column_names else
+                 pa.nulls(len(old), schema.field(name).type)
+                 for name in schema.names], names=schema.names).cast(schema))
+        return writer
+
+    rows = 0
+    columns = None
+    typed = set()  # columns with non-null values written
+    writer = None
+    current = path
+    try:
+        for chunk in chunks:
+            widened = result_columns(columns or [], chunk.columns)
+            table = pa.Table.from_pandas(chunk.reindex(columns=widened),
+                                         preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(current, table.schema)
+            else:
+                schema = merged_schema(writer.schema, table)
+                if widened != columns or not schema.equals(writer.schema):
+                    writer.close()
+                    target = path + '.tmp' if current == path else path
+                    writer = rewrite(current, target, schema)
+                    os.remove(current)
+                    current = target
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+            typed.update(name for name in table.column_names
+                         if table.column(name).null_count < len(table))
+            columns = widened
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+        if current != path:
+            os.replace(current, path)
+    return rows
+
+
+class BulkPoller(object):
+    """
+    Watches any number of bulk jobs and batches from one poll loop. Each job
+    is checked with a single batch list request. A job's poll interval
+    shrinks towards min_interval while numberRecordsProcessed is moving and
+    backs off exponentially towards max_interval while it is not.
+    on_complete(job_id, batch_id, status) fires as soon as a batch
+    completes, on_error the same way for failed batches; without on_error a
+    failed batch raises BulkBatchFailed.
+    """
+
+    def __init__(self, bulk, min_interval=1, max_interval=30, backoff=2,
+                 timeout=None):
+        self.bulk = bulk
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.started = None
+        self.watched = {}  # dict of job_id => watch state
+
+    def watch(self, job_id, batch_ids=None, on_complete=None, on_error=None):
+        """
+        Watch the given batches of a job, or every batch of the job if
+        batch_ids is None (including ones Salesforce adds for PK chunking).
+        """
+        self.watched[job_id] = {
+            'batch_ids': set(batch_ids) if batch_ids is not None else None,
+            'on_complete': on_complete,
+            'on_error': on_error,
+            'done': set(),
+            'processed': -1,
+            'interval': self.min_interval,
+            'next_poll': 0,
+        }
+
+    def step(self):
+        """
+        Poll every job that is due. Returns the seconds until the next poll
+        is due, or None once every watched batch has finished.
+        """
+        now = time.time()
+        if self.started is None:
+            self.started = now
+        if self.timeout is not None and now - self.started > self.timeout:
+            raise BulkJobTimeout(list(self.watched), self.timeout)
+
+        for job_id, job in list(self.watched.items()):
+            if job['next_poll'] <= now:
+                self.poll_job(job_id, job)
+
+        if not self.watched:
+            return None
+        next_poll = min(job['next_poll'] for job in self.watched.values())
+        return max(0, next_poll - time.time())
+
+    def run(self):
+        delay = self.step()
+        while delay is not None:
+            time.sleep(delay)
+            delay = self.step()
+
+    def poll_job(self, job_id, job):
+        finished = True
+        processed = 0
+        seen = set()
+        self.bulk.instrumentation.count('bulk_polls')
+        for status in self.bulk.get_batch_list(job_id):
+            batch_id = status['id']
+            if job['batch_ids'] is not None and \
+                    batch_id not in job['batch_ids']:
+                continue
+            seen.add(batch_id)
+            processed += int(status.get('numberRecordsProcessed') or 0)
+            if batch_id in job['done']:
+                continue
+
+            state = status['state']
+            if state == bulk_states.NOT_PROCESSED and \
+                    job_id in self.bulk.pk_chunked_jobs:
+                # the original batch of a PK chunked job
+                continue
+            if state in bulk_states.ERROR_STATES:
+                job['done'].add(batch_id)
+                if job['on_error'] is None:
+                    raise BulkBatchFailed(job_id, batch_id,
+                                          status.get('stateMessage'))
+                job['on_error'](job_id, batch_id, status)
+            elif state == bulk_states.COMPLETED:
+                job['done'].add(batch_id)
+                if job['on_complete'] is not None:
+                    job['on_complete'](job_id, batch_id, status)
+            else:
+                finished = False
+
+        if job['batch_ids'] is not None and job['batch_ids'] - seen:
+            finished = False
+        if finished:
+            del self.watched[job_id]
+            return
+
+        if processed > job['processed']:
+            job['interval'] = max(self.min_interval,
+                                  job['interval'] / self.backoff)
+        else:
+            job['interval'] = min(self.max_interval,
+                                  job['interval'] * self.backoff)
+        job['processed'] = processed
+        job['next_poll'] = time.time() + job['interval']
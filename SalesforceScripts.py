@@ -1,24 +1,144 @@
 # coding: utf-8 
-import numpy as np
-import pandas as pd
+import json
+import os
+import re
 import time
-from datetime import datetime, timedelta, date
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus
+from datetime import datetime, timedelta, date, timezone
 from time import sleep, gmtime, strftime
-from pandas import DataFrame, Series, read_csv
 
-from salesforce_bulk_api import SalesforceBulkJob
 from SalesforceBulkQuery import *
-from simple_salesforce import *
+from bulk2 import SalesforceBulk2, BulkJobFailed, RESULT_COLUMNS
+from sf_records import *
+from describe_cache import DescribeCache
+from bulk_checkpoint import JobStore
+from sf_sync import SyncCache, column, watermark, shift_watermark, upsert_frame
+from bulk_metrics import Instrumentation, CallbackInstrumentation, LoggingInstrumentation, PrometheusInstrumentation
+from sf_schema import format_frame, resolve_column_fields, apply_dtypes, api_column_names
+import sf_session
+from sf_session import LazySalesforce
+from sf_collections import upload_collections
+from lazy_imports import lazy_module
+from prefetch import Prefetch
+
+# imported on first use, so importing this module stays fast
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+simple_salesforce = lazy_module('simple_salesforce')
 
 ###################################################################################################
 
 # Salesforce Credentials
 
-# Creates SimpleSalesforce Login Instance
-sf = Salesforce(username='', password='', security_token='', sandbox=, client_id='')
+# SimpleSalesforce Login Instance, logs in the first time it is used
+# Credentials come from SFConfigure() or SF_USERNAME, SF_PASSWORD, SF_SECURITY_TOKEN, SF_SANDBOX (or SF_DOMAIN) and SF_CLIENT_ID,
+# and the session is reused from ~/.cache/salesforcetools/sessions.json until it expires
+sf = LazySalesforce()
+
+# Caches SObject describes in memory and under ~/.cache/salesforcetools for a day
+# describeCache.invalidate(sf, 'Account') forces a fresh describe after metadata changes
+describeCache = DescribeCache()
+
+# Parquet copies of SFSync results under ~/.cache/salesforcetools/sync
+syncCache = SyncCache()
+
+# Metrics sink for api requests, polls and rows/sec, quiet until setInstrumentation is called
+instrumentation = Instrumentation()
 
 ###################################################################################################
 
+# names this module used to star import, still reachable as SalesforceScripts.<name> but loaded on first use
+legacyNames = {
+    'DataFrame': pd, 'Series': pd, 'read_csv': pd,
+    'Salesforce': simple_salesforce, 'SalesforceLogin': simple_salesforce, 'SFType': simple_salesforce,
+    'SalesforceError': simple_salesforce, 'SalesforceAuthenticationFailed': simple_salesforce,
+    'SalesforceExpiredSession': simple_salesforce, 'SalesforceGeneralError': simple_salesforce,
+    'SalesforceMalformedRequest': simple_salesforce, 'SalesforceMoreThanOneRecord': simple_salesforce,
+    'SalesforceRefusedRequest': simple_salesforce, 'SalesforceResourceNotFound': simple_salesforce,
+    'format_soql': simple_salesforce, 'format_external_id': simple_salesforce,
+}
+
+def __getattr__(name):
+    if name in legacyNames:
+        return getattr(legacyNames[name], name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def SFConfigure(Username=None, Password=None, SecurityToken=None, Sandbox=None, Domain=None, ClientId=None, SessionId=None,
+                Instance=None, Client=None, SessionCache=True):
+    """
+        Description: Sets the login sf uses. Nothing connects until the next query, and unset values fall back to the SF_* environment variables.
+        Parameters:
+            Username, Password, SecurityToken, ClientId = Username and password login
+            Sandbox       = True logs in to test.salesforce.com
+            Domain        = Login domain such as 'test' or a my domain, instead of Sandbox
+            SessionId     = An existing session id, used with Instance ('na1.salesforce.com') instead of a username login
+            Client        = An existing simple_salesforce.Salesforce login to use as is
+            SessionCache  = True reuses username logins across runs from ~/.cache/salesforcetools/sessions.json, False logs in every run
+    """
+    global sf
+    if not isinstance(sf, LazySalesforce):
+        sf = LazySalesforce()
+    sf.configure(client=Client, session_cache=sf_session.SessionCache() if SessionCache else False,
+                 username=Username, password=Password,
+                 security_token=SecurityToken, sandbox=Sandbox, domain=Domain, client_id=ClientId,
+                 session_id=SessionId, instance=Instance)
+
+
+def setInstrumentation(Sink=None):
+    """
+        Description: Sends request latency, bytes, api usage, poll counts and rows/sec from the bulk api client and the rest queries to Sink.
+        Parameters:
+            Sink = A bulk_metrics sink: LoggingInstrumentation(), CallbackInstrumentation(function), PrometheusInstrumentation() or your own Instrumentation subclass.  None turns metrics off again.
+    """
+    global instrumentation
+    instrumentation = Sink or Instrumentation()
+    instrumentSession()
+
+
+def restResponseHook(resp, *args, **kwargs):
+    # reports each simple_salesforce request to the current instrumentation
+    body = resp.request.body or b''
+    instrumentation.request(resp.request.method, resp.url, resp.status_code, resp.elapsed.total_seconds(),
+                            len(body.encode('utf-8') if isinstance(body, str) else body), len(resp.content or b''),
+                            resp.headers.get('Sforce-Limit-Info'))
+
+
+def instrumentSession():
+    # hooks the rest api session of sf once, so a replaced login is picked up on its next query
+    # a lazy login shares one requests session across logins, so hooking it doesn't connect
+    session = sf.http_session() if isinstance(sf, LazySalesforce) and sf.client_override is None else sf.session
+    hooks = session.hooks['response']
+    if restResponseHook not in hooks:
+        hooks.append(restResponseHook)
+
+
+def bulkClient(**kwargs):
+    # a bulk api client on the current login that reports to instrumentation
+    if isinstance(sf, LazySalesforce) and sf.can_refresh():
+        # a bulk session rejected mid job logs in again instead of failing the job
+        kwargs.setdefault('session_refresher', sf.refresh_session_id)
+    return SalesforceBulk(sessionId=sf.session_id, host=sf.sf_instance, instrumentation=instrumentation, **kwargs)
+
+
+def bulk2Client(**kwargs):
+    # a bulk api 2.0 client on the current login and api version that reports to instrumentation
+    if isinstance(sf, LazySalesforce) and sf.can_refresh():
+        kwargs.setdefault('session_refresher', sf.refresh_session_id)
+    return SalesforceBulk2(sessionId=sf.session_id, host=sf.sf_instance, API_version=sf.sf_version,
+                           instrumentation=instrumentation, **kwargs)
+
+
+def bulkEngine(Engine):
+    # checks an Engine parameter, '1.0' or '2.0'
+    Engine = str(Engine)
+    if Engine not in ('1.0', '2.0'):
+        raise ValueError("Engine must be '1.0' or '2.0', not %r" % Engine)
+    return Engine
+
+
 def getBlankDF():
     return pd.DataFrame(np.nan, index=[], columns=[])
 
@@ -37,17 +157,247 @@ def SFNulls(df, FillWith='#N/A'):
         Description: Fills 0's and NAN's with "#N/A" which is the value that the Salesforce Bulk API recognizes as Null.
         Parameters:
             df = Pandas.DataFrame
-        Recognizes 'float64', 'int64', and 'int32' data types.
+        Recognizes 'float64', 'int64', and 'int32' data types.  Checkbox columns keep False.
     """
-    df.apply(lambda s: pd.to_numeric(s, errors='ignore'))
-    NumCol = df.columns.values.tolist()
-    for col in NumCol:
-        df[col] = df[col].replace(0, np.NAN).fillna('%s' % FillWith)
+    # checkbox columns keep False, which compares equal to 0
+    zeros = df.eq(0)
+    for col in zeros.columns[zeros.any()]:
+        if pd.api.types.is_bool_dtype(df[col]):
+            zeros[col] = False
+        elif df[col].dtype == object:
+            zeros[col] &= ~df[col].map(lambda v: isinstance(v, (bool, np.bool_)))
+    nulls = df.isna() | zeros
+    for col in nulls.columns[nulls.any()]:
+        df[col] = df[col].astype(object).where(~nulls[col], '%s' % FillWith)
+
+
+def soqlObject(SOQL: str):
+    # the object in the outer FROM clause, ignoring any subqueries
+    outer = SOQL
+    while True:
+        stripped = re.sub(r"\([^()]*\)", "", outer)
+        if stripped == outer:
+            break
+        outer = stripped
+    match = re.search(r"\bfrom\s+(\w+)", outer, re.I)
+    return match.group(1) if match else None
+
+
+def maskSOQL(SOQL: str):
+    # blanks out quoted strings and anything in parentheses without moving the rest, so outer clauses can be found by position
+    out = []
+    depth = 0
+    quoted = escaped = False
+    for ch in SOQL:
+        if quoted:
+            out.append(' ')
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == "'":
+                quoted = False
+        elif ch == "'":
+            quoted = True
+            out.append(' ')
+        elif ch in '()':
+            depth += 1 if ch == '(' else -1
+            out.append(' ')
+        else:
+            out.append(' ' if depth else ch)
+    return ''.join(out)
+
+
+def soqlFields(SOQL: str):
+    # the items of the outer select list as written, subqueries included
+    masked = maskSOQL(SOQL)
+    select = re.search(r"^\s*select\b(.*?)\bfrom\b", masked, re.I | re.S)
+    start, end = select.span(1)
+    fields = []
+    last = start
+    for i in range(start, end + 1):
+        if i == end or masked[i] == ',':
+            if SOQL[last:i].strip():
+                fields.append(SOQL[last:i].strip())
+            last = i + 1
+    return fields
+
+
+def addSOQLFields(SOQL: str, Fields):
+    # appends the Fields not already in the outer select list
+    present = set(f.lower() for f in soqlFields(SOQL))
+    missing = [f for f in Fields if f.lower() not in present]
+    if not missing:
+        return SOQL
+    end = re.search(r"^\s*select\b(.*?)\bfrom\b", maskSOQL(SOQL), re.I | re.S).end(1)
+    return SOQL[:end].rstrip() + ", " + ", ".join(missing) + " " + SOQL[end:]
+
+
+def soqlWhereSpan(SOQL: str):
+    # (has a where clause, start, end) of the outer WHERE condition, or of where one would go ahead of any ORDER BY, LIMIT etc.
+    masked = maskSOQL(SOQL)
+    where = re.search(r"\bwhere\b", masked, re.I)
+    if where:
+        start = where.end()
+    else:
+        start = re.search(r"\bfrom\s+\w+(\s+using\s+scope\s+\w+)?", masked, re.I).end()
+    clause = re.search(r"\b(with|group\s+by|order\s+by|limit|offset|for\s+(view|reference|update)|update\s+(tracking|viewstat)|all\s+rows)\b", masked[start:], re.I)
+    end = start + clause.start() if clause else len(SOQL)
+    return bool(where), start, end
+
+
+def addSOQLFilter(SOQL: str, Condition: str):
+    # ANDs Condition into the outer WHERE clause, or adds one, ahead of any ORDER BY, LIMIT etc.
+    # SOQL('Select Id From Account Where A = 1 Or B = 2 Limit 5', 'C = 3') -> Select Id From Account Where (A = 1 Or B = 2) AND (C = 3) Limit 5
+    where, start, end = soqlWhereSpan(SOQL)
+    if where:
+        filterStr = " (%s) AND (%s) " % (SOQL[start:end].strip(), Condition)
+    else:
+        filterStr = " WHERE %s " % Condition
+    return (SOQL[:start].rstrip() + filterStr + SOQL[end:].lstrip()).rstrip()
+
+
+# Salesforce Ids sort in the order of these digits, so their first 15 characters read as base 62 numbers keep their order
+ID_DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+UNSHARDABLE = re.compile(r"\b(group\s+by|order\s+by|limit|offset|for\s+(view|reference|update)|update\s+(tracking|viewstat))\b", re.I)
+AGGREGATE = re.compile(r"^(count|count_distinct|sum|avg|min|max)\s*\(", re.I)
+
+
+def idNumber(Id: str):
+    number = 0
+    for ch in Id[:15]:
+        number = number * 62 + ID_DIGITS.index(ch)
+    return number
+
+
+def numberId(Number: int):
+    digits = ''
+    for _ in range(15):
+        Number, digit = divmod(Number, 62)
+        digits = ID_DIGITS[digit] + digits
+    return digits
+
+
+def splitRange(Low: int, High: int, Parts: int):
+    # the points that cut Low..High into Parts even ranges, fewer if the range is too narrow
+    return sorted(set(Low + (High - Low) * k // Parts for k in range(1, Parts)) - {Low})
+
+
+def shardSOQL(SOQL: str, Shards: int, ShardBy='Id'):
+    # splits SOQL into up to Shards queries over consecutive ranges of ShardBy, found by probing its lowest and highest value
+    # returns None when the query has to run as one: LIMIT, OFFSET, ORDER BY, GROUP BY, aggregates, or too few records to split
+    SObject = soqlObject(SOQL)
+    masked = maskSOQL(SOQL)
+    if not Shards or Shards < 2 or SObject is None or UNSHARDABLE.search(masked) or \
+            any(AGGREGATE.match(field) for field in soqlFields(SOQL)):
+        return None
+
+    where, start, end = soqlWhereSpan(SOQL)
+    scope = re.search(r"\bfrom\s+\w+(\s+using\s+scope\s+\w+)?", masked, re.I)
+    probe = "SELECT %s %s" % (ShardBy, SOQL[scope.start():scope.end()])
+    if where:
+        probe = addSOQLFilter(probe, SOQL[start:end].strip())
+    low = sf.query("%s ORDER BY %s ASC NULLS LAST LIMIT 1" % (probe, ShardBy))['records']
+    high = sf.query("%s ORDER BY %s DESC NULLS LAST LIMIT 1" % (probe, ShardBy))['records']
+    value = lambda records: next((v for k, v in records[0].items() if k.lower() == ShardBy.lower()), None)
+    if not low or value(low) is None:
+        return None
+    low, high = value(low), value(high)
+
+    if ShardBy.lower() == 'id':
+        bounds = ["'%s'" % numberId(b) for b in splitRange(idNumber(low), idNumber(high), Shards)]
+        nulls = ""
+    else:
+        # datetime fields, ex: CreatedDate.  Rows with no value go in the last shard
+        seconds = [int(datetime.strptime(v, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()) for v in (low, high)]
+        bounds = [datetime.fromtimestamp(b, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ') for b in splitRange(seconds[0], seconds[1] + 1, Shards)]
+        nulls = " OR %s = null" % ShardBy
+    if not bounds:
+        return None
+
+    # the outer shards are open ended so records added since the probe are not missed
+    conditions = ["%s < %s" % (ShardBy, bounds[0])]
+    conditions += ["%s >= %s AND %s < %s" % (ShardBy, lo, ShardBy, hi) for lo, hi in zip(bounds, bounds[1:])]
+    conditions.append("%s >= %s%s" % (ShardBy, bounds[-1], nulls))
+    return [addSOQLFilter(SOQL, condition) for condition in conditions]
+
+
+def orderedMap(Function, Items, Workers):
+    # Function over Items Workers at a time, yielding the results in the order of Items with at most Workers held at once
+    with ThreadPoolExecutor(max_workers=Workers) as pool:
+        pending = deque()
+        for item in Items:
+            pending.append(pool.submit(Function, item))
+            if len(pending) >= Workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def shiftIndex(df, Offset):
+    # moves the row numbers (or record numbers of a multi index) of a query result along by Offset
+    if isinstance(df.index, pd.MultiIndex):
+        df.index = df.index.set_levels(df.index.levels[0] + Offset, level=0)
+    else:
+        df.index = df.index + Offset
+    return df
+
+
+def schemaDtypes(df, SObject):
+    # converts query result columns to compact dtypes using the describe of SObject and its parents, columns that don't match a field fall back to numeric conversion
+    try:
+        fields = resolve_column_fields(df.columns, SObject, lambda name: describeCache.field_index(sf, name))
+    except Exception:
+        fields = {}
+    apply_dtypes(df, fields)
+    return to_numeric_columns(df, [col for col in df.columns if col not in fields])
 
 
-def SFQuery(SOQL: str, InList=None, LowerHeaders=True, CheckParentChild=True, KeepAttributes=False):
+def apiColumns(df, SObject):
+    # renames query result columns to the api names of their fields, bulk results keep the case of the SOQL while REST results use api names
+    try:
+        names = api_column_names(df.columns, SObject, lambda name: describeCache.field_index(sf, name))
+    except Exception:
+        names = {}
+    return df.rename(columns=names)
+
+
+def queryPages(SOQL: str, IncludeDeleted=False):
+    # the records of each page of a REST query, the next page fetched on a background thread while the caller works on this one
+    instrumentSession()
+    return Prefetch(fetchPages(SOQL, IncludeDeleted))
+
+
+def fetchPages(SOQL, IncludeDeleted):
+    # yields the records of each page, following nextRecordsUrl
+    res = sf.query(SOQL, include_deleted=IncludeDeleted)
+    while True:
+        yield res['records']
+        if res.get('done', True) or not res.get('nextRecordsUrl'):
+            break
+        res = sf.query_more(res['nextRecordsUrl'].rsplit('/', 1)[-1], include_deleted=IncludeDeleted)
+
+
+def pageFrames(SOQL: str, LowerHeaders=True, CheckParentChild=True, KeepAttributes=False, MultiIndexChildren=False, IncludeDeleted=False):
+    # flattens each page of a REST query into a dataframe as it arrives
+    start = 0
+    for records in queryPages(SOQL, IncludeDeleted):
+        if CheckParentChild == True:
+            res = records_to_frame(records, KeepAttributes, MultiIndexChildren, start=start)
+        else:
+            res = pd.DataFrame([dict(r) for r in records], index=pd.RangeIndex(start, start + len(records)))
+            if KeepAttributes == False and 'attributes' in res.columns:
+                res = res.drop(['attributes'], axis=1)
+        if LowerHeaders == True:
+            res.columns = map(str.lower, res.columns)
+        start += len(records)
+        yield res
+
+
+def SFQuery(SOQL: str, InList=None, LowerHeaders=True, CheckParentChild=True, KeepAttributes=False, MultiIndexChildren=False, ChunkSize=None, Sink=None, SinkFormat=None, Workers=4, MaxQueryLength=16000, BulkThreshold=50000, SchemaTypes=True,
+            Shards=None, ShardBy='Id'):
     """
-        Description: Queries Salesforce returning all results in a pandas dataframe.  This also sets all possible data types to numbers and sets column headers to lower case. If using InList, this functionality is built with pandas dataframe columns in mind to help simplify filtering from other SOQL results.
+        Description: Queries Salesforce returning all results in a pandas dataframe.  This also sets data types from the object's field types and sets column headers to lower case. If using InList, this functionality is built with pandas dataframe columns in mind to help simplify filtering from other SOQL results.
         Parameters:
             SOQL = Salesforce SOQL Statement
             InList* = List of items for an "IN" filter. Apex SOQL - "SELECT Id, Name FROM Account Where Id IN :ids"
@@ -57,245 +407,436 @@ def SFQuery(SOQL: str, InList=None, LowerHeaders=True, CheckParentChild=True, Ke
                 I usually use this with a dataframe column.  
                 ex: "SFQuery("Select Id, Name From Contact Where Id In", InList=list(your_dataframe['column_name']))
             LowerHeader = Returns Dataframe with column headers lowercase, defaulted true for previous projects
-            CheckParentChild = This checks for the relationships by looking for the ordered dictionaries returned by Salesforce.  It loops through to ensure reached the end of the line if stepping through multiple parent relationships.  Turn off if queries need to run slighly faster.
+            CheckParentChild = Flattens relationship fields returned by Salesforce into dotted columns named by the relationship path, ex: Account.Owner.Name, in a single pass over the records.  Child relationship subqueries are returned as a dictionary of child records in their column.  Turn off to keep the raw ordered dictionaries.
+            KeepAttributes = Keeps the attributes (type and url) Salesforce returns with each record
+            MultiIndexChildren = Returns child relationship subqueries as extra rows instead, with a (record, child) multi index.  Parent columns repeat on every child row.
+            ChunkSize = If set, returns an iterator of dataframes of ChunkSize rows instead of one dataframe.  Pages are fetched on a background thread at most two ahead of the reader, so memory stays flat and work can start on the first rows before the query finishes.
+            Sink = File path to write the results to instead of returning them.  Written page by page, returns the number of rows written.  ChunkSize and Sink are not used with InList.
+            SinkFormat = 'csv' or 'parquet', defaults to the Sink file extension.  Parquet requires pyarrow.
+            Workers = Number of InList sub-queries or Shards run at the same time
+            MaxQueryLength = Longest url encoded query sent through the rest api when packing InList values, defaults to 16,000 to stay under the 16,384 character uri limit
+            SchemaTypes = Sets column types from the describe of the queried object: picklists and lookups become categories, checkboxes booleans, dates and datetimes datetime64, numbers Int64 or float by scale.  If false tries to convert every column to numbers instead.
+            BulkThreshold = InList sizes above this many unique values run through the bulk api instead, packed into queries of up to 100,000 characters.  Set to None to always use the rest api.
+            Shards = Splits the query into this many queries over ranges of ShardBy and runs them Workers at a time, for large rest extracts.  Two LIMIT 1 queries find the lowest and highest value first.
+                     Results are joined back in range order.  Each running shard reads at most a couple of pages ahead, so with ChunkSize or Sink memory stays at a few pages per worker.  Queries with LIMIT, OFFSET, ORDER BY, GROUP BY or aggregates, run as one query.  Not used with InList.
+            ShardBy = 'Id' splits by record Id, 'CreatedDate' by creation time.  Id ranges are even when Ids are, CreatedDate suits objects loaded in bursts.
             
-            InList* - This is not an efficent use of api calls.  There are limitations to the length of the queries so this is capped out at a default of 300 elements.  Nested Select statements in the where clause is a more efficent use for api calls but there are always tradeoffs.  At some point it would make more sense to utilize tuples, but unfortunately salesforce did not like the format with the last comma.
+            InList* - This is not an efficent use of api calls.  The list is packed into as few queries as fit under MaxQueryLength and those queries run Workers at a time.  Nested Select statements in the where clause is a more efficent use for api calls but there are always tradeoffs.  Bulk queries do not support child relationship subqueries.
     """
+    SObject = soqlObject(SOQL)
+    def typeColumns(res):
+        if SchemaTypes and SObject is not None:
+            return schemaDtypes(res, SObject)
+        return to_numeric_columns(res)
     def basicSOQL(SOQLstr : str):
         # formats the Salesforce ordered dictionary into a pandas dataframe
+        return joinFrames(pageFrames(SOQLstr, LowerHeaders, CheckParentChild, KeepAttributes, MultiIndexChildren))
+    def joinFrames(frames):
+        # one typed dataframe from the pages of a query, None if it returned nothing
+        frames = list(frames)
+        if not frames:
+            return None
         try:
-            od = sf.query_all("%s" % SOQLstr)
-            items = {val: dict(od['records'][val]) for val in range(len(od['records'])) } 
-            res = DataFrame.from_dict(items, orient='index')
-            if LowerHeaders == True:
-                res.columns = map(str.lower, res.columns)
-            return res.apply(lambda s: pd.to_numeric(s, errors='ignore'))
+            res = pd.concat(frames) if len(frames) > 1 else frames[0]
+            return typeColumns(drop_parent_placeholders(res))
         except ValueError:
             pass
+    def chunkedSOQL(SOQLstr : str):
+        # typed dataframes of ChunkSize rows, fetched a page ahead
+        return chunkedFrames(pageFrames(SOQLstr, LowerHeaders, CheckParentChild, KeepAttributes, MultiIndexChildren))
+    def chunkedFrames(frames):
+        for chunk in rechunk_frames(frames, ChunkSize or 2000):
+            yield typeColumns(drop_parent_placeholders(chunk.copy()))
+    def shardedFrames(statements):
+        # the pages of every shard numbered as one result in shard order, Workers shards fetched at a time a page or so ahead of the reader
+        offset = 0
+        pending = deque()
+        try:
+            for statement in statements:
+                pending.append(Prefetch(pageFrames(statement, LowerHeaders, CheckParentChild, KeepAttributes, MultiIndexChildren)))
+                if len(pending) >= Workers:
+                    offset = yield from shardFrames(pending.popleft(), offset)
+            while pending:
+                offset = yield from shardFrames(pending.popleft(), offset)
+        finally:
+            for shard in pending:
+                shard.close()
+    def shardFrames(frames, offset):
+        # the pages of one shard numbered on from offset, returns the offset of the next shard
+        count = 0
+        for frame in frames:
+            if len(frame):
+                yield shiftIndex(frame, offset)
+            count += frame.index.get_level_values(0).nunique() if MultiIndexChildren else len(frame)
+        return offset + count
     def CreateFilterStr(ListToStr):
         # creates a string from a list 
         # ['id1', 'id2', 'id3', 'id4', 'id5'] -> ('id1', 'id2', 'id3', 'id4', 'id5')
-        resStr = "("
-        r = 0
-        for rl in ListToStr:
-            if rl is not None:
-                if r == 0:
-                    resStr += "'"+str(rl)+"'"
-                    r = 1
-                elif r == 1:
-                    resStr += ",'"+str(rl)+"'"
-        resStr += ")"
-        return resStr
-    def BatchQueryList(toBatchList):
-        # filters the list of duplicates then batches the lists in groups
+        return "(" + ",".join(ListToStr) + ")"
+    def QuoteValue(value):
+        return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+    def BatchQueryList(toBatchList, maxLength, encoded=True):
+        # filters the list of duplicates then packs as many values into each query as fit under maxLength
         # [('id1', 'id2', 'id3', id4', 'id5'),('id6', 'id7', 'id8', 'id9', 'id10')]
-        batchSize = 300
-        newList = list(set(toBatchList))
-        listSize = len(newList)
-        startPoint = 0
-        endPoint = batchSize
+        measure = (lambda x: len(quote_plus(x))) if encoded else len
+        newList = [QuoteValue(v) for v in dict.fromkeys(toBatchList) if v is not None]
+        baseLength = measure("%s ()" % SOQL)
         res = []
-        while startPoint < listSize:
-            tempStr = CreateFilterStr(newList[startPoint:endPoint])
-            res.append([tempStr])
-            startPoint = endPoint
-            endPoint += batchSize
+        batch = []
+        length = baseLength
+        for value in newList:
+            valueLength = measure(value) + (measure(",") if batch else 0)
+            if batch and length + valueLength > maxLength:
+                res.append([CreateFilterStr(batch)])
+                batch = []
+                valueLength = measure(value)
+                length = baseLength
+            batch.append(value)
+            length += valueLength
+        if batch:
+            res.append([CreateFilterStr(batch)])
         return res
     def InListQuery(SOQL, InList):
-        # runs a query for each list from the batched lists and stacks the results
-        filterLists = BatchQueryList(InList)
-
-        resDF = None
-        i = 0
-        for i in range(0,len(filterLists)):
-            tempDF = basicSOQL(SOQLstr = "%s %s" % (SOQL, filterLists[i][0]))
-            try: resDF = resDF.append(tempDF, ignore_index=True)
-            except AttributeError: resDF = tempDF
-            i += 1
-        return resDF
-    def getChildRecords(obj, row):
-        if row == None:
+        # runs the batched queries Workers at a time and stacks the results once at the end
+        filterLists = BatchQueryList(InList, MaxQueryLength)
+        with ThreadPoolExecutor(max_workers=Workers) as pool:
+            frames = list(pool.map(lambda f: basicSOQL(SOQLstr = "%s %s" % (SOQL, f[0])), filterLists))
+        frames = [f for f in frames if f is not None]
+        if not frames:
             return None
+        if MultiIndexChildren:
+            # each sub-query numbers its records from 0, move them along so (record, child) stays unique
+            offset = 0
+            for frame in frames:
+                shiftIndex(frame, offset)
+                offset += frame.index.get_level_values(0).nunique()
+        return pd.concat(frames, ignore_index=not MultiIndexChildren)
+    def BulkInListQuery(SOQL, InList):
+        # packs the list into bulk sized queries, each run as a batch of one bulk job
+        filterLists = BatchQueryList(InList, 100000, encoded=False)
+        res = SFBulkQuery(SObject, ["%s %s" % (SOQL, f[0]) for f in filterLists], Workers=Workers, SchemaTypes=SchemaTypes)
+        if LowerHeaders == True:
+            res.columns = map(str.lower, res.columns)
+        if SchemaTypes:
+            return res
+        return to_numeric_columns(res.mask(res == ''))
 
-        size = row.get('totalSize')
-        records = row.get('records')
-        tempDic = {}
-
-        for i in range(0,size):
-            tempDic[i] = {}
-            for field in records[i].keys():
-                try:
-                    records[i].get(field).keys()
-                    continue
-                except AttributeError:
-                    pass
-                tempDic[i][obj + '.' + field] = records[i].get(field)
-        return tempDic
-    def getParentRecords(field, row):
-        if row == None:
-            return None
-        else:
-            return row.get(field)
-    
+    if InList is not None and (ChunkSize or Sink is not None or Shards):
+        raise ValueError("ChunkSize, Sink and Shards do not apply to InList queries")
     rs = None
-    if InList == None:
+    started = time.perf_counter()
+    shards = shardSOQL(SOQL, Shards, ShardBy) if InList == None and Shards else None
+    if shards and Sink is not None:
+        return write_result_chunks(count_rows(chunkedFrames(shardedFrames(shards)), instrumentation, 'sfquery'), Sink, SinkFormat)
+    elif shards and ChunkSize:
+        return count_rows(chunkedFrames(shardedFrames(shards)), instrumentation, 'sfquery')
+    elif shards:
+        rs = joinFrames(shardedFrames(shards))
+    elif InList == None and Sink is not None:
+        return write_result_chunks(count_rows(chunkedSOQL(SOQL), instrumentation, 'sfquery'), Sink, SinkFormat)
+    elif InList == None and ChunkSize:
+        return count_rows(chunkedSOQL(SOQL), instrumentation, 'sfquery')
+    elif InList == None:
         rs = basicSOQL(SOQL)
     else:
         InList = list(InList)
-        rs = InListQuery(SOQL, InList)
-    
-    # Drops the attributes column passed through by Salesforce
-    if CheckParentChild == False and KeepAttributes == False:
-        rs = rs.drop(['attributes'], axis=1)
-        
-    while CheckParentChild:
-        CheckParentChild = False
-
-        indexCols = []
-        for col in rs:
-            obj = None
-            relationship = None
-            for i in range(len(rs[col])):
-                # scans down each column until finding an ordered dict to parse
-                if rs[col][i] == None:
-                    continue
-                try:
-                    if rs[col][i].get('type') != None and col == 'attributes':
-                        if KeepAttributes == False:
-                            rs = rs.drop([col], axis=1)
-                        break
-                except AttributeError:
-                    indexCols.append(col) # will use this later for creating a multi indexed dataframe
-                    break
-
-                # Determines whether parent or child query and the object type
-                try:
-                    obj = rs[col][i].get('attributes').get('type')
-                    relationship = 'Parent'
-                except:
-                    pass
-                try:
-                    obj = rs[col][i].get('records')[0].get('attributes').get('type')
-                    relationship = 'Child'
-                except:
-                    pass
-                break
-                
-            if relationship == 'Child' and obj != None:
-                rs[col] = rs.apply(lambda row: getChildRecords(obj, row[col]), axis=1)
-
-            elif relationship == 'Parent' and obj != None:
-                fields = []
-                for i in range(len(rs[col])):
-                    if rs[col][i] != None:
-                        fields.extend(list(rs[col][i].keys()))
-                        fields = list(set(fields))
-                        
-                if KeepAttributes == False:
-                    try:
-                        fields.remove('attributes')
-                    except ValueError:
-                        pass
-                for field in fields:
-                    rs[obj + '.' + field] = rs.apply(lambda row: getParentRecords(field, row[col]), axis=1)
-                rs = rs.drop([col], axis=1)
-
-                CheckParentChild = True
-
-        # next I'd like to setup an option for child relationship queries to return a multi indexed dataframe
-        # print(indexCols)
+        if BulkThreshold is not None and len(set(InList)) > BulkThreshold:
+            rs = BulkInListQuery(SOQL, InList)
+        else:
+            rs = InListQuery(SOQL, InList)
+
+    instrumentation.rows('sfquery', 0 if rs is None else len(rs), time.perf_counter() - started)
     return rs
         
            
-def SFFormat(df, SObject, EnforceNulls=False):
+def SFFormat(df, SObject, EnforceNulls=False, InPlace=True, ZeroAsNull=True):
     """
         Description: Looks up data types and dynamically formats columns to a correct format for the Bulk Api. Returns error messages for invalid data types or column headers.  If EnforceNulls is true fills all blanks with #N/A, if false will set blanks to ''.
         Parameters:
             df = Pandas.DataFrame
             SObject = Type of object for the upload. Ex: 'Account'
             EnforceNulls = If true will fill blanks with #N/A to set as null in Salesforce
+            InPlace = Formats the columns of df in place, the default.  If false df is left alone and a formatted copy is returned along with the errors.
+            ZeroAsNull = Treats 0 in number and text columns as blank, as SFNulls does.  Checkbox columns keep false.
             
-        *Currently only formats dates and datetimes
+        Formats dates, datetimes, checkboxes and numbers, and checks text against the field length, in one pass per column.
+        Field types come from describeCache, so repeated calls skip the describe api call.
     """
-    NoFieldError = ''
-    InvalidDataError = ''
-    
-    df.columns = map(str.lower, df.columns)
-    fieldDict = getattr(sf, '%s' % SObject).describe()["fields"]
-    numFields = len(fieldDict)
-    
-    NumCol = df.columns.values.tolist()
-    for col in NumCol:
-        i = 0
-        for x in fieldDict:
-            if x['name'].lower() == col:
-                dtype = x['type']
-                length = x['length']
-                try:
-                    if dtype == 'date':
-                        df[col] = pd.to_datetime(df[col]).dt.strftime('%Y-%m-%d').replace(to_replace='NaT', value='#N/A') 
-                    elif dtype == 'datetime':
-                        df[col] = pd.to_datetime(df[col]).dt.strftime('%Y-%m-%dT%H:%M:%S').replace(to_replace='NaT', value='#N/A')
-                except ValueError: 
-                    InvalidDataError += ("Invalid "+dtype+" : "+col+"\n")
-                break
-            i += 1
-            if i >= numFields:
-                NoFieldError += (SObject+" does not contain : "+col+"\n")
-                
-    SFNulls(df)
-    if EnforceNulls == False:
-        for col in NumCol:
-            df[col] = df[col].replace('#N/A','')
-    errors = NoFieldError+InvalidDataError
-    if len(errors) > 0:
+    if InPlace:
+        df.columns = map(str.lower, df.columns)
+    fieldIndex = describeCache.field_index(sf, SObject)
+
+    res, errors = format_frame(df, fieldIndex, SObject, '#N/A' if EnforceNulls else '', ZeroAsNull, InPlace)
+    res.columns = map(str.lower, res.columns)
+    errors = ''.join(e + "\n" for e in errors)
+    if len(errors) == 0:
+        errors = 'No Errors'
+    if InPlace:
         return(errors)
-    else:
-        return('No Errors')
+    return(res, errors)
 
     
-def SFUpload(df, UploadType, Sobject, batchSize=49995, hangtime=0):
+def SFUpload(df, UploadType, Sobject, batchSize=10000, hangtime=0, ExternalIdName=None, Concurrency='Parallel', Workers=4, Timeout=None, Engine='1.0',
+             BulkThreshold=2000, AllOrNone=False):
     """
-        Description: Upload a pandas dataframe through the Salesforce Bulk API in batches of 50k. Can run either an insert or update to the listed Sobject.  Sobject and UploadType must be listed as a string. ex: 'Update', 'Account'  
+        Description: Upload a pandas dataframe to Salesforce.  Small frames go through the REST sObject Collections api 200 rows a call, larger ones through the Bulk API as a single job.  Can run an insert, update, upsert, delete or hardDelete to the listed Sobject.  Sobject and UploadType must be listed as a string. ex: 'Update', 'Account'  
         Parameters:
-            df         = Pandas.DataFrame
-            UploadType = Update or Insert
-            Sobject    = Salesforce object in the upload. Ex - Accounts, Contact
-            batchSize  = Number of rows that the upload will run before submitting the next group of rows in the dataset. Defaults to 49,995 (5 batches of 9999)
-            hangtime   = Number of seconds to wait before uploading a new batch. Defaults to 0.
+            df             = Pandas.DataFrame
+            UploadType     = Insert, Update, Upsert, Delete or HardDelete.  HardDelete always goes through the Bulk API and needs the Bulk API Hard Delete permission.
+            Sobject        = Salesforce object in the upload. Ex - Accounts, Contact
+            batchSize      = Number of rows in each batch of the job, at most 10,000.  Batches are also split to stay under 10MB.
+            hangtime       = Number of seconds to wait between submitting batches.  Defaults to 0, which submits them all at once.
+            ExternalIdName = External id field to match on for an Upsert
+            Concurrency    = 'Parallel' or 'Serial' processing of the batches by Salesforce.  Use Serial if parallel batches hit record locks.
+            Workers        = Number of batches (or REST calls) submitted and downloaded at the same time
+            Timeout        = Seconds to wait for the job to finish before raising BulkJobTimeout.  Defaults to waiting forever.
+            Engine         = '1.0' for the batch based Bulk API, '2.0' for Bulk API 2.0.  2.0 sends the whole frame in one upload (one job per 100MB) and Salesforce
+                             splits it, so batchSize, hangtime and Concurrency don't apply.  Rows are matched to their results on the values sent.
+            BulkThreshold  = Frames with fewer rows than this are uploaded over REST, which skips the bulk job queue and finishes in about a second.  0 always uses the Bulk API.
+            AllOrNone      = REST uploads only.  Rolls back every row of a 200 row call if any of them fails, each call commits on its own.  Bulk jobs always commit row by row.
+        Returns a copy of df with sf_id, sf_success, sf_created and sf_error columns holding the result of each row.
     """
 
     if len(df) == 0:
         return
-    
-    startRow = 0
-    endRow = batchSize
+    Engine = bulkEngine(Engine)
+    # results of an earlier upload, ex: when retrying its failed rows, aren't fields to send
+    df = df.drop(columns=[c for c in RESULT_COLUMNS if c in df.columns])
 
-    while startRow < len(df):
-        upload = df[startRow:endRow]
+    # sObject Collections can't hard delete
+    if len(df) < BulkThreshold and UploadType.lower() != 'harddelete':
+        instrumentSession()
+        results = upload_collections(sf.restful, df, Sobject, UploadType, external_id_name=ExternalIdName, all_or_none=AllOrNone,
+                                     max_workers=Workers, instrumentation=instrumentation)
+        return uploadResults(df, results)
 
-        Headers = upload.columns.tolist()
-        Data = upload.to_records(index=False)
-        job = SalesforceBulkJob(UploadType, Sobject, salesforce=sf)
-        job.upload(Headers,Data)
+    if Engine == '2.0':
+        results = bulk2Client().upload_frame(df, Sobject, UploadType, external_id_name=ExternalIdName, max_workers=Workers, timeout=Timeout)
+        return uploadResults(df, results)
 
-        startRow = endRow
-        endRow = startRow + batchSize
-        time.sleep(hangtime)
+    sfbulk = bulkClient()
+    results = sfbulk.upload_frame(df, Sobject, UploadType, external_id_name=ExternalIdName, concurrency=Concurrency,
+                                  max_workers=Workers, batch_size=batchSize, timeout=Timeout, hangtime=hangtime)
+    return uploadResults(df, results)
     
     
-def SFBulkQuery(SObject, SOQL):
+def uploadResults(df, results):
+    # adds the sf_* result columns to df by position, so duplicate index labels line up row for row
+    return df.assign(**{c: results[c].values for c in RESULT_COLUMNS})
+
+
+def SFBulkQuery(SObject, SOQL, ChunkSize=None, Sink=None, SinkFormat=None, PKChunking=False, ChunkParent=None, Workers=4, Timeout=None, SchemaTypes=True, Checkpoint=None, IncludeDeleted=False, Engine='1.0', MaxRecords=None,
+                KeepFiles=False):
     """
-        Description: Runs a query through the bulk api.  Creates, Tracks, and Closes the Request and returns the results as a Pandas Dataframe.  Currently there are lots of slighly obnoxious messages to help with tracking the current status.
+        Description: Runs a query through the bulk api.  Creates, Tracks, and Closes the Request and returns the results as a Pandas Dataframe.  Every result file of the batch is read, not just the first one.
         Parameters:
-            SObject = Salesforce Object, ex: Account, Contact
-            SOQL    = Salesforce SOQL Statement for bulk query
+            SObject     = Salesforce Object, ex: Account, Contact
+            SOQL        = Salesforce SOQL Statement for bulk query.  A list of statements runs each one as a batch of the same job.
+            ChunkSize   = If set, returns an iterator of dataframes of at most ChunkSize rows instead of one dataframe.  Results are parsed as they download so memory stays flat.
+            Sink        = File path to write the results to instead of returning them.  Written chunk by chunk, returns the number of rows written.
+            SinkFormat  = 'csv' or 'parquet', defaults to the Sink file extension.  Parquet requires pyarrow.
+            PKChunking  = True or a chunk size (max 250,000) to have Salesforce split the query into batches by record Id.  Use for very large objects.
+            ChunkParent = Parent object when PK chunking a sharing or history object, ex: 'Account' for AccountShare
+            Workers     = Number of PK chunked (or SOQL list) batches downloaded at the same time
+            Timeout     = Seconds to wait for the job to finish before raising BulkJobTimeout.  Defaults to waiting forever.
+            SchemaTypes = Sets column types from the describe of SObject as SFQuery does.  If false every column is returned as text like the bulk api sends it.
+            Checkpoint  = Path to a SQLite file that records the job, its batches and how much of each result file has been saved.  Result files are saved next to it in a <Checkpoint>_results folder.  If the process dies, running the same SFBulkQuery again reattaches to the job and downloads only the files, or parts of files, not already saved.
+            IncludeDeleted = Runs the job as queryAll so deleted and archived records are returned too
+            Engine      = '1.0' for the batch based Bulk API, '2.0' for Bulk API 2.0.  2.0 chunks large queries on its own, so PKChunking, ChunkParent and Checkpoint don't apply.
+            MaxRecords  = Bulk API 2.0 only, rows per result page downloaded.  Defaults to what Salesforce picks.
+            KeepFiles   = Checkpoint only.  Keeps the saved result files once every row has been read, they are deleted by default.
+
+            With PKChunking or a list of SOQL statements the rows come back in the order the batches finish.
     """
-    sfbulk = SalesforceBulk(sessionId=sf.session_id, host=sf.sf_instance)
-    job = sfbulk.create_query_job(SObject, contentType='CSV')
-    batch = sfbulk.query(job, SOQL)
-    while not sfbulk.is_batch_done(job, batch):
-        time.sleep(10)
-    sfbulk.close_job(job)
-    res = sfbulk.get_batch_result_iter(job, batch)
+    if bulkEngine(Engine) == '2.0':
+        if PKChunking or ChunkParent or Checkpoint is not None:
+            raise ValueError("PKChunking, ChunkParent and Checkpoint only apply to the 1.0 Engine")
+        return bulkResults(bulk2Query(SOQL, ChunkSize, MaxRecords, IncludeDeleted, Timeout), SObject, ChunkSize, Sink, SinkFormat, SchemaTypes)
+
+    if Checkpoint is not None:
+        return checkpointedBulkQuery(SObject, SOQL, Checkpoint, ChunkSize, Sink, SinkFormat, PKChunking, ChunkParent, Workers, Timeout, SchemaTypes, IncludeDeleted,
+                                     KeepFiles)
+
+    sfbulk = bulkClient()
+    job = sfbulk.create_query_job(SObject, contentType='CSV', pk_chunking=PKChunking, parent=ChunkParent, include_deleted=IncludeDeleted)
+    if isinstance(SOQL, str):
+        batch = sfbulk.query(job, SOQL)
+    else:
+        for statement in SOQL:
+            sfbulk.query(job, statement)
+    if PKChunking or not isinstance(SOQL, str):
+        sfbulk.close_job(job)
+        chunks = sfbulk.iter_job_result_chunks(job, chunksize=ChunkSize or 100000, max_workers=Workers, timeout=Timeout)
+    else:
+        sfbulk.wait_for_batch(job, batch, timeout=Timeout)
+        sfbulk.close_job(job)
+        chunks = sfbulk.get_batch_result_iter(job, batch, chunksize=ChunkSize or 100000)
+
+    return bulkResults(chunks, SObject, ChunkSize, Sink, SinkFormat, SchemaTypes)
+
+
+def bulkResults(chunks, SObject, ChunkSize, Sink, SinkFormat, SchemaTypes):
+    # returns bulk query result chunks the way SFBulkQuery was asked for: one dataframe, an iterator, or written to a sink
+    if Sink is None and not ChunkSize:
+        # typed once after joining so categories match across the whole result
+        res = concat_chunks(chunks)
+        return schemaDtypes(res, SObject) if SchemaTypes else res
+    if SchemaTypes:
+        chunks = (schemaDtypes(chunk, SObject) for chunk in chunks)
+    if Sink is not None:
+        return write_result_chunks(chunks, Sink, SinkFormat)
+    return chunks
+
+
+def bulk2Query(SOQL, ChunkSize, MaxRecords, IncludeDeleted, Timeout):
+    # result chunks of one or more bulk api 2.0 query jobs, all started before the first is read
+    sfbulk = bulk2Client()
+    statements = [SOQL] if isinstance(SOQL, str) else list(SOQL)
+    jobs = [sfbulk.create_query_job(statement, include_deleted=IncludeDeleted) for statement in statements]
+
+    def results():
+        for job in jobs:
+            sfbulk.wait_for_job(job, 'query', timeout=Timeout)
+            for chunk in sfbulk.iter_query_result_chunks(job, chunksize=ChunkSize or 100000, max_records=MaxRecords):
+                yield chunk
+
+    return count_rows(results(), instrumentation, 'bulk2_query')
+
+
+def checkpointedBulkQuery(SObject, SOQL, Checkpoint, ChunkSize, Sink, SinkFormat, PKChunking, ChunkParent, Workers, Timeout, SchemaTypes, IncludeDeleted=False,
+                          KeepFiles=False):
+    # runs or resumes a bulk query job recorded in the Checkpoint store, saving result files to disk before reading them
+    # the files are deleted once every row has been read unless KeepFiles is set
+    store = JobStore(Checkpoint)
+    sfbulk = bulkClient(store=store)
+    statements = [SOQL] if isinstance(SOQL, str) else list(SOQL)
+    queryKey = json.dumps([SObject, statements, PKChunking, ChunkParent, IncludeDeleted])
+    job = sfbulk.resumable_query_job(SObject, statements, queryKey, pk_chunking=PKChunking, parent=ChunkParent, include_deleted=IncludeDeleted)
+
+    directory = os.path.splitext(Checkpoint)[0] + '_results'
+    paths = sfbulk.download_job_results(job, directory, max_workers=Workers, timeout=Timeout)
+
+    def readFiles():
+        for path in paths:
+            with open(path, 'rb') as f:
+                for chunk in read_result_csv(f, ChunkSize or 100000):
+                    yield chunk
+        store.finish_job(job)
+        if not KeepFiles:
+            for path in paths:
+                os.remove(path)
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass  # other jobs' files are still in it
+
+    return bulkResults(count_rows(readFiles(), instrumentation, 'bulk_query'), SObject, ChunkSize, Sink, SinkFormat, SchemaTypes)
+
+
+def SFBulkQueries(Queries, MaxConcurrent=5, Timeout=None, SchemaTypes=True):
+    """
+        Description: Runs several bulk api queries at the same time instead of one after another, so the total time is close to the slowest query.  Requires aiohttp.
+        Parameters:
+            Queries       = Dictionary of name : (SObject, SOQL), ex: {'accounts': ('Account', 'Select Id From Account')}.  A list of (SObject, SOQL) pairs also works and returns a list.
+            MaxConcurrent = Most query jobs running at once.  Keep this within the org's bulk api limits.
+            Timeout       = Seconds to wait for each job before raising BulkJobTimeout.  Defaults to waiting forever.
+            SchemaTypes   = Sets column types from the describe of each query's SObject as SFBulkQuery does.  If false every column is left as text.
+        Returns the results in the same shape as Queries with a dataframe for each query.
+    """
+    from AsyncSalesforceBulkQuery import run_bulk_queries
+    Queries = Queries if isinstance(Queries, dict) else list(Queries)
+    res = run_bulk_queries(sf.session_id, sf.sf_instance, Queries, max_concurrency=MaxConcurrent, instrumentation=instrumentation, timeout=Timeout)
+    if not SchemaTypes:
+        return res
+    if isinstance(Queries, dict):
+        return {key: schemaDtypes(res[key], Queries[key][0]) for key in Queries}
+    return [schemaDtypes(df, query[0]) for df, query in zip(res, Queries)]
+
+
+def SFSync(SOQL: str, CacheDir=None, Bulk=False, FullRefresh=False, FullRefreshAfter=15, Lookback=300, LowerHeaders=True, SchemaTypes=True, Workers=4, Timeout=None):
+    """
+        Description: Keeps a local Parquet copy of a query's results up to date instead of pulling the whole object every run.  The first run loads everything and saves the latest SystemModstamp as a watermark.  Later runs only query rows modified since the watermark through queryAll, upsert them into the copy by Id and drop deleted rows, so api calls and transfer follow the number of changed rows rather than the size of the object.  Returns the up to date dataframe.  Requires pyarrow.
+        Parameters:
+            SOQL             = Salesforce SOQL Statement.  Id and SystemModstamp are added to the select list if missing.  Child relationship subqueries, GROUP BY and LIMIT are not supported.
+            CacheDir         = Folder for the Parquet copies, defaults to ~/.cache/salesforcetools/sync.  Copies are keyed by org and SOQL.
+            Bulk             = Runs the queries through the bulk api, better for the first load of large objects
+            FullRefresh      = Ignores the local copy and loads everything again
+            FullRefreshAfter = Days since the last sync after which everything is loaded again, since deleted records only stay in the recycle bin for 15 days.  None to never refresh on age.
+            Lookback         = Seconds the watermark is moved back on each run to catch rows from transactions that committed late
+            LowerHeaders     = Returns Dataframe with column headers lowercase.  The local copy keeps the api names.
+            SchemaTypes      = Sets column types from the describe of the queried object as SFQuery does
+            Workers          = Number of bulk result files downloaded at the same time
+            Timeout          = Seconds to wait for bulk jobs before raising BulkJobTimeout
+
+            When the SOQL has a WHERE clause, rows changed so they no longer match it are found with an extra Id only query and removed.  Records hard deleted or purged from the recycle bin can't be seen until the next full refresh.
+            Objects without an IsDeleted field, ex: User, are synced with query instead of queryAll and have no deleted rows to drop.
+            Columns are stored under their api names, so switching Bulk between runs upserts into the same columns.
+    """
+    SObject = soqlObject(SOQL)
+    masked = maskSOQL(SOQL)
+    if re.search(r"\b(group\s+by|limit)\b", masked, re.I):
+        raise ValueError("SFSync does not support GROUP BY or LIMIT queries")
+    cache = syncCache if CacheDir is None else SyncCache(CacheDir)
+    org = describeCache.org_key(sf)
+
+    cached, state = (None, {}) if FullRefresh else cache.load(org, SObject, SOQL)
+    if cached is not None:
+        cached = apiColumns(cached, SObject)
+    since = state.get('watermark') if cached is not None else None
+    if since is not None and FullRefreshAfter is not None and time.time() - state.get('synced_at', 0) > FullRefreshAfter * 86400:
+        since = None
+    syncedAt = time.time()
+
+    def runQuery(SOQLstr, IncludeDeleted):
+        if Bulk:
+            return SFBulkQuery(SObject, SOQLstr, Workers=Workers, Timeout=Timeout, SchemaTypes=False, IncludeDeleted=IncludeDeleted)
+        frames = list(pageFrames(SOQLstr, LowerHeaders=False, IncludeDeleted=IncludeDeleted))
+        return drop_parent_placeholders(pd.concat(frames) if len(frames) > 1 else frames[0])
+
+    # objects such as User have no IsDeleted and can't be queried with queryAll
+    hasDeleted = describeCache.field(sf, SObject, 'IsDeleted') is not None
+    selectsDeleted = 'isdeleted' in [f.lower() for f in soqlFields(SOQL)]
+    query = addSOQLFields(SOQL, ['Id', 'SystemModstamp'] + (['IsDeleted'] if hasDeleted else []))
+    if since is not None:
+        query = addSOQLFilter(query, "SystemModstamp >= %s" % shift_watermark(since, Lookback))
+    changes = runQuery(query, IncludeDeleted=hasDeleted and since is not None)
+
+    removed = set()
+    newWatermark = since
+    if len(changes.columns):
+        changes = apiColumns(changes, SObject)
+        idCol, stampCol = column(changes, 'Id'), column(changes, 'SystemModstamp')
+        newWatermark = watermark(changes[stampCol], newWatermark)
+        if hasDeleted:
+            deletedCol = column(changes, 'IsDeleted')
+            deleted = changes[deletedCol].astype(str).str.lower().eq('true')
+            removed = set(changes.loc[deleted, idCol])
+            changes = changes[~deleted]
+            if not selectsDeleted:
+                changes = changes.drop([deletedCol], axis=1)
+        changes = changes.rename(columns={idCol: 'Id', stampCol: 'SystemModstamp'})
+        if SchemaTypes:
+            changes = schemaDtypes(changes, SObject)
+        else:
+            changes = to_numeric_columns(changes)
+
+    if since is not None and re.search(r"\bwhere\b", masked, re.I):
+        # rows edited out of the WHERE clause show up here but not in changes
+        touched = runQuery("SELECT Id FROM %s WHERE SystemModstamp >= %s" % (SObject, shift_watermark(since, Lookback)), IncludeDeleted=hasDeleted)
+        if len(touched.columns):
+            kept = set(changes['Id']) if len(changes.columns) else set()
+            removed |= set(touched[column(touched, 'Id')]) - kept
+
+    if since is None:
+        res = changes.reset_index(drop=True)
+    else:
+        res = upsert_frame(cached, changes if len(changes.columns) else cached.iloc[:0], 'Id', removed)
+        if SchemaTypes and len(res.columns):
+            # categories from the copy and the changes differ until typed again
+            res = schemaDtypes(res, SObject)
+
+    cache.save(org, SObject, SOQL, res, {'watermark': newWatermark, 'synced_at': syncedAt})
+    if LowerHeaders == True:
+        res = res.copy()
+        res.columns = map(str.lower, res.columns)
     return res
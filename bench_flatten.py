@@ -0,0 +1,103 @@
+"""
+Compares the single pass relationship flattener in sf_records with the
+column scanning loop SFQuery used before it, on synthetic REST API records.
+
+    python bench_flatten.py [rows ...]
+"""
+import sys
+import time
+
+from pandas import DataFrame
+
+from sf_records import records_to_frame
+
+
+def make_records(rows):
+    records = []
+    for i in range(rows):
+        owner = {'attributes': {'type': 'User', 'url': '/User/%d' % i},
+                 'Name': 'Owner %d' % (i % 50),
+                 'Email': 'owner%d@example.com' % (i % 50)}
+        account = {'attributes': {'type': 'Account', 'url': '/Account/%d' % i},
+                   'Name': 'Account %d' % i,
+                   'Industry': 'Energy',
+                   'Owner': owner if i % 10 else None}
+        records.append({'attributes': {'type': 'Opportunity',
+                                       'url': '/Opportunity/%d' % i},
+                        'Id': '006%012d' % i,
+                        'Name': 'Opportunity %d' % i,
+                        'Amount': i * 10.0,
+                        'StageName': 'Closed Won',
+                        'Account': account,
+                        'CreatedBy': dict(owner)})
+    return records
+
+
+def legacy_flatten(rs, KeepAttributes=False):
+    # the row by row CheckParentChild loop SFQuery used to run
+    def getParentRecords(field, row):
+        if row == None:
+            return None
+        else:
+            return row.get(field)
+
+    CheckParentChild = True
+    while CheckParentChild:
+        CheckParentChild = False
+        for col in rs:
+            obj = None
+            relationship = None
+            for i in range(len(rs[col])):
+                if rs[col][i] == None:
+                    continue
+                try:
+                    if rs[col][i].get('type') != None and col == 'attributes':
+                        if KeepAttributes == False:
+                            rs = rs.drop([col], axis=1)
+                        break
+                except AttributeError:
+                    break
+                try:
+                    obj = rs[col][i].get('attributes').get('type')
+                    relationship = 'Parent'
+                except:
+                    pass
+                break
+
+            if relationship == 'Parent' and obj != None:
+                fields = []
+                for i in range(len(rs[col])):
+                    if rs[col][i] != None:
+                        fields.extend(list(rs[col][i].keys()))
+                        fields = list(set(fields))
+                if KeepAttributes == False:
+                    try:
+                        fields.remove('attributes')
+                    except ValueError:
+                        pass
+                for field in fields:
+                    rs[obj + '.' + field] = rs.apply(
+                        lambda row: getParentRecords(field, row[col]), axis=1)
+                rs = rs.drop([col], axis=1)
+                CheckParentChild = True
+    return rs
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main(sizes):
+    print('%10s %12s %12s %8s' % ('rows', 'legacy (s)', 'single (s)', 'speedup'))
+    for rows in sizes:
+        records = make_records(rows)
+        legacy = timed(lambda: legacy_flatten(DataFrame(records)))
+        single = timed(records_to_frame, records)
+        print('%10d %12.3f %12.3f %7.1fx' % (rows, legacy, single,
+                                              legacy / single))
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [1000, 10000, 50000])
@@ -0,0 +1,225 @@
+"""
+Measures throughput of the query and upload paths against the local mock
+Salesforce server in mock_salesforce, so performance work can be checked
+offline. Each scenario runs in its own process and reports rows/sec, peak
+RSS, API calls and bytes served.
+
+    python bench_salesforce.py [--rows 10000 1000000 10000000]
+                               [--scenarios sfquery sfbulkquery ...]
+                               [--latency S] [--page-size N]
+                               [--result-splits N] [--no-gzip]
+                               [--json results.jsonl]
+
+The server speaks HTTPS with a throwaway self-signed certificate made with
+the openssl command line tool, since simple_salesforce and the bulk client
+always use https.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_salesforce import DEFAULT_SOQL, MockConfig, MockSalesforce
+
+CHUNKSIZE = 100000
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else \
+        peak / 1024.0
+
+
+def scripts(host):
+    import SalesforceScripts
+    from describe_cache import DescribeCache
+    SalesforceScripts.SFConfigure(SessionId='mock', Instance=host,
+                                  SessionCache=False)
+    # describes come from the mock every run instead of ~/.cache
+    SalesforceScripts.describeCache = DescribeCache(cache_dir=None)
+    return SalesforceScripts
+
+
+def bulk_client(host, rows):
+    from SalesforceBulkQuery import SalesforceBulk
+    bulk = SalesforceBulk(sessionId='mock', host=host)
+
+    def run():
+        job = bulk.create_query_job('Account', contentType='CSV')
+        batch = bulk.query(job, DEFAULT_SOQL)
+        bulk.wait_for_batch(job, batch)
+        bulk.close_job(job)
+        return sum(len(chunk) for chunk in bulk.get_batch_result_iter(
+            job, batch, chunksize=CHUNKSIZE))
+    return run
+
+
+def sfbulkquery(host, rows):
+    ss = scripts(host)
+    return lambda: len(ss.SFBulkQuery('Account', DEFAULT_SOQL))
+
+
+def sfbulkquery_chunked(host, rows):
+    ss = scripts(host)
+    return lambda: sum(len(chunk) for chunk in ss.SFBulkQuery(
+        'Account', DEFAULT_SOQL, ChunkSize=CHUNKSIZE))
+
+
+def sfbulkquery_v2(host, rows):
+    ss = scripts(host)
+    return lambda: len(ss.SFBulkQuery('Account', DEFAULT_SOQL, Engine='2.0'))
+
+
+def sfquery(host, rows):
+    ss = scripts(host)
+    return lambda: len(ss.SFQuery(DEFAULT_SOQL))
+
+
+def sfquery_sharded(host, rows):
+    ss = scripts(host)
+    return lambda: len(ss.SFQuery(DEFAULT_SOQL, Shards=8, Workers=8))
+
+
+def sfquery_chunked(host, rows):
+    ss = scripts(host)
+    return lambda: sum(len(chunk) for chunk in ss.SFQuery(
+        DEFAULT_SOQL, ChunkSize=CHUNKSIZE))
+
+
+def upload_frame(rows):
+    import pandas as pd
+    return pd.DataFrame({'Name': ['Account %d' % i for i in range(rows)],
+                         'AnnualRevenue': [i * 10.5 for i in range(rows)],
+                         'Industry': ['Energy'] * rows})
+
+
+def sfupload(host, rows):
+    ss = scripts(host)
+    # built before the clock starts, but it counts towards peak RSS
+    df = upload_frame(rows)
+    return lambda: len(ss.SFUpload(df, 'insert', 'Account'))
+
+
+def sfupload_rest(host, rows):
+    ss = scripts(host)
+    df = upload_frame(rows)
+    return lambda: len(ss.SFUpload(df, 'insert', 'Account',
+                                   BulkThreshold=rows + 1))
+
+
+def sfupload_v2(host, rows):
+    ss = scripts(host)
+    df = upload_frame(rows)
+    return lambda: int(ss.SFUpload(df, 'insert', 'Account',
+                                   Engine='2.0')['sf_success'].sum())
+
+
+SCENARIOS = {
+    'bulk_client': bulk_client,
+    'sfbulkquery': sfbulkquery,
+    'sfbulkquery_chunked': sfbulkquery_chunked,
+    'sfbulkquery_v2': sfbulkquery_v2,
+    'sfquery': sfquery,
+    'sfquery_chunked': sfquery_chunked,
+    'sfquery_sharded': sfquery_sharded,
+    'sfupload': sfupload,
+    'sfupload_rest': sfupload_rest,
+    'sfupload_v2': sfupload_v2,
+}
+
+
+def run_child(scenario, host, rows):
+    run = SCENARIOS[scenario](host, rows)
+    start = time.perf_counter()
+    done = run()
+    seconds = time.perf_counter() - start
+    print(json.dumps({'rows': done, 'seconds': seconds,
+                      'peak_rss_mb': peak_rss_mb()}))
+
+
+def make_certificate(directory):
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                    '-nodes', '-keyout', key, '-out', cert, '-days', '1',
+                    '-subj', '/CN=127.0.0.1',
+                    '-addext', 'subjectAltName=IP:127.0.0.1'],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+def run_scenario(mock, scenario, rows, cert):
+    mock.config.rows = rows
+    mock.reset()
+    env = dict(os.environ, REQUESTS_CA_BUNDLE=cert)
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', scenario,
+         '--host', mock.host, '--rows', str(rows)],
+        env=env, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        return {'scenario': scenario, 'rows': rows,
+                'error': proc.stderr.strip().splitlines()[-1]}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    calls = mock.calls()
+    result.update(scenario=scenario, api_calls=sum(calls.values()),
+                  calls=calls, mb_sent=mock.state.bytes_sent / 1e6,
+                  rows_per_sec=result['rows'] / result['seconds'])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 1000000, 10000000])
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+                        default=sorted(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--page-size', type=int, default=2000)
+    parser.add_argument('--result-splits', type=int, default=1)
+    parser.add_argument('--batch-seconds', type=float, default=0.0)
+    parser.add_argument('--no-gzip', action='store_true',
+                        help='serve results uncompressed')
+    parser.add_argument('--json', help='append results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--host', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.child, args.host, args.rows[0])
+
+    config = MockConfig(latency=args.latency, page_size=args.page_size,
+                        result_splits=args.result_splits,
+                        batch_seconds=args.batch_seconds,
+                        gzip=not args.no_gzip)
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory)
+        with MockSalesforce(config, certfile=cert, keyfile=key) as mock:
+            print('%-20s %10s %9s %12s %10s %9s %9s' % (
+                'scenario', 'rows', 'seconds', 'rows/sec', 'peak MB',
+                'calls', 'MB sent'))
+            for rows in args.rows:
+                for scenario in args.scenarios:
+                    result = run_scenario(mock, scenario, rows, cert)
+                    if 'error' in result:
+                        print('%-20s %10d  failed: %s' % (
+                            scenario, rows, result['error']))
+                    else:
+                        print('%-20s %10d %9.2f %12.0f %10.1f %9d %9.1f' % (
+                            scenario, result['rows'], result['seconds'],
+                            result['rows_per_sec'], result['peak_rss_mb'],
+                            result['api_calls'], result['mb_sent']))
+                    if args.json:
+                        with open(args.json, 'a') as f:
+                            f.write(json.dumps(dict(result, time=time.time(),
+                                                    config=vars(config))) +
+                                    '\n')
+
+
+if __name__ == '__main__':
+    main()
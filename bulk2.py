@@ -0,0 +1,330 @@
+import io
+import json
+import time
+
+import bulk_states
+from bulk_transport import RequestsTransport, compress_body
+from bulk_metrics import NULL, endpoint_name
+from SalesforceBulkQuery import BulkApiError, BulkJobTimeout, \
+    api_operation, bounded_map, concat_chunks, count_rows, csv_batches, \
+    read_result_csv
+from lazy_imports import lazy_module
+
+pd = lazy_module('pandas')
+
+# Salesforce takes up to 150MB of base64 encoded CSV per upload, which is
+# about 100MB of raw data; larger frames are split over several jobs
+MAX_UPLOAD_BYTES = 100000000
+MAX_UPLOAD_RECORDS = 150000000
+RESULT_COLUMNS = ['sf_id', 'sf_success', 'sf_created', 'sf_error']
+
+
+class BulkJobFailed(BulkApiError):
+
+    def __init__(self, job_id, state, error_message):
+        self.job_id = job_id
+        self.state = state
+        self.error_message = error_message
+
+        message = 'Job {0} {1}: {2}'.format(job_id, state.lower(),
+                                            error_message)
+        super(BulkJobFailed, self).__init__(message)
+
+
+class SalesforceBulk2(object):
+    """
+    Bulk API 2.0 client. Salesforce splits query and ingest jobs into
+    batches itself, so there are no batches to create, poll or collect
+    results from one by one: a query job is polled until it completes and
+    its results are read page by page with the Sforce-Locator, and an
+    ingest job takes its whole CSV in one upload.
+
+    Shares the keep-alive transport, gzip handling, instrumentation and
+    session refresh of SalesforceBulk.
+    """
+
+    def __init__(self, sessionId=None, host=None, API_version="52.0",
+                 exception_class=BulkApiError, transport=None, pool_size=10,
+                 max_retries=5, instrumentation=None, compress=True,
+                 session_refresher=None):
+        self.endpoint = "https://" + host + "/services/data/v%s/jobs" % \
+            API_version
+        self.sessionId = sessionId
+        self.exception_class = exception_class
+        self.instrumentation = instrumentation or NULL
+        self.session_refresher = session_refresher
+        self.transport = transport or RequestsTransport(
+            pool_size=pool_size, max_retries=max_retries,
+            instrumentation=self.instrumentation,
+            session_refresher=self.refresh_session if session_refresher
+            else None)
+        # gzip uploads on the way up, results come back gzipped anyway
+        self.compress = compress
+
+    def refresh_session(self, stale_session_id):
+        self.sessionId = self.session_refresher(stale_session_id)
+        return self.sessionId
+
+    def headers(self, values={}):
+        default = {"Authorization": "Bearer " + self.sessionId,
+                   "Content-Type": "application/json; charset=UTF-8",
+                   "Accept": "application/json",
+                   "Accept-Encoding": "gzip"}
+        for k, val in values.items():
+            default[k] = val
+        return default
+
+    def check_status(self, resp, content):
+        if resp.status_code >= 400:
+            msg = "Bulk API 2.0 HTTP Error result: {0}".format(content)
+            if self.exception_class == BulkApiError:
+                raise self.exception_class(
+                    "[{0}] {1}".format(resp.status_code, msg),
+                    status_code=resp.status_code)
+            raise self.exception_class(msg)
+
+    def send_json(self, method, uri, data, idempotent=None):
+        resp = self.transport.request(method, uri, headers=self.headers(),
+                                      body=json.dumps(data),
+                                      idempotent=idempotent)
+        self.check_status(resp, resp.content)
+        return resp.json()
+
+    def job_info(self, job_id, kind):
+        resp = self.transport.request(
+            "GET", self.endpoint + "/%s/%s" % (kind, job_id),
+            headers=self.headers())
+        self.check_status(resp, resp.content)
+        return resp.json()
+
+    def wait_for_job(self, job_id, kind, timeout=None, min_interval=1,
+                     max_interval=30, backoff=2):
+        """
+        Poll a query or ingest job until it completes and return its job
+        info. Like BulkPoller, the interval shrinks while
+        numberRecordsProcessed moves and backs off while it does not.
+        Raises BulkJobFailed if the job fails or is aborted.
+        """
+        started = time.time()
+        interval = min_interval
+        processed = -1
+        while True:
+            self.instrumentation.count('bulk_polls')
+            info = self.job_info(job_id, kind)
+            if info['state'] == bulk_states.JOB_COMPLETE:
+                return info
+            if info['state'] in bulk_states.JOB_ERROR_STATES:
+                raise BulkJobFailed(job_id, info['state'],
+                                    info.get('errorMessage'))
+            if timeout is not None and time.time() - started > timeout:
+                raise BulkJobTimeout([job_id], timeout)
+
+            done = int(info.get('numberRecordsProcessed') or 0)
+            if done > processed:
+                interval = max(min_interval, interval / backoff)
+            else:
+                interval = min(max_interval, interval * backoff)
+            processed = done
+            time.sleep(interval)
+
+    # Query jobs
+
+    def create_query_job(self, soql, include_deleted=False):
+        # queryAll also returns deleted and archived records
+        return self.send_json("POST", self.endpoint + "/query", {
+            "operation": "queryAll" if include_deleted else "query",
+            "query": soql,
+            "contentType": "CSV",
+            "columnDelimiter": "COMMA",
+            "lineEnding": "LF",
+        })["id"]
+
+    def iter_query_result_chunks(self, job_id, chunksize=100000,
+                                 max_records=None):
+        """
+        Yield DataFrames of at most chunksize rows for a completed query
+        job. Results are read a page of max_records rows at a time (the
+        server's choice when None), following the Sforce-Locator header from
+        one page to the next, and parsed straight off the HTTP stream.
+        """
+        uri = self.endpoint + "/query/%s/results" % job_id
+        locator = None
+        while True:
+            params = []
+            if max_records:
+                params.append("maxRecords=%d" % max_records)
+            if locator:
+                params.append("locator=%s" % locator)
+            page = uri + ("?" + "&".join(params) if params else "")
+            resp = self.transport.request(
+                "GET", page, headers=self.headers({"Accept": "text/csv"}),
+                stream=True)
+            if resp.status_code >= 400:
+                self.check_status(resp, resp.content)
+            resp.raw.decode_content = True
+            try:
+                for chunk in read_result_csv(resp.raw, chunksize):
+                    yield chunk
+            finally:
+                self.instrumentation.count('request_bytes_received',
+                                           resp.raw.tell(),
+                                           endpoint=endpoint_name(uri))
+                resp.close()
+            locator = resp.headers.get("Sforce-Locator")
+            if not locator or locator == "null":
+                return
+
+    def query(self, soql, chunksize=100000, max_records=None,
+              include_deleted=False, timeout=None):
+        """
+        Run soql as a query job and return an iterator of result
+        DataFrames once it completes.
+        """
+        job_id = self.create_query_job(soql, include_deleted)
+        self.wait_for_job(job_id, "query", timeout=timeout)
+        return count_rows(self.iter_query_result_chunks(
+            job_id, chunksize, max_records), self.instrumentation,
+            'bulk2_query')
+
+    # Ingest jobs
+
+    def create_ingest_job(self, object_name, operation,
+                          external_id_name=None):
+        job = {"object": object_name, "operation": operation,
+               "contentType": "CSV", "lineEnding": "LF"}
+        if external_id_name:
+            job["externalIdFieldName"] = external_id_name
+        return self.send_json("POST", self.endpoint + "/ingest", job)["id"]
+
+    def upload_job_data(self, job_id, data):
+        uri = self.endpoint + "/ingest/%s/batches" % job_id
+        headers = self.headers({"Content-Type": "text/csv"})
+        if self.compress:
+            data, encoding = compress_body(data)
+            headers.update(encoding)
+        resp = self.transport.request("PUT", uri, headers=headers,
+                                      body=data)
+        self.check_status(resp, resp.content)
+
+    def close_job(self, job_id):
+        # tells Salesforce the upload is complete so it starts processing
+        return self.send_json("PATCH", self.endpoint + "/ingest/%s" % job_id,
+                              {"state": bulk_states.UPLOAD_COMPLETE},
+                              idempotent=True)
+
+    def abort_job(self, job_id, kind="ingest"):
+        return self.send_json("PATCH", self.endpoint + "/%s/%s" % (kind,
+                                                                  job_id),
+                              {"state": bulk_states.ABORTED},
+                              idempotent=True)
+
+    def get_job_results(self, job_id, kind):
+        """
+        The successfulResults, failedResults or unprocessedrecords of an
+        ingest job as a DataFrame of strings. Each row repeats the fields
+        that were uploaded, after sf__Id and sf__Created or sf__Error.
+        """
+        uri = self.endpoint + "/ingest/%s/%s/" % (job_id, kind)
+        resp = self.transport.request(
+            "GET", uri, headers=self.headers({"Accept": "text/csv"}),
+            stream=True)
+        if resp.status_code >= 400:
+            self.check_status(resp, resp.content)
+        resp.raw.decode_content = True
+        try:
+            return concat_chunks(read_result_csv(resp.raw))
+        finally:
+            self.instrumentation.count('request_bytes_received',
+                                       resp.raw.tell(),
+                                       endpoint=endpoint_name(uri))
+            resp.close()
+
+    def upload_csv(self, object_name, operation, data,
+                   external_id_name=None, timeout=None):
+        """
+        Run one ingest job over CSV bytes: create it, upload data in a single
+        request, close it and wait for it to finish. Returns the job id.
+        """
+        job_id = self.create_ingest_job(object_name, operation,
+                                        external_id_name)
+        try:
+            self.upload_job_data(job_id, data)
+        except Exception:
+            self.abort_job(job_id)
+            raise
+        self.close_job(job_id)
+        self.wait_for_job(job_id, "ingest", timeout=timeout)
+        return job_id
+
+    def upload_frame(self, df, object_name, operation,
+                     external_id_name=None, max_workers=4, timeout=None,
+                     max_bytes=MAX_UPLOAD_BYTES):
+        """
+        Upload a DataFrame as single-upload ingest jobs, one per max_bytes
+        of CSV, run by max_workers threads. Each piece is serialized as a
+        worker frees up, so at most max_workers pieces are held as CSV. Returns a DataFrame on df's
+        index with the same sf_id, sf_success, sf_created and sf_error
+        columns as SalesforceBulk.upload_frame.
+        """
+        started = time.perf_counter()
+        operation = api_operation(operation)
+
+        def upload(piece):
+            start, stop, data = piece
+            job_id = self.upload_csv(object_name, operation, data,
+                                     external_id_name, timeout)
+            return self.match_results(job_id, data, df.index[start:stop])
+
+        pieces = csv_batches(df, max_records=MAX_UPLOAD_RECORDS,
+                             max_bytes=max_bytes)
+        frames = list(bounded_map(upload, pieces, max_workers))
+        self.instrumentation.rows('bulk2_' + operation.lower(), len(df),
+                                  time.perf_counter() - started)
+        if not frames:
+            return pd.DataFrame(columns=RESULT_COLUMNS, index=df.index)
+        return pd.concat(frames)
+
+    def match_results(self, job_id, data, index):
+        """
+        Line the successful and failed results of an ingest job up with the
+        rows of the uploaded CSV data. Bulk API 2.0 returns results in no
+        particular order, so rows are matched on the fields they echo back;
+        identical rows are matched in turn. Rows with no result were not
+        processed.
+        """
+        sent = concat_chunks(read_result_csv(io.BytesIO(data)))
+        fields = list(sent.columns)
+
+        succeeded = self.get_job_results(job_id, "successfulResults")
+        failed = self.get_job_results(job_id, "failedResults")
+        results = []
+        if len(succeeded):
+            results.append(succeeded.assign(
+                sf_id=succeeded['sf__Id'], sf_success=True,
+                sf_created=succeeded['sf__Created'] == 'true', sf_error=''))
+        if len(failed):
+            results.append(failed.assign(
+                sf_id=failed['sf__Id'], sf_success=False, sf_created=False,
+                sf_error=failed['sf__Error']))
+        if results:
+            results = pd.concat(results, ignore_index=True)
+            results = results[fields + RESULT_COLUMNS]
+        else:
+            results = pd.DataFrame(columns=fields + RESULT_COLUMNS, dtype=str)
+
+        # numbers repeated rows so duplicates pair up one to one
+        sent['sf_occurrence'] = sent.groupby(fields, sort=False).cumcount()
+        results['sf_occurrence'] = results.groupby(fields,
+                                                   sort=False).cumcount()
+        matched = sent.merge(results, how='left',
+                             on=fields + ['sf_occurrence'], sort=False)
+        unprocessed = matched['sf_success'].isna()
+        matched['sf_id'] = matched['sf_id'].where(~unprocessed, '')
+        matched['sf_success'] = matched['sf_success'].where(
+            ~unprocessed, False).astype(bool)
+        matched['sf_created'] = matched['sf_created'].where(
+            ~unprocessed, False).astype(bool)
+        matched['sf_error'] = matched['sf_error'].where(
+            ~unprocessed, 'Not processed')
+        matched.index = index
+        return matched[RESULT_COLUMNS]
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    object_name TEXT,
+    operation TEXT,
+    query_key TEXT,
+    pk_chunked INTEGER DEFAULT 0,
+    closed INTEGER DEFAULT 0,
+    finished INTEGER DEFAULT 0,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    job_id TEXT,
+    soql TEXT,
+    state TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    batch_id TEXT,
+    result_id TEXT,
+    job_id TEXT,
+    path TEXT,
+    bytes_written INTEGER DEFAULT 0,
+    complete INTEGER DEFAULT 0,
+    PRIMARY KEY (batch_id, result_id)
+);
+"""
+
+
+class JobStore(object):
+    """
+    Local SQLite record of bulk jobs, their batches and how much of each
+    result file has been saved, so a new process can reattach to a job and
+    download only what is missing. Safe to share between threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def execute(self, sql, params=()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).fetchall()
+
+    def record_job(self, job_id, object_name, operation, query_key=None,
+                   pk_chunked=False):
+        self.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, object_name, operation, "
+            "query_key, pk_chunked, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, object_name, operation, query_key, int(bool(pk_chunked)),
+             time.time()))
+
+    def set_query_key(self, job_id, query_key):
+        self.execute("UPDATE jobs SET query_key = ? WHERE job_id = ?",
+                     (query_key, job_id))
+
+    def close_job(self, job_id):
+        self.execute("UPDATE jobs SET closed = 1 WHERE job_id = ?", (job_id,))
+
+    def finish_job(self, job_id):
+        self.execute("UPDATE jobs SET finished = 1 WHERE job_id = ?",
+                     (job_id,))
+
+    def job(self, job_id):
+        rows = self.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+        return dict(rows[0]) if rows else None
+
+    def find_job(self, query_key):
+        """
+        The most recent unfinished job recorded for query_key, or None.
+        """
+        rows = self.execute(
+            "SELECT job_id FROM jobs WHERE query_key = ? AND finished = 0 "
+            "ORDER BY created_at DESC LIMIT 1", (query_key,))
+        return rows[0]['job_id'] if rows else None
+
+    def record_batch(self, job_id, batch_id, soql=None, state=None):
+        self.execute(
+            "INSERT INTO batches (batch_id, job_id, soql, state) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT (batch_id) DO UPDATE SET "
+            "soql = COALESCE(excluded.soql, soql), "
+            "state = COALESCE(excluded.state, state)",
+            (batch_id, job_id, soql, state))
+
+    def batches(self, job_id):
+        return [dict(row) for row in self.execute(
+            "SELECT * FROM batches WHERE job_id = ?", (job_id,))]
+
+    def result_progress(self, batch_id, result_id):
+        """
+        Returns (bytes_written, complete) for a result file.
+        """
+        rows = self.execute(
+            "SELECT bytes_written, complete FROM results "
+            "WHERE batch_id = ? AND result_id = ?", (batch_id, result_id))
+        if not rows:
+            return 0, False
+        return rows[0]['bytes_written'], bool(rows[0]['complete'])
+
+    def record_result(self, job_id, batch_id, result_id, path, bytes_written,
+                      complete=False):
+        self.execute(
+            "INSERT OR REPLACE INTO results (batch_id, result_id, job_id, "
+            "path, bytes_written, complete) VALUES (?, ?, ?, ?, ?, ?)",
+            (batch_id, result_id, job_id, path, bytes_written,
+             int(bool(complete))))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,151 @@
+import logging
+import re
+import threading
+from urllib.parse import urlparse
+
+# Sforce-Limit-Info: api-usage=18/5000
+LIMIT_INFO = re.compile(r'api-usage=(\d+)/(\d+)')
+RECORD_ID = re.compile(r'^[a-zA-Z0-9]{15}(?:[a-zA-Z0-9]{3})?$')
+QUERY_LOCATOR = re.compile(r'^\w+-\d+$')
+
+
+def endpoint_name(url):
+    """
+    The path of url with record ids and query locators replaced, so metrics
+    are grouped by endpoint rather than by job or batch.
+    /services/async/39.0/job/750.../batch -> /services/async/39.0/job/{id}/batch
+    """
+    parts = []
+    for part in urlparse(url).path.split('/'):
+        if RECORD_ID.match(part) and any(c.isdigit() for c in part):
+            part = '{id}'
+        elif QUERY_LOCATOR.match(part):
+            part = '{locator}'
+        parts.append(part)
+    return '/'.join(parts)
+
+
+class Instrumentation(object):
+    """
+    Receives metrics from SalesforceBulk, its transport and poller, and the
+    SalesforceScripts query and upload helpers. This base class drops
+    everything, so instrumentation is off unless a sink is passed in. Sinks
+    override record(kind, name, value, labels), where kind is 'counter',
+    'gauge' or 'timing'.
+
+    Metrics sent:
+        request_seconds         timing per HTTP request, by method,
+                                endpoint and status
+        request_bytes_sent      counter of request body bytes
+        request_bytes_received  counter of response body bytes
+        request_retries         counter of retried requests
+        api_usage, api_limit    gauges from the Sforce-Limit-Info header
+        bulk_polls              counter of batch list polls
+        rows                    counter of rows queried or uploaded, by
+                                operation
+        rows_per_second         gauge of the last operation's throughput
+    """
+
+    def record(self, kind, name, value, labels):
+        pass
+
+    def count(self, name, value=1, **labels):
+        self.record('counter', name, value, labels)
+
+    def gauge(self, name, value, **labels):
+        self.record('gauge', name, value, labels)
+
+    def timing(self, name, seconds, **labels):
+        self.record('timing', name, seconds, labels)
+
+    def request(self, method, url, status, seconds, sent=0, received=0,
+                limit_info=None):
+        endpoint = endpoint_name(url)
+        self.timing('request_seconds', seconds, method=method,
+                    endpoint=endpoint, status=str(status))
+        if sent:
+            self.count('request_bytes_sent', sent, endpoint=endpoint)
+        if received:
+            self.count('request_bytes_received', received, endpoint=endpoint)
+        if limit_info:
+            match = LIMIT_INFO.search(limit_info)
+            if match:
+                self.gauge('api_usage', int(match.group(1)))
+                self.gauge('api_limit', int(match.group(2)))
+
+    def rows(self, operation, rows, seconds):
+        self.count('rows', rows, operation=operation)
+        if seconds > 0:
+            self.gauge('rows_per_second', rows / seconds, operation=operation)
+
+
+class CallbackInstrumentation(Instrumentation):
+    """
+    Calls callback(kind, name, value, labels) for every metric.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def record(self, kind, name, value, labels):
+        self.callback(kind, name, value, labels)
+
+
+class LoggingInstrumentation(Instrumentation):
+    """
+    Logs every metric as one line, at DEBUG by default, to the
+    salesforcetools logger or the one given.
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('salesforcetools')
+        self.level = level
+
+    def record(self, kind, name, value, labels):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, '%s %s=%s %s', kind, name, value,
+                            ' '.join('%s=%s' % item
+                                     for item in sorted(labels.items())))
+
+
+class PrometheusInstrumentation(Instrumentation):
+    """
+    Exposes metrics through prometheus_client: counters as Counters, gauges
+    as Gauges and timings as Histograms, named namespace_name. Requires
+    prometheus_client; serve them with prometheus_client.start_http_server
+    or push them with the push gateway helpers.
+    """
+
+    def __init__(self, registry=None, namespace='salesforce'):
+        import prometheus_client
+        self.prometheus = prometheus_client
+        self.registry = registry or prometheus_client.REGISTRY
+        self.namespace = namespace
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def metric(self, kind, name, label_names):
+        with self.lock:
+            if name not in self.metrics:
+                cls = {'counter': self.prometheus.Counter,
+                       'gauge': self.prometheus.Gauge,
+                       'timing': self.prometheus.Histogram}[kind]
+                self.metrics[name] = cls(name, name.replace('_', ' '),
+                                         label_names,
+                                         namespace=self.namespace,
+                                         registry=self.registry)
+            return self.metrics[name]
+
+    def record(self, kind, name, value, labels):
+        metric = self.metric(kind, name, sorted(labels))
+        if labels:
+            metric = metric.labels(**labels)
+        if kind == 'counter':
+            metric.inc(value)
+        elif kind == 'gauge':
+            metric.set(value)
+        else:
+            metric.observe(value)
+
+
+NULL = Instrumentation()
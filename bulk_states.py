@@ -1,10 +1,19 @@
 ABORTED = 'Aborted'
 FAILED = 'Failed'
-NOT_PROCESSED = 'Not Processed'
+NOT_PROCESSED = 'NotProcessed'
 COMPLETED = 'Completed'
 
 ERROR_STATES = (
     ABORTED,
     FAILED,
     NOT_PROCESSED,
-)
\ No newline at end of file
+)
+# Bulk API 2.0 job states
+UPLOAD_COMPLETE = 'UploadComplete'
+IN_PROGRESS = 'InProgress'
+JOB_COMPLETE = 'JobComplete'
+
+JOB_ERROR_STATES = (
+    ABORTED,
+    FAILED,
+)
@@ -0,0 +1,202 @@
+import gzip
+import random
+import time
+
+from bulk_metrics import NULL, endpoint_name
+from lazy_imports import lazy_module
+
+requests = lazy_module('requests')
+urllib3 = lazy_module('urllib3')
+
+# HTTP statuses worth retrying, and the Bulk API exceptionCodes Salesforce
+# returns when an org is being throttled
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# the statuses that also mean a request was turned away unprocessed, so a
+# POST, PUT or PATCH can be sent again without creating a second job or batch
+REFUSED_STATUSES = (429, 503)
+# methods that are safe to repeat whatever happened to the first attempt
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'DELETE')
+THROTTLE_CODES = (
+    'ExceededQuota',
+    'TooManyRequests',
+    'REQUEST_LIMIT_EXCEEDED',
+)
+# Bulk API 1.0 sends the session id in its own header, 2.0 as a bearer token
+SESSION_HEADER = 'X-SFDC-Session'
+AUTH_HEADER = 'Authorization'
+INVALID_SESSION_CODES = (
+    b'InvalidSessionId',
+    b'INVALID_SESSION_ID',
+)
+
+# bodies smaller than this aren't worth gzipping, e.g. query batches
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+
+def compress_body(body, level=COMPRESS_LEVEL):
+    """
+    Returns (body, extra headers): body gzipped with a Content-Encoding
+    header if it is large enough to gain from it, otherwise unchanged.
+    """
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if body is None or len(body) < COMPRESS_MIN_BYTES:
+        return body, {}
+    return gzip.compress(body, compresslevel=level), \
+        {'Content-Encoding': 'gzip'}
+
+
+def session_id(headers):
+    """
+    The session id a request's headers carry, for either Bulk API version.
+    """
+    if not headers:
+        return None
+    if SESSION_HEADER in headers:
+        return headers[SESSION_HEADER]
+    auth = headers.get(AUTH_HEADER) or ''
+    return auth[len('Bearer '):] if auth.startswith('Bearer ') else None
+
+
+def with_session(headers, session_id):
+    headers = dict(headers)
+    if SESSION_HEADER in headers:
+        headers[SESSION_HEADER] = session_id
+    else:
+        headers[AUTH_HEADER] = 'Bearer ' + session_id
+    return headers
+
+
+def request_unsent(error):
+    """
+    True if a requests exception was raised before the request reached the
+    server: a connect timeout or a connection that could not be opened.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+class RequestsTransport(object):
+    """
+    Keep-alive, pooled HTTP transport with retries. One instance is shared by
+    every request a SalesforceBulk makes so connections are reused instead of
+    paying a TCP and TLS handshake per call.
+
+    Any object with a matching request(method, url, headers, body, stream,
+    idempotent) method returning a requests.Response can be used in its
+    place.
+
+    GETs and other idempotent requests are retried on any connection error,
+    timeout, 5xx or throttle. A POST, PUT or PATCH may already have been
+    processed when its response is lost, so it is only retried when it never
+    reached the server, or on 429, 503 and throttle exceptionCodes, unless
+    the caller passes idempotent=True, e.g. for closing a job.
+
+    Every attempt is reported to instrumentation (a bulk_metrics sink) with
+    its latency, bytes and the Sforce-Limit-Info api usage. Streamed
+    response bodies are counted by whoever reads them.
+
+    With a session_refresher, a request rejected for an invalid session is
+    sent once more with the session id the refresher returns.
+    """
+
+    def __init__(self, pool_size=10, max_retries=5, backoff=0.5,
+                 max_backoff=60, timeout=None, session=None,
+                 instrumentation=None, session_refresher=None):
+        self.instrumentation = instrumentation or NULL
+        self.session_refresher = session_refresher
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, headers=None, body=None, stream=False,
+                idempotent=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        refreshed = False
+        while True:
+            start = time.perf_counter()
+            try:
+                resp = self.session.request(method, url, headers=headers,
+                                            data=body, stream=stream,
+                                            timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries or not (
+                        idempotent or request_unsent(e)):
+                    raise
+                self.instrumentation.count('request_retries',
+                                           endpoint=endpoint_name(url))
+                time.sleep(self.retry_delay(None, attempt))
+                attempt += 1
+                continue
+            self.report(method, url, resp, time.perf_counter() - start,
+                        body, stream)
+
+            if not refreshed and self.session_expired(resp, headers):
+                resp.close()
+                headers = with_session(headers, self.session_refresher(
+                    session_id(headers)))
+                refreshed = True
+                continue
+
+            if attempt >= self.max_retries or \
+                    not self.should_retry(resp, idempotent):
+                return resp
+            self.instrumentation.count('request_retries',
+                                       endpoint=endpoint_name(url))
+            delay = self.retry_delay(resp, attempt)
+            resp.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def report(self, method, url, resp, seconds, body, stream):
+        received = 0 if stream else len(resp.content or b'')
+        self.instrumentation.request(method, url, resp.status_code, seconds,
+                                     len(body or b''), received,
+                                     resp.headers.get('Sforce-Limit-Info'))
+
+    def session_expired(self, resp, headers):
+        if self.session_refresher is None or not session_id(headers) or \
+                resp.status_code not in (400, 401):
+            return False
+        content = resp.content or b''
+        return any(code in content for code in INVALID_SESSION_CODES)
+
+    def should_retry(self, resp, idempotent=True):
+        if resp.status_code in (RETRY_STATUSES if idempotent
+                                else REFUSED_STATUSES):
+            return True
+        if resp.status_code >= 400:
+            content = resp.content or b''
+            return any(code.encode() in content for code in THROTTLE_CODES)
+        return False
+
+    def retry_delay(self, resp, attempt):
+        """
+        Honour a Retry-After header when the server sends one, otherwise use
+        exponential backoff with full jitter.
+        """
+        if resp is not None:
+            retry_after = resp.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.max_backoff)
+                except ValueError:
+                    pass
+        delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+        return random.uniform(0, delay)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,123 @@
+import json
+import os
+import re
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'salesforcetools', 'describe')
+
+
+class DescribeCache(object):
+    """
+    Caches SObject describe results per org, in process memory and as JSON
+    files on disk, so repeated formatting and uploads skip the describe call
+    even across process restarts. Entries expire after ttl seconds; pass
+    ttl=None to keep them until invalidated. Set cache_dir=None for a memory
+    only cache.
+
+    field_index() maps lowercase field API names to their describe entries
+    for O(1) lookups.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=24 * 60 * 60):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.memory = {}  # dict of (org, sobject) => (fetched_at, describe, index)
+        self.lock = threading.Lock()
+
+    def org_key(self, sf):
+        # the org id session ids start with, legacy pod hosts serve many orgs
+        session_id = getattr(sf, 'session_id', None)
+        if session_id and '!' in session_id:
+            return session_id.split('!', 1)[0]
+        return getattr(sf, 'sf_instance', None) or 'default'
+
+    def path(self, org, sobject):
+        org = re.sub(r'[^\w.-]', '_', org)
+        return os.path.join(self.cache_dir, org, sobject.lower() + '.json')
+
+    def expired(self, fetched_at):
+        return self.ttl is not None and time.time() - fetched_at > self.ttl
+
+    def entry(self, sf, sobject):
+        key = (self.org_key(sf), sobject.lower())
+        with self.lock:
+            cached = self.memory.get(key)
+        if cached is not None and not self.expired(cached[0]):
+            return cached
+
+        cached = self.load(*key)
+        if cached is None:
+            describe = getattr(sf, sobject).describe()
+            cached = self.build(time.time(), describe)
+            self.save(key[0], key[1], cached[0], describe)
+
+        with self.lock:
+            self.memory[key] = cached
+        return cached
+
+    def build(self, fetched_at, describe):
+        index = {field['name'].lower(): field for field in describe['fields']}
+        return fetched_at, describe, index
+
+    def load(self, org, sobject):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.path(org, sobject), encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.expired(saved['fetched_at']):
+            return None
+        return self.build(saved['fetched_at'], saved['describe'])
+
+    def save(self, org, sobject, fetched_at, describe):
+        if self.cache_dir is None:
+            return
+        path = self.path(org, sobject)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + '.%d.tmp' % os.getpid()
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'fetched_at': fetched_at, 'describe': describe}, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass  # the disk cache is best effort
+
+    def describe(self, sf, sobject):
+        return self.entry(sf, sobject)[1]
+
+    def field_index(self, sf, sobject):
+        return self.entry(sf, sobject)[2]
+
+    def field(self, sf, sobject, name):
+        return self.field_index(sf, sobject).get(name.lower())
+
+    def invalidate(self, sf=None, sobject=None):
+        """
+        Drop cached describes, for one SObject or all of them, for the org
+        of sf or every org.
+        """
+        org = self.org_key(sf) if sf is not None else None
+        with self.lock:
+            for key in list(self.memory):
+                if (org is None or key[0] == org) and \
+                        (sobject is None or key[1] == sobject.lower()):
+                    del self.memory[key]
+
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return
+        orgs = [re.sub(r'[^\w.-]', '_', org)] if org is not None else \
+            os.listdir(self.cache_dir)
+        for org_dir in orgs:
+            directory = os.path.join(self.cache_dir, org_dir)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if sobject is None or name == sobject.lower() + '.json':
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError:
+                        pass
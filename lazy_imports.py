@@ -0,0 +1,37 @@
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module until one of its attributes is used, then
+    imports the real module and hands every attribute lookup to it. The
+    import runs through importlib, so concurrent first uses from several
+    threads are safe.
+    """
+
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_module(name):
+    """
+    The module called name if it is already imported, otherwise a
+    LazyModule that imports it on first use.
+    """
+    return sys.modules.get(name) or LazyModule(name)
@@ -0,0 +1,666 @@
+"""
+A local stand-in for the parts of Salesforce these scripts talk to, for
+offline benchmarks and experiments: the Bulk API 1.0 job, batch and result
+endpoints (queries, PK chunking and ingest), the Bulk API 2.0 query and
+ingest jobs, the REST query, queryMore and queryAll endpoints, sObject
+Collections uploads and sObject describes.
+
+Rows are generated on the fly from their row number, so large result sets
+cost no memory. Latency, row counts, page size, result file splits and
+batch processing time are configurable, and every request is counted.
+
+    python mock_salesforce.py [--rows N] [--port P] [--certfile F --keyfile F]
+"""
+import argparse
+import calendar
+import csv
+import io
+import itertools
+import json
+import re
+import ssl
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+JOB_NS = 'http://www.force.com/2009/06/asyncapi/dataload'
+BASE62 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+INDUSTRIES = ('Energy', 'Banking', 'Retail', 'Technology', 'Healthcare')
+OWNERS = 100
+DEFAULT_SOQL = ('SELECT Id, Name, AnnualRevenue, Industry, CreatedDate, '
+                'Owner.Name FROM Account')
+
+
+def record_id(i, prefix='001'):
+    digits = ''
+    while True:
+        i, r = divmod(i, 62)
+        digits = BASE62[r] + digits
+        if not i:
+            break
+    return prefix + digits.rjust(12, '0') + 'AAA'
+
+
+def timestamp(i):
+    seconds = 1577836800 + i * 37
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000+0000', time.gmtime(seconds))
+
+
+# field name => (describe type, value of row i); parents are dotted paths
+FIELDS = {
+    'id': ('id', record_id),
+    'name': ('string', lambda i: 'Account %d' % i),
+    'annualrevenue': ('currency', lambda i: '%.2f' % (i * 10.5)),
+    'numberofemployees': ('int', lambda i: str(i % 5000)),
+    'industry': ('picklist', lambda i: INDUSTRIES[i % len(INDUSTRIES)]),
+    'createddate': ('datetime', timestamp),
+    'systemmodstamp': ('datetime', timestamp),
+    'isdeleted': ('boolean', lambda i: 'false'),
+    'ownerid': ('reference', lambda i: record_id(i % OWNERS, '005')),
+    'owner.name': ('string', lambda i: 'Owner %d' % (i % OWNERS)),
+}
+
+
+def select_fields(soql):
+    match = re.search(r'select\s+(.*?)\s+from\s', soql, re.I | re.S)
+    fields = match.group(1) if match else 'Id'
+    return [f.strip() for f in fields.split(',') if f.strip()]
+
+
+def field_value(field, i):
+    known = FIELDS.get(field.lower())
+    return known[1](i) if known else ''
+
+
+def first_row(field, value):
+    # the first row whose Id or CreatedDate is at least value
+    if field.lower() == 'id':
+        number = 0
+        for ch in value[3:15]:
+            number = number * 62 + BASE62.index(ch)
+        return number
+    seconds = calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+    return max(0, -(-(seconds - 1577836800) // 37))
+
+
+def query_rows(soql, rows):
+    """
+    The row numbers a REST query returns, in order. Honours the Id and
+    CreatedDate range filters, ORDER BY ... DESC and LIMIT of a sharded
+    query; anything else in the WHERE clause is ignored.
+    """
+    start, stop = 0, rows
+    for field, op, value in re.findall(
+            r"\b(Id|CreatedDate)\s*(>=|<)\s*('[^']*'|[\dT:Z-]+)", soql, re.I):
+        row = min(first_row(field, value.strip("'")), rows)
+        if op == '>=':
+            start = max(start, row)
+        else:
+            stop = min(stop, row)
+    selected = range(start, max(start, stop))
+    if re.search(r'\border\s+by\s+\w+\s+desc\b', soql, re.I):
+        selected = selected[::-1]
+    limit = re.search(r'\blimit\s+(\d+)', soql, re.I)
+    return selected[:int(limit.group(1))] if limit else selected
+
+
+def rest_record(fields, i, object_name='Account'):
+    record = {'attributes': {'type': object_name,
+                             'url': '/services/data/v52.0/sobjects/%s/%s'
+                                    % (object_name, record_id(i))}}
+    for field in fields:
+        value = field_value(field, i)
+        ftype = FIELDS.get(field.lower(), ('string',))[0]
+        if ftype in ('currency', 'int'):
+            value = float(value) if ftype == 'currency' else int(value)
+        elif ftype == 'boolean':
+            value = value == 'true'
+        parts = field.split('.')
+        target = record
+        for part in parts[:-1]:
+            target = target.setdefault(part, {'attributes': {'type': part}})
+        target[parts[-1]] = value
+    return record
+
+
+def describe(object_name):
+    fields = []
+    for name, (ftype, _) in FIELDS.items():
+        if '.' in name:
+            continue
+        field = {'name': name[0].upper() + name[1:], 'type': ftype,
+                 'length': 255 if ftype == 'string' else 0,
+                 'scale': 2 if ftype == 'currency' else 0,
+                 'relationshipName': None, 'referenceTo': []}
+        if name == 'ownerid':
+            field.update(name='OwnerId', relationshipName='Owner',
+                         referenceTo=['User'])
+        fields.append(field)
+    return {'name': object_name, 'fields': fields}
+
+
+class MockConfig(object):
+    """
+    rows             rows every query returns
+    latency          seconds added to every request
+    page_size        records per REST query page
+    result_splits    result files each bulk query batch is split into
+    batch_seconds    seconds a bulk batch stays queued before it completes
+    pk_chunk_size    rows per batch when a job asks for PK chunking without
+                     a chunk size
+    gzip             gzip result files and larger responses for clients that
+                     accept it
+    bulk2_page_size  rows per Bulk API 2.0 result page when the client
+                     doesn't set maxRecords
+    """
+
+    def __init__(self, rows=10000, latency=0.0, page_size=2000,
+                 result_splits=1, batch_seconds=0.0, pk_chunk_size=100000,
+                 gzip=True, bulk2_page_size=100000):
+        self.rows = rows
+        self.latency = latency
+        self.page_size = page_size
+        self.result_splits = result_splits
+        self.batch_seconds = batch_seconds
+        self.pk_chunk_size = pk_chunk_size
+        self.gzip = gzip
+        self.bulk2_page_size = bulk2_page_size
+
+
+class MockState(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.jobs = {}
+        self.batches = {}
+        self.queries = {}
+        self.reset_counts()
+
+    def reset_counts(self):
+        with self.lock:
+            self.calls = {}
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def count(self, endpoint, received=0):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            self.bytes_received += received
+
+    def next_id(self, prefix):
+        return record_id(next(self.ids), prefix)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 31)
+        return body
+
+    def accepts_gzip(self):
+        return self.config.gzip and \
+            'gzip' in self.headers.get('Accept-Encoding', '')
+
+    def send(self, code, body, content_type='application/xml'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        if self.accepts_gzip() and len(body) >= 1024:
+            body = self.gzip_bytes(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.state.lock:
+            self.state.bytes_sent += len(body)
+
+    def send_chunked(self, parts, content_type='text/csv', headers={}):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Transfer-Encoding', 'chunked')
+        if self.accepts_gzip():
+            self.send_header('Content-Encoding', 'gzip')
+            parts = self.gzipped(parts)
+        self.end_headers()
+        sent = 0
+        for part in parts:
+            if part:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(part), part))
+                sent += len(part)
+        self.wfile.write(b'0\r\n\r\n')
+        with self.state.lock:
+            self.state.bytes_sent += sent
+
+    def gzip_bytes(self, body):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+
+    def gzipped(self, parts):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for part in parts:
+            yield compressor.compress(part)
+        yield compressor.flush()
+
+    def send_json(self, data, code=200):
+        self.send(code, json.dumps(data), 'application/json')
+
+    def route(self, method):
+        if self.config.latency:
+            time.sleep(self.config.latency)
+        body = self.read_body() if method in ('POST', 'PUT', 'PATCH') else b''
+        url = urlparse(self.path)
+        for pattern, handler in self.routes:
+            match = re.match(pattern, url.path)
+            if match and handler.__name__.startswith(method.lower()):
+                self.state.count(handler.__name__[len(method) + 1:],
+                                 len(body))
+                return handler(self, body, parse_qs(url.query),
+                               *match.groups())
+        self.state.count('not_found')
+        self.send(404, 'Not Found', 'text/plain')
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_PUT(self):
+        self.route('PUT')
+
+    def do_PATCH(self):
+        self.route('PATCH')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+    # Bulk API 1.0
+
+    def batch_info(self, batch):
+        if batch['state'] == 'Queued' and \
+                time.time() - batch['created'] >= self.config.batch_seconds:
+            batch['state'] = 'Completed'
+            batch['processed'] = batch['rows']
+        return ('<batchInfo><id>%s</id><jobId>%s</jobId><state>%s</state>'
+                '<numberRecordsProcessed>%d</numberRecordsProcessed>'
+                '<numberRecordsFailed>0</numberRecordsFailed></batchInfo>'
+                % (batch['id'], batch['job'], batch['state'],
+                   batch['processed']))
+
+    def add_batch(self, job, start, stop, soql=None, state='Queued'):
+        batch_id = self.state.next_id('751')
+        self.state.batches[batch_id] = {
+            'id': batch_id, 'job': job['id'], 'state': state,
+            'created': time.time(), 'rows': stop - start, 'processed': 0,
+            'start': start, 'soql': soql}
+        job['batches'].append(batch_id)
+        return batch_id
+
+    def post_job(self, body, query):
+        text = body.decode('utf-8')
+        job_id = self.state.next_id('750')
+        chunking = self.headers.get('Sforce-Enable-PKChunking')
+        operation = re.search(r'<operation>(\w+)</operation>', text).group(1)
+        object_name = re.search(r'<object>(\w+)</object>', text).group(1)
+        self.state.jobs[job_id] = {'id': job_id, 'operation': operation,
+                                   'object': object_name, 'batches': [],
+                                   'pk_chunking': chunking, 'state': 'Open'}
+        self.send(201, '<jobInfo xmlns="%s"><id>%s</id><operation>%s'
+                       '</operation><state>Open</state></jobInfo>'
+                  % (JOB_NS, job_id, operation))
+
+    def post_close_job(self, body, query, job_id):
+        self.state.jobs[job_id]['state'] = 'Closed'
+        self.send(200, '<jobInfo xmlns="%s"><id>%s</id><state>Closed</state>'
+                       '</jobInfo>' % (JOB_NS, job_id))
+
+    def get_job(self, body, query, job_id):
+        job = self.state.jobs[job_id]
+        self.send(200, '<jobInfo xmlns="%s"><id>%s</id><operation>%s'
+                       '</operation><state>%s</state></jobInfo>'
+                  % (JOB_NS, job_id, job['operation'], job['state']))
+
+    def post_batch(self, body, query, job_id):
+        job = self.state.jobs[job_id]
+        if job['operation'] in ('query', 'queryAll'):
+            soql = body.decode('utf-8')
+            if job['pk_chunking']:
+                size = re.search(r'chunkSize=(\d+)', job['pk_chunking'])
+                size = int(size.group(1)) if size else \
+                    self.config.pk_chunk_size
+                batch_id = self.add_batch(job, 0, 0, soql, 'NotProcessed')
+                for start in range(0, self.config.rows, size):
+                    self.add_batch(job, start,
+                                   min(start + size, self.config.rows), soql)
+            else:
+                batch_id = self.add_batch(job, 0, self.config.rows, soql)
+        else:
+            rows = sum(1 for _ in csv.reader(io.StringIO(
+                body.decode('utf-8')))) - 1
+            batch_id = self.add_batch(job, 0, rows)
+        self.send(201, '<batchInfo xmlns="%s"><id>%s</id><jobId>%s</jobId>'
+                       '<state>Queued</state></batchInfo>'
+                  % (JOB_NS, batch_id, job_id))
+
+    def get_batch_list(self, body, query, job_id):
+        infos = ''.join(self.batch_info(self.state.batches[batch_id])
+                        for batch_id in self.state.jobs[job_id]['batches'])
+        self.send(200, '<batchInfoList xmlns="%s">%s</batchInfoList>'
+                  % (JOB_NS, infos))
+
+    def get_batch(self, body, query, job_id, batch_id):
+        info = self.batch_info(self.state.batches[batch_id])
+        self.send(200, info.replace('<batchInfo>',
+                                    '<batchInfo xmlns="%s">' % JOB_NS))
+
+    def get_batch_result(self, body, query, job_id, batch_id):
+        job = self.state.jobs[job_id]
+        batch = self.state.batches[batch_id]
+        if job['operation'] in ('query', 'queryAll'):
+            # result ids only need to be unique within their batch
+            results = ''.join('<result>752%s%03dAAA</result>'
+                              % (batch_id[3:12], i)
+                              for i in range(self.config.result_splits))
+            return self.send(200, '<result-list xmlns="%s">%s</result-list>'
+                             % (JOB_NS, results))
+
+        def rows():
+            yield b'"Id","Success","Created","Error"\n'
+            for start in range(0, batch['rows'], 10000):
+                yield ''.join(
+                    '"%s","true","true",""\n' % record_id(batch['start'] + i)
+                    for i in range(start, min(start + 10000, batch['rows']))
+                ).encode('utf-8')
+        self.send_chunked(rows())
+
+    def get_query_result(self, body, query, job_id, batch_id, result_id):
+        batch = self.state.batches[batch_id]
+        splits = self.config.result_splits
+        part = int(result_id[12:15])
+        size = -(-batch['rows'] // splits)
+        start = batch['start'] + part * size
+        stop = min(start + size, batch['start'] + batch['rows'])
+        if stop <= start:
+            return self.send(200, 'Records not found for this query',
+                             'text/plain')
+        fields = select_fields(batch['soql'])
+        getters = [FIELDS.get(f.lower(), (None, lambda i: ''))[1]
+                   for f in fields]
+
+        def rows():
+            yield (','.join('"%s"' % f for f in fields) + '\n').encode()
+            for lo in range(start, stop, 10000):
+                yield ''.join(
+                    ','.join('"%s"' % get(i) for get in getters) + '\n'
+                    for i in range(lo, min(lo + 10000, stop))).encode('utf-8')
+        self.send_chunked(rows())
+
+    # Bulk API 2.0
+
+    def job2_info(self, job):
+        if job['state'] == 'UploadComplete' and \
+                time.time() - job['created'] >= self.config.batch_seconds:
+            job['state'] = 'JobComplete'
+        return {'id': job['id'], 'operation': job['operation'],
+                'object': job['object'], 'state': job['state'],
+                'numberRecordsProcessed':
+                    job['rows'] if job['state'] == 'JobComplete' else 0}
+
+    def new_job2(self, operation, object_name, state, **extra):
+        job_id = self.state.next_id('750')
+        job = {'id': job_id, 'operation': operation, 'object': object_name,
+               'state': state, 'created': time.time(), 'rows': 0}
+        job.update(extra)
+        self.state.jobs[job_id] = job
+        return job
+
+    def post_query_job2(self, body, query, version):
+        request = json.loads(body.decode('utf-8'))
+        match = re.search(r'\bfrom\s+(\w+)', request['query'], re.I)
+        job = self.new_job2(request['operation'],
+                            match.group(1) if match else 'Account',
+                            'UploadComplete', soql=request['query'])
+        job['rows'] = self.config.rows
+        self.send_json(self.job2_info(job))
+
+    def get_query_job2(self, body, query, version, job_id):
+        self.send_json(self.job2_info(self.state.jobs[job_id]))
+
+    def get_query_results2(self, body, query, version, job_id):
+        job = self.state.jobs[job_id]
+        start = int(query.get('locator', ['0'])[0])
+        size = int(query.get('maxRecords', [self.config.bulk2_page_size])[0])
+        stop = min(start + size, job['rows'])
+        fields = select_fields(job['soql'])
+        getters = [FIELDS.get(f.lower(), (None, lambda i: ''))[1]
+                   for f in fields]
+
+        def rows():
+            yield (','.join('"%s"' % f for f in fields) + '\n').encode()
+            for lo in range(start, stop, 10000):
+                yield ''.join(
+                    ','.join('"%s"' % get(i) for get in getters) + '\n'
+                    for i in range(lo, min(lo + 10000, stop))).encode('utf-8')
+        self.send_chunked(rows(), headers={
+            'Sforce-Locator': str(stop) if stop < job['rows'] else 'null',
+            'Sforce-NumberOfRecords': str(stop - start)})
+
+    def post_ingest_job2(self, body, query, version):
+        request = json.loads(body.decode('utf-8'))
+        job = self.new_job2(request['operation'], request['object'], 'Open',
+                            data=b'')
+        self.send_json(self.job2_info(job))
+
+    def put_ingest_data2(self, body, query, version, job_id):
+        job = self.state.jobs[job_id]
+        job['data'] = body
+        job['rows'] = body.count(b'\n') - 1
+        self.send(201, b'', 'text/plain')
+
+    def patch_ingest_job2(self, body, query, version, job_id):
+        job = self.state.jobs[job_id]
+        job['state'] = json.loads(body.decode('utf-8'))['state']
+        job['created'] = time.time()
+        self.send_json(self.job2_info(job))
+
+    def get_ingest_job2(self, body, query, version, job_id):
+        self.send_json(self.job2_info(self.state.jobs[job_id]))
+
+    def get_ingest_results2(self, body, query, version, job_id, kind):
+        job = self.state.jobs[job_id]
+        lines = job['data'].decode('utf-8').splitlines()
+        header = '"sf__Id","sf__Created",' if kind == 'successfulResults' \
+            else '"sf__Id","sf__Error",'
+
+        def rows():
+            yield (header + lines[0] + '\n').encode('utf-8')
+            if kind != 'successfulResults':
+                return
+            # Bulk API 2.0 results come back in no particular order
+            for lo in range(len(lines) - 1, 0, -10000):
+                yield ''.join(
+                    '"%s","true",%s\n' % (record_id(i), lines[i])
+                    for i in range(lo, max(lo - 10000, 0), -1)
+                ).encode('utf-8')
+        self.send_chunked(rows())
+
+    # REST API
+
+    def query_page(self, version, kind, query_id, offset):
+        soql, object_name = self.state.queries[query_id]
+        fields = select_fields(soql)
+        selected = query_rows(soql, self.config.rows)
+        stop = min(offset + self.config.page_size, len(selected))
+        page = {'totalSize': len(selected), 'done': stop >= len(selected),
+                'records': [rest_record(fields, i, object_name)
+                            for i in selected[offset:stop]]}
+        if not page['done']:
+            page['nextRecordsUrl'] = '/services/data/v%s/%s/%s-%d' % (
+                version, kind, query_id, stop)
+        self.send_json(page)
+
+    def get_query(self, body, query, version, kind):
+        soql = query['q'][0]
+        match = re.search(r'\bfrom\s+(\w+)', soql, re.I)
+        query_id = '01g' + self.state.next_id('')[:12]
+        self.state.queries[query_id] = (soql, match.group(1) if match
+                                        else 'Account')
+        self.query_page(version, kind, query_id, 0)
+
+    def get_query_more(self, body, query, version, kind, query_id, offset):
+        self.query_page(version, kind, query_id, int(offset))
+
+    def collection_results(self, records, created):
+        # an upsert creates the records with no Id
+        self.send_json([{'id': record.get('Id') or self.state.next_id('001'),
+                         'success': True, 'errors': [],
+                         **({'created': 'Id' not in record}
+                            if created else {})}
+                        for record in records])
+
+    def post_collection(self, body, query, version, object_name, field):
+        self.collection_results(json.loads(body)['records'], False)
+
+    def patch_collection(self, body, query, version, object_name, field):
+        self.collection_results(json.loads(body)['records'],
+                                object_name is not None)
+
+    def delete_collection(self, body, query, version, object_name, field):
+        self.collection_results([{'Id': i} for i in
+                                 query['ids'][0].split(',')], False)
+
+    def get_describe(self, body, query, version, object_name):
+        self.send_json(describe(object_name))
+
+    routes = [
+        (r'.*/services/async/[\d.]+/job$', post_job),
+        (r'.*/services/async/[\d.]+/job/(\w+)$', post_close_job),
+        (r'.*/services/async/[\d.]+/job/(\w+)$', get_job),
+        (r'.*/services/async/[\d.]+/job/(\w+)/batch$', post_batch),
+        (r'.*/services/async/[\d.]+/job/(\w+)/batch$', get_batch_list),
+        (r'.*/services/async/[\d.]+/job/(\w+)/batch/(\w+)$', get_batch),
+        (r'.*/services/async/[\d.]+/job/(\w+)/batch/(\w+)/result$',
+         get_batch_result),
+        (r'.*/services/async/[\d.]+/job/(\w+)/batch/(\w+)/result/(\w+)$',
+         get_query_result),
+        (r'.*/services/data/v([\d.]+)/jobs/query$', post_query_job2),
+        (r'.*/services/data/v([\d.]+)/jobs/query/(\w+)$', get_query_job2),
+        (r'.*/services/data/v([\d.]+)/jobs/query/(\w+)/results$',
+         get_query_results2),
+        (r'.*/services/data/v([\d.]+)/jobs/ingest$', post_ingest_job2),
+        (r'.*/services/data/v([\d.]+)/jobs/ingest/(\w+)$', patch_ingest_job2),
+        (r'.*/services/data/v([\d.]+)/jobs/ingest/(\w+)$', get_ingest_job2),
+        (r'.*/services/data/v([\d.]+)/jobs/ingest/(\w+)/batches$',
+         put_ingest_data2),
+        (r'.*/services/data/v([\d.]+)/jobs/ingest/(\w+)/'
+         r'(successfulResults|failedResults|unprocessedrecords)/?$',
+         get_ingest_results2),
+        (r'.*/services/data/v([\d.]+)/(query|queryAll)/?$', get_query),
+        (r'.*/services/data/v([\d.]+)/(query|queryAll)/(\w+)-(\d+)$',
+         get_query_more),
+        (r'.*/services/data/v([\d.]+)/composite/sobjects(?:/(\w+)/(\w+))?$',
+         post_collection),
+        (r'.*/services/data/v([\d.]+)/composite/sobjects(?:/(\w+)/(\w+))?$',
+         patch_collection),
+        (r'.*/services/data/v([\d.]+)/composite/sobjects(?:/(\w+)/(\w+))?$',
+         delete_collection),
+        (r'.*/services/data/v([\d.]+)/sobjects/(\w+)/describe/?$',
+         get_describe),
+    ]
+
+
+class MockSalesforce(object):
+    """
+    Runs the mock server on a background thread. host is what
+    SalesforceBulk and simple_salesforce take as the instance; with a
+    certfile the server speaks HTTPS like the real thing, otherwise plain
+    HTTP at url.
+    """
+
+    def __init__(self, config=None, port=0, certfile=None, keyfile=None):
+        self.config = config or MockConfig()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), MockHandler)
+        self.server.daemon_threads = True
+        self.server.config = self.config
+        self.server.state = self.state = MockState()
+        scheme = 'http'
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.server.socket = context.wrap_socket(self.server.socket,
+                                                     server_side=True)
+            scheme = 'https'
+        self.host = '127.0.0.1:%d' % self.server.server_address[1]
+        self.url = '%s://%s' % (scheme, self.host)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def calls(self):
+        """
+        Requests served since the last reset, by endpoint.
+        """
+        with self.state.lock:
+            return dict(self.state.calls)
+
+    def reset(self):
+        self.state.reset_counts()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--page-size', type=int, default=2000)
+    parser.add_argument('--result-splits', type=int, default=1)
+    parser.add_argument('--batch-seconds', type=float, default=0.0)
+    parser.add_argument('--no-gzip', action='store_true')
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    args = parser.parse_args()
+    config = MockConfig(args.rows, args.latency, args.page_size,
+                        args.result_splits, args.batch_seconds,
+                        gzip=not args.no_gzip)
+    mock = MockSalesforce(config, args.port, args.certfile, args.keyfile)
+    print('Serving mock Salesforce on %s' % mock.url)
+    mock.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
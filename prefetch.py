@@ -0,0 +1,55 @@
+import queue
+import threading
+
+
+class Prefetch(object):
+    """
+    Reads an iterator on a background thread, at most buffer values ahead of
+    whoever iterates over this, so producing the next value (e.g. fetching
+    the next page of a query) overlaps with using the current one. Reading
+    starts as soon as the Prefetch is made. An exception raised by the
+    iterator is raised to the reader when it gets there. Iterate over it
+    once; close() stops the thread early.
+    """
+
+    def __init__(self, values, buffer=1):
+        self.queue = queue.Queue(buffer)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.produce, args=(values,),
+                                       daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        # waits for room unless the reader has gone away
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(self, values):
+        try:
+            for value in values:
+                if not self.put((True, value)):
+                    return
+        except BaseException as e:
+            self.put((False, e))
+        else:
+            self.put((False, None))
+
+    def __iter__(self):
+        try:
+            while True:
+                more, value = self.queue.get()
+                if not more:
+                    if value is not None:
+                        raise value
+                    return
+                yield value
+        finally:
+            self.close()
+
+    def close(self):
+        self.stopped.set()
@@ -0,0 +1,115 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bulk2 import RESULT_COLUMNS
+from bulk_metrics import NULL
+from lazy_imports import lazy_module
+
+pd = lazy_module('pandas')
+
+# records per sObject Collections request, the most Salesforce accepts
+COLLECTION_SIZE = 200
+# cells holding this are sent as null, like a bulk upload of #N/A
+NULL_VALUE = '#N/A'
+
+
+def json_value(value):
+    # dates and timestamps as ISO 8601, anything else json can't take as text
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def collection_records(df, object_name):
+    """
+    Rows of df as sObject records. Blank cells, NaN or '' as SFFormat
+    leaves them, are left out so they don't change the field, the same as
+    a bulk upload; #N/A clears it.
+    """
+    records = []
+    for row in df.to_dict('records'):
+        record = {'attributes': {'type': object_name}}
+        for field, value in row.items():
+            if isinstance(value, str):
+                if value == NULL_VALUE:
+                    record[field] = None
+                elif value != '':
+                    record[field] = value
+            elif not pd.isna(value):
+                record[field] = value
+        records.append(record)
+    return records
+
+
+def result_error(errors):
+    # formatted like the Error column of bulk results
+    return '; '.join('%s:%s:%s --' % (e.get('statusCode'), e.get('message'),
+                                      ','.join(e.get('fields') or []))
+                     for e in errors or [])
+
+
+def collection_results(results, operation, index):
+    """
+    The per record results of one sObject Collections request as the
+    sf_id, sf_success, sf_created, sf_error frame bulk uploads return.
+    """
+    return pd.DataFrame({
+        'sf_id': [r.get('id') or '' for r in results],
+        'sf_success': [bool(r.get('success')) for r in results],
+        'sf_created': [bool(r.get('created', operation == 'insert' and
+                                   r.get('success'))) for r in results],
+        'sf_error': [result_error(r.get('errors')) for r in results],
+    }, index=index, columns=RESULT_COLUMNS)
+
+
+def upload_collections(rest, df, object_name, operation,
+                       external_id_name=None, all_or_none=False,
+                       max_workers=4, instrumentation=None):
+    """
+    Insert, update, upsert or delete the rows of df through the REST
+    sObject Collections API, COLLECTION_SIZE rows per request with
+    max_workers requests in flight. rest(path, method=..., **kwargs) makes
+    the call and returns the parsed JSON, e.g. simple_salesforce's
+    Salesforce.restful. all_or_none rolls back every row of a request if
+    one of them fails; requests are committed separately. Returns a
+    DataFrame on df's index with sf_id, sf_success, sf_created and sf_error
+    columns.
+    """
+    instrumentation = instrumentation or NULL
+    operation = operation.lower()
+    if operation not in ('insert', 'update', 'upsert', 'delete'):
+        raise ValueError("Unsupported operation: %s" % operation)
+    if operation == 'upsert' and not external_id_name:
+        raise ValueError("An upsert needs external_id_name")
+    started = time.perf_counter()
+    if operation == 'delete':
+        ids = df[[c for c in df.columns if c.lower() == 'id'][0]].astype(str)
+
+    def send(start):
+        rows = df.iloc[start:start + COLLECTION_SIZE]
+        if operation == 'delete':
+            results = rest('composite/sobjects', method='DELETE', params={
+                'ids': ','.join(ids.iloc[start:start + COLLECTION_SIZE]),
+                'allOrNone': str(bool(all_or_none)).lower()})
+            return collection_results(results, operation, rows.index)
+
+        body = json.dumps({'allOrNone': bool(all_or_none),
+                           'records': collection_records(rows, object_name)},
+                          default=json_value)
+        if operation == 'insert':
+            results = rest('composite/sobjects', method='POST', data=body)
+        elif operation == 'update':
+            results = rest('composite/sobjects', method='PATCH', data=body)
+        else:
+            results = rest('composite/sobjects/%s/%s' % (
+                object_name, external_id_name), method='PATCH', data=body)
+        return collection_results(results, operation, rows.index)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        frames = list(pool.map(send, range(0, len(df), COLLECTION_SIZE)))
+    instrumentation.rows('rest_' + operation, len(df),
+                         time.perf_counter() - started)
+    if not frames:
+        return pd.DataFrame(columns=RESULT_COLUMNS, index=df.index)
+    return pd.concat(frames)
@@ -0,0 +1,134 @@
+from lazy_imports import lazy_module
+
+pd = lazy_module('pandas')
+
+
+def is_child_relationship(value):
+    return isinstance(value, dict) and 'records' in value and \
+        'totalSize' in value
+
+
+def flatten_record(record, keep_attributes=False, prefix=''):
+    """
+    Flatten one REST API record in a single walk. Parent relationships become
+    dotted columns named by relationship path, e.g. Account.Owner.Name, the
+    same headers the Bulk API returns. Child relationship subqueries are
+    returned separately as {relationship: [flattened child records]}.
+    """
+    row = {}
+    children = {}
+    _flatten_into(record, prefix, row, children, keep_attributes)
+    return row, children
+
+
+def _flatten_into(record, prefix, row, children, keep_attributes):
+    for field, value in record.items():
+        if field == 'attributes':
+            if keep_attributes:
+                row[prefix + field] = value
+            continue
+        name = prefix + field
+        if is_child_relationship(value):
+            children[name] = [flatten_record(child, keep_attributes)[0]
+                              for child in value['records']]
+        elif isinstance(value, dict):
+            _flatten_into(value, name + '.', row, children, keep_attributes)
+        else:
+            row[name] = value
+
+
+def records_to_frame(records, keep_attributes=False, multi_index=False,
+                     start=0):
+    """
+    Build a flat DataFrame from REST API records.
+
+    By default each child relationship column holds a dict of
+    {child number: {Relationship.Field: value}} per record. With
+    multi_index=True the children are expanded instead: the frame gets a
+    (record, child) MultiIndex with one row per child record and the parent
+    columns repeated, child relationships lined up side by side.
+
+    start numbers the records from an offset, for building a frame a page
+    at a time.
+    """
+    rows = []
+    child_rows = []
+    for record in records:
+        row, children = flatten_record(record, keep_attributes)
+        rows.append(row)
+        child_rows.append(children)
+
+    if not multi_index:
+        for row, children in zip(rows, child_rows):
+            for name, child_records in children.items():
+                row[name] = {i: {name + '.' + field: value
+                                 for field, value in child.items()}
+                             for i, child in enumerate(child_records)}
+        index = pd.RangeIndex(start, start + len(rows))
+        return drop_parent_placeholders(pd.DataFrame(rows, index=index))
+
+    expanded = []
+    index = []
+    for i, (row, children) in enumerate(zip(rows, child_rows), start):
+        size = max([len(c) for c in children.values()] + [1])
+        for j in range(size):
+            line = dict(row)
+            for name, child_records in children.items():
+                if j < len(child_records):
+                    for field, value in child_records[j].items():
+                        line[name + '.' + field] = value
+            expanded.append(line)
+            index.append((i, j))
+    multi = pd.MultiIndex.from_arrays([[i for i, j in index],
+                                       [j for i, j in index]],
+                                      names=['record', 'child'])
+    return drop_parent_placeholders(pd.DataFrame(expanded, index=multi))
+
+
+def drop_parent_placeholders(df):
+    """
+    A null lookup comes back as Account: None while populated ones flatten
+    to Account.Name etc. Drop the bare column when dotted ones exist.
+    """
+    prefixes = set()
+    for col in df.columns:
+        parts = str(col).split('.')
+        for i in range(1, len(parts)):
+            prefixes.add('.'.join(parts[:i]))
+    drop = [col for col in df.columns if col in prefixes]
+    if drop:
+        df = df.drop(drop, axis=1)
+    return df
+
+
+def to_numeric_columns(df, columns=None):
+    """
+    Convert every column (or just the given ones) that parses cleanly as
+    numbers, leaving the rest as they are.
+    """
+    for col in df.columns if columns is None else columns:
+        try:
+            df[col] = pd.to_numeric(df[col])
+        except (ValueError, TypeError):
+            pass
+    return df
+
+
+def rechunk_frames(frames, chunksize):
+    """
+    Regroup an iterator of DataFrames into DataFrames of exactly chunksize
+    rows, the last one possibly shorter.
+    """
+    buffered = []
+    rows = 0
+    for frame in frames:
+        buffered.append(frame)
+        rows += len(frame)
+        while rows >= chunksize:
+            joined = pd.concat(buffered) if len(buffered) > 1 else buffered[0]
+            yield joined.iloc[:chunksize]
+            rest = joined.iloc[chunksize:]
+            buffered = [rest] if len(rest) else []
+            rows = len(rest)
+    if rows:
+        yield pd.concat(buffered) if len(buffered) > 1 else buffered[0]
@@ -0,0 +1,225 @@
+from lazy_imports import lazy_module
+
+np = lazy_module('numpy')
+pd = lazy_module('pandas')
+
+NUMBER_TYPES = ('double', 'currency', 'percent')
+INTEGER_TYPES = ('int', 'long')
+DATE_FORMATS = {
+    'date': '%Y-%m-%d',
+    'datetime': '%Y-%m-%dT%H:%M:%S',
+}
+BOOLEAN_VALUES = {
+    'true': 'true', '1': 'true', '1.0': 'true', 'yes': 'true',
+    'false': 'false', '0': 'false', '0.0': 'false', 'no': 'false',
+}
+
+
+def format_column(series, field=None, null_value='#N/A', zero_as_null=True):
+    """
+    Format one column for the Bulk API according to its describe field in a
+    single vectorized pass: dates and datetimes to Salesforce formats,
+    checkboxes to true/false, numbers validated (integers written without a
+    decimal point) and text checked against the field length. Nulls, the
+    '#N/A' marker and, with zero_as_null, numeric zeros become null_value.
+
+    Returns (formatted series, error message or None). A column with invalid
+    values is returned with only its nulls filled.
+    """
+    ftype = field['type'] if field else None
+    nulls = series.isna()
+    if series.dtype == object or pd.api.types.is_string_dtype(series):
+        nulls |= series.eq('#N/A')
+    error = None
+    values = series
+
+    if ftype == 'boolean':
+        mapped = series.astype(str).str.strip().str.lower().map(BOOLEAN_VALUES)
+        if (mapped.isna() & ~nulls).any():
+            error = 'Invalid boolean'
+        else:
+            values = mapped
+    elif ftype in DATE_FORMATS:
+        parsed = pd.to_datetime(series.where(~nulls), errors='coerce')
+        if (parsed.isna() & ~nulls).any():
+            error = 'Invalid ' + ftype
+        else:
+            values = parsed.dt.strftime(DATE_FORMATS[ftype])
+    elif ftype in NUMBER_TYPES or ftype in INTEGER_TYPES:
+        numeric = pd.to_numeric(series.where(~nulls), errors='coerce')
+        if (numeric.isna() & ~nulls).any():
+            error = 'Invalid ' + ftype
+        else:
+            if zero_as_null:
+                nulls |= numeric.eq(0)
+            if ftype in INTEGER_TYPES:
+                if (numeric.dropna() % 1 != 0).any():
+                    error = 'Invalid ' + ftype
+                else:
+                    values = numeric.astype('Int64')
+            else:
+                values = numeric
+    else:
+        if zero_as_null and (series.dtype == object or
+                             pd.api.types.is_numeric_dtype(series)) and \
+                not pd.api.types.is_bool_dtype(series):
+            zeros = series.eq(0)
+            if series.dtype == object:
+                # False compares equal to 0 but is a checkbox value
+                zeros &= ~series.map(lambda v: isinstance(v, (bool, np.bool_)))
+            nulls |= zeros
+        length = field.get('length') if field else None
+        if length and ftype not in ('id', 'reference'):
+            too_long = series.astype(str).str.len().gt(length) & ~nulls
+            if too_long.any():
+                error = 'Too long (max %d)' % length
+
+    result = values.astype(object).where(~nulls, null_value)
+    result.name = series.name
+    return result, error
+
+
+def format_frame(df, field_index, object_name, null_value='#N/A',
+                 zero_as_null=True, inplace=True):
+    """
+    Format every column of df with format_column, looking fields up by
+    lowercase column name in field_index. With inplace=True the columns of
+    df are replaced one at a time, otherwise a new DataFrame is built and df
+    is left alone. Returns (DataFrame, list of error lines), missing fields
+    listed before invalid data.
+    """
+    missing = []
+    errors = []
+    columns = {}
+    for col in df.columns:
+        field = field_index.get(str(col).lower())
+        if field is None:
+            missing.append(object_name + " does not contain : " + str(col))
+        formatted, error = format_column(df[col], field, null_value,
+                                         zero_as_null)
+        if error:
+            errors.append(error + " : " + str(col))
+        if inplace:
+            df[col] = formatted
+        else:
+            columns[col] = formatted
+
+    if inplace:
+        return df, missing + errors
+    return pd.DataFrame(columns, index=df.index), missing + errors
+
+
+CATEGORY_TYPES = ('picklist', 'reference', 'combobox')
+
+
+def field_dtype(field):
+    """
+    The compact pandas dtype for a describe field, or None to leave the
+    column as it is (text, ids and anything unrecognised).
+    """
+    ftype = field['type']
+    if ftype in CATEGORY_TYPES:
+        return 'category'
+    if ftype == 'boolean':
+        return 'boolean'
+    if ftype in DATE_FORMATS:
+        return 'datetime64[ns]'
+    if ftype in INTEGER_TYPES:
+        return 'Int64'
+    if ftype in NUMBER_TYPES:
+        return 'Int64' if field.get('scale') == 0 else 'float64'
+    return None
+
+
+def resolve_column_fields(columns, object_name, field_index):
+    """
+    Map query result columns to describe fields, following dotted
+    relationship paths such as Account.Owner.Name through each parent's
+    describe. field_index(object_name) returns the lowercase field index of
+    an object. Columns that don't resolve (aggregates, child relationships)
+    are left out.
+    """
+    return {col: path[-1] for col, path in
+            resolve_column_paths(columns, object_name, field_index).items()}
+
+
+def api_column_names(columns, object_name, field_index):
+    """
+    Map query result columns to the API names of the fields they resolve
+    to, e.g. account.owner.name to Account.Owner.Name. Bulk API results keep
+    the case the SOQL was written in while REST results use API names.
+    Columns that don't resolve are left out.
+    """
+    return {col: '.'.join([f['relationshipName'] for f in path[:-1]] +
+                          [path[-1]['name']])
+            for col, path in resolve_column_paths(columns, object_name,
+                                                  field_index).items()}
+
+
+def resolve_column_paths(columns, object_name, field_index):
+    # {column: [lookup field, ..., field]} for the columns that resolve
+    relationships = {}
+
+    def relationship_index(name):
+        if name not in relationships:
+            relationships[name] = {
+                f['relationshipName'].lower(): f
+                for f in field_index(name).values()
+                if f.get('relationshipName') and f.get('referenceTo')}
+        return relationships[name]
+
+    paths = {}
+    for col in columns:
+        parts = str(col).lower().split('.')
+        current = object_name
+        path = []
+        for part in parts[:-1]:
+            lookup = relationship_index(current).get(part)
+            if lookup is None:
+                current = None
+                break
+            path.append(lookup)
+            current = lookup['referenceTo'][0]
+        if current is None:
+            continue
+        field = field_index(current).get(parts[-1])
+        if field is not None:
+            paths[col] = path + [field]
+    return paths
+
+
+def apply_dtypes(df, fields):
+    """
+    Convert each column in fields ({column: describe field}) to its compact
+    dtype in place: picklists and lookups to categoricals, checkboxes to
+    nullable booleans, dates and datetimes to datetime64, and numbers to
+    Int64 or float64 by scale. Bulk API blanks become nulls in these
+    columns. Returns df.
+    """
+    for col, field in fields.items():
+        dtype = field_dtype(field)
+        if dtype is None:
+            continue
+        series = df[col]
+        if series.dtype == object or pd.api.types.is_string_dtype(series):
+            series = series.mask(series.eq(''))
+
+        if dtype == 'category':
+            df[col] = series.astype('category')
+        elif dtype == 'boolean':
+            if not pd.api.types.is_bool_dtype(series):
+                series = series.map({True: True, False: False,
+                                     'true': True, 'false': False})
+            df[col] = series.astype('boolean')
+        elif dtype == 'datetime64[ns]':
+            if field['type'] == 'datetime':
+                df[col] = pd.to_datetime(series, utc=True, errors='coerce')
+            else:
+                df[col] = pd.to_datetime(series, errors='coerce')
+        else:
+            numeric = pd.to_numeric(series, errors='coerce')
+            if dtype == 'Int64' and (numeric.dropna() % 1 == 0).all():
+                df[col] = numeric.astype('Int64')
+            else:
+                df[col] = numeric.astype('float64')
+    return df
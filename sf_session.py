@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+
+from lazy_imports import lazy_module
+
+simple_salesforce = lazy_module('simple_salesforce')
+requests = lazy_module('requests')
+
+DEFAULT_SESSION_CACHE = os.path.join(os.path.expanduser('~'), '.cache',
+                                     'salesforcetools', 'sessions.json')
+
+# login setting => environment variable read when it isn't configured
+ENVIRONMENT = {
+    'username': 'SF_USERNAME',
+    'password': 'SF_PASSWORD',
+    'security_token': 'SF_SECURITY_TOKEN',
+    'domain': 'SF_DOMAIN',
+    'sandbox': 'SF_SANDBOX',
+    'client_id': 'SF_CLIENT_ID',
+    'session_id': 'SF_SESSION_ID',
+    'instance': 'SF_INSTANCE',
+    'version': 'SF_VERSION',
+}
+
+
+class SessionCache(object):
+    """
+    Session ids and instances by login in a JSON file only the current user
+    can read, so separate processes reuse one login until Salesforce
+    expires it.
+    """
+
+    def __init__(self, path=DEFAULT_SESSION_CACHE):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def key(self, username, domain):
+        return '%s@%s' % (username, domain or 'login')
+
+    def read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write(self, sessions):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.%d.tmp' % os.getpid()
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(sessions, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass  # the cache is best effort, the next run logs in again
+
+    def load(self, key):
+        return self.read().get(key)
+
+    def save(self, key, session_id, instance):
+        with self.lock:
+            sessions = self.read()
+            sessions[key] = {'session_id': session_id, 'instance': instance,
+                             'saved_at': time.time()}
+            self.write(sessions)
+
+    def clear(self, key):
+        with self.lock:
+            sessions = self.read()
+            if sessions.pop(key, None) is not None:
+                self.write(sessions)
+
+
+class DeferredCall(object):
+    """
+    A method or SObject of the client reached through LazySalesforce, e.g.
+    sf.query or sf.Account.describe, looked up again on the current client
+    each time it is called so a refreshed login is used.
+    """
+
+    def __init__(self, lazy, path):
+        self.lazy = lazy
+        self.path = path
+
+    def __getattr__(self, name):
+        return DeferredCall(self.lazy, self.path + (name,))
+
+    def __call__(self, *args, **kwargs):
+        return self.lazy.call(self.path, args, kwargs)
+
+
+class LazySalesforce(object):
+    """
+    Stands in for a simple_salesforce.Salesforce login that is only made
+    the first time it is used. Settings come from configure() or the SF_*
+    environment variables in ENVIRONMENT. After a username and password
+    login the session id is saved to session_cache and reused by later
+    processes, pass session_cache=False to turn that off. A call that fails
+    with an expired or invalid session logs in again and is retried once.
+
+    Plain attributes such as session_id and sf_instance come straight from
+    the current client; methods and SObjects are wrapped so the retry
+    applies to them.
+    """
+
+    def __init__(self, session_cache=None, **settings):
+        self.session_cache = SessionCache() if session_cache is None \
+            else session_cache
+        self.settings = settings
+        self.client_override = None
+        self._client = None
+        self._session = None
+        self._lock = threading.RLock()
+
+    def configure(self, client=None, session_cache=None, **settings):
+        """
+        Replace the login settings, or use an existing client as is. Takes
+        the same keyword arguments as simple_salesforce.Salesforce plus
+        sandbox=True for domain='test'. The next use logs in again.
+        """
+        with self._lock:
+            self.settings = settings
+            self.client_override = client
+            if session_cache is not None:
+                self.session_cache = session_cache
+            self._client = None
+
+    def setting(self, name):
+        value = self.settings.get(name)
+        if value is None:
+            value = os.environ.get(ENVIRONMENT[name]) or None
+        return value
+
+    def domain(self):
+        domain = self.setting('domain')
+        sandbox = self.setting('sandbox')
+        if domain is None and sandbox and \
+                str(sandbox).lower() not in ('0', 'false', 'no'):
+            domain = 'test'
+        return domain
+
+    def cache_key(self):
+        return self.session_cache.key(self.setting('username'), self.domain())
+
+    def http_session(self):
+        # one requests session for every login, so hooks and pooled
+        # connections survive a refresh
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def connect(self, fresh=False):
+        if self.client_override is not None:
+            return self.client_override
+        options = {'session': self.http_session()}
+        if self.setting('version'):
+            options['version'] = self.setting('version')
+
+        if self.setting('session_id'):
+            return simple_salesforce.Salesforce(
+                session_id=self.setting('session_id'),
+                instance=self.setting('instance'), **options)
+
+        if self.setting('username') is None:
+            raise ValueError("Salesforce login is not configured, call "
+                             "SFConfigure() or set SF_USERNAME and "
+                             "SF_PASSWORD")
+        key = self.cache_key()
+        cached = None if fresh or not self.session_cache else \
+            self.session_cache.load(key)
+        if cached:
+            return simple_salesforce.Salesforce(
+                session_id=cached['session_id'], instance=cached['instance'],
+                **options)
+
+        client = simple_salesforce.Salesforce(
+            username=self.setting('username'),
+            password=self.setting('password'),
+            security_token=self.setting('security_token') or '',
+            domain=self.domain(), client_id=self.setting('client_id'),
+            **options)
+        if self.session_cache:
+            self.session_cache.save(key, client.session_id,
+                                    client.sf_instance)
+        return client
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self.connect()
+            return self._client
+
+    def can_refresh(self):
+        return self.client_override is None and \
+            not self.setting('session_id') and \
+            self.setting('username') is not None
+
+    def refresh(self, stale_session_id=None):
+        """
+        Log in again, skipping the session cache, unless another thread
+        already replaced stale_session_id. Returns the current client.
+        """
+        with self._lock:
+            if self._client is not None and stale_session_id is not None \
+                    and self._client.session_id != stale_session_id:
+                return self._client
+            if self.session_cache:
+                self.session_cache.clear(self.cache_key())
+            self._client = self.connect(fresh=True)
+            return self._client
+
+    def refresh_session_id(self, stale_session_id=None):
+        return self.refresh(stale_session_id).session_id
+
+    def call(self, path, args, kwargs):
+        client = self.client()
+        try:
+            return self.resolve(client, path)(*args, **kwargs)
+        except simple_salesforce.SalesforceExpiredSession:
+            if not self.can_refresh():
+                raise
+            client = self.refresh(client.session_id)
+            return self.resolve(client, path)(*args, **kwargs)
+
+    def resolve(self, client, path):
+        target = client
+        for name in path:
+            target = getattr(target, name)
+        return target
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        value = getattr(self.client(), name)
+        if callable(value) or isinstance(value, simple_salesforce.SFType):
+            return DeferredCall(self, (name,))
+        return value
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+
+from lazy_imports import lazy_module
+
+pd = lazy_module('pandas')
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'salesforcetools', 'sync')
+WATERMARK_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def column(df, name):
+    """
+    The column of df named name in any case, or None. Bulk results keep the
+    case the SOQL was written in, REST results use the API name.
+    """
+    for col in df.columns:
+        if str(col).lower() == name.lower():
+            return col
+    return None
+
+
+def watermark(values, current=None):
+    """
+    The latest SystemModstamp in values as a SOQL datetime literal, or
+    current if values is empty or older.
+    """
+    stamps = pd.to_datetime(pd.Series(values), utc=True, errors='coerce')
+    latest = stamps.max()
+    if current is not None and (pd.isna(latest) or
+                                latest < pd.Timestamp(current)):
+        return current
+    if pd.isna(latest):
+        return None
+    return latest.strftime(WATERMARK_FORMAT)
+
+
+def shift_watermark(value, seconds):
+    """
+    The watermark moved back by seconds, to pick up rows committed late by
+    long transactions. Rows seen twice are harmless since merges upsert.
+    """
+    stamp = pd.Timestamp(value) - pd.Timedelta(seconds=seconds)
+    return stamp.strftime(WATERMARK_FORMAT)
+
+
+def upsert_frame(cached, changes, id_column, removed_ids=()):
+    """
+    Merge changed rows into cached by Id: rows with an Id in changes replace
+    the cached row, new Ids are appended and removed_ids are dropped.
+    Returns a new DataFrame with a fresh RangeIndex.
+    """
+    if cached is None or cached.empty:
+        return changes.reset_index(drop=True)
+    drop = set(changes[id_column]) | set(removed_ids)
+    kept = cached[~cached[id_column].isin(drop)]
+    merged = pd.concat([kept, changes]) if len(changes) else kept
+    return merged.reset_index(drop=True)
+
+
+class SyncCache(object):
+    """
+    Local Parquet copies of query results with the sync state (the
+    SystemModstamp watermark and when the copy was last synced) in a JSON
+    file next to each one. Entries are keyed by org and SOQL, so the same
+    query against a sandbox and production gets separate copies. Parquet
+    requires pyarrow.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def paths(self, org, object_name, soql):
+        key = hashlib.sha1(('%s\n%s' % (org, ' '.join(soql.split())))
+                           .encode('utf-8')).hexdigest()[:16]
+        base = os.path.join(self.cache_dir, '%s_%s' % (object_name, key))
+        return base + '.parquet', base + '.json'
+
+    def load(self, org, object_name, soql):
+        """
+        Returns (DataFrame, state dict), or (None, {}) if nothing is cached.
+        """
+        data, state = self.paths(org, object_name, soql)
+        try:
+            with open(state, encoding='utf-8') as f:
+                saved = json.load(f)
+            return pd.read_parquet(data), saved
+        except (OSError, ValueError):
+            return None, {}
+
+    def save(self, org, object_name, soql, df, state):
+        data, state_path = self.paths(org, object_name, soql)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = data + '.%d.tmp' % os.getpid()
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, data)
+        # the state is written last so a crash in between only means rows
+        # newer than the old watermark are fetched again
+        tmp = state_path + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(dict(state, soql=soql, object=object_name), f)
+        os.replace(tmp, state_path)
+
+    def clear(self, org, object_name, soql):
+        for path in self.paths(org, object_name, soql):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from AsyncSalesforceBulkQuery import AsyncSalesforceBulk
+
+
+class FakeContent(object):
+    def __init__(self, content):
+        self.content = content
+        self.total_bytes = len(content)
+
+    async def iter_any(self):
+        yield self.content
+
+
+class FakeResponse(object):
+    def __init__(self, status, content=b''):
+        self.status = status
+        self.headers = {}
+        self.content = FakeContent(content)
+
+    async def read(self):
+        return self.content.content
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakeSession(object):
+    # plays back responses, one per request
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url.rsplit('/', 1)[-1]))
+        return self.responses.pop(0)
+
+
+def test_batch_results_retry_a_throttled_download():
+    results = b'<result-list xmlns="http://www.force.com/2009/06/asyncapi/dataload"><result>752</result></result-list>'
+    bulk = AsyncSalesforceBulk(sessionId='x', host='example.com', backoff=0)
+    bulk.session = FakeSession(FakeResponse(200, results), FakeResponse(503),
+                               FakeResponse(200, b'"Id"\n"001"\n"002"\n'))
+
+    async def download():
+        return [chunk async for chunk in bulk.iter_batch_result_chunks('750', '751')]
+
+    chunks = asyncio.run(download())
+    assert list(chunks[0]['Id']) == ['001', '002']
+    assert bulk.session.calls == [('GET', 'result'), ('GET', '752'), ('GET', '752')]
@@ -0,0 +1,66 @@
+import pandas as pd
+
+from bulk2 import RESULT_COLUMNS, SalesforceBulk2
+
+
+def bulk2Client(succeeded, failed):
+    # a client whose ingest job results are the given rows, served in the order given
+    bulk = SalesforceBulk2(sessionId='x', host='example.com', transport=object())
+    frames = {
+        'successfulResults': pd.DataFrame(succeeded, columns=['sf__Id', 'sf__Created', 'Name', 'Phone'], dtype=str),
+        'failedResults': pd.DataFrame(failed, columns=['sf__Id', 'sf__Error', 'Name', 'Phone'], dtype=str),
+    }
+    bulk.get_job_results = lambda job_id, kind: frames[kind]
+    return bulk
+
+
+def test_match_results_pairs_duplicate_rows_one_to_one():
+    data = b'Name,Phone\nacme,1\nacme,1\nacme,1\nbeta,2\n'
+    bulk = bulk2Client(succeeded=[['001B', 'false', 'beta', '2'], ['001A', 'true', 'acme', '1']],
+                       failed=[['', 'DUPLICATE_VALUE:dup --', 'acme', '1']])
+    results = bulk.match_results('750', data, pd.Index([10, 10, 11, 12]))
+
+    assert list(results.columns) == RESULT_COLUMNS
+    assert list(results.index) == [10, 10, 11, 12]
+    assert list(results['sf_id']) == ['001A', '', '', '001B']
+    assert list(results['sf_success']) == [True, False, False, True]
+    assert list(results['sf_created']) == [True, False, False, False]
+    assert list(results['sf_error']) == ['', 'DUPLICATE_VALUE:dup --', 'Not processed', '']
+
+
+def test_match_results_marks_every_row_unprocessed_without_results():
+    bulk = bulk2Client(succeeded=[], failed=[])
+    results = bulk.match_results('750', b'Name,Phone\nacme,1\nacme,1\n', pd.RangeIndex(2))
+    assert list(results['sf_success']) == [False, False]
+    assert list(results['sf_error']) == ['Not processed', 'Not processed']
+
+
+def test_upload_frame_serializes_pieces_as_workers_free_up(monkeypatch):
+    import SalesforceBulkQuery
+    df = pd.DataFrame({'Name': ['n%05d' % i for i in range(2000)], 'Phone': '555'})
+    bulk = SalesforceBulk2(sessionId='x', host='example.com', transport=object())
+    serialized = []
+    in_flight = []
+    jobs = []
+    real_csv_batches = SalesforceBulkQuery.csv_batches
+
+    def csv_batches(*args, **kwargs):
+        for start, stop, data in real_csv_batches(*args, **kwargs):
+            serialized.append(start)
+            in_flight.append(len(serialized) - len(jobs))
+            yield start, stop, data
+
+    def upload_csv(object_name, operation, data, external_id_name=None, timeout=None):
+        jobs.append(operation)
+        return '750%d' % len(jobs)
+
+    monkeypatch.setattr('bulk2.csv_batches', csv_batches)
+    bulk.upload_csv = upload_csv
+    bulk.match_results = lambda job_id, data, index: pd.DataFrame(
+        {'sf_id': job_id, 'sf_success': True, 'sf_created': False, 'sf_error': ''}, index=index)
+    results = bulk.upload_frame(df, 'Account', 'HardDelete', max_workers=2, max_bytes=2000)
+
+    assert len(jobs) > 10
+    assert set(jobs) == {'hardDelete'}
+    assert max(in_flight) <= 2
+    assert list(results.index) == list(df.index)
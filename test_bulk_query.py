@@ -0,0 +1,268 @@
+import io
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from SalesforceBulkQuery import NO_RECORDS, BulkBatchFailed, BulkPoller, \
+    SalesforceBulk, bounded_map, concat_chunks, csv_batches, read_result_csv, \
+    write_result_chunks
+from bulk_checkpoint import JobStore
+from sf_records import records_to_frame
+
+
+class FakeBulk(SalesforceBulk):
+    # a bulk client whose batch lists are played back from a script, one list per poll
+    def __init__(self, *batch_lists, pk_chunked=False):
+        super(FakeBulk, self).__init__(sessionId='x', host='example.com', transport=object())
+        self.batch_lists = list(batch_lists)
+        self.downloads = []
+        self.lock = threading.Lock()
+        if pk_chunked:
+            self.pk_chunked_jobs.add('750')
+
+    def get_batch_list(self, job_id):
+        if len(self.batch_lists) > 1:
+            return self.batch_lists.pop(0)
+        return self.batch_lists[0]
+
+    def iter_batch_result_chunks(self, job_id, batch_id, chunksize=100000):
+        with self.lock:
+            self.downloads.append(batch_id)
+        yield pd.DataFrame({'Id': [batch_id]})
+
+
+def batches(*states, processed=0):
+    return [{'id': '751%d' % i, 'state': state, 'numberRecordsProcessed': str(processed)}
+            for i, state in enumerate(states)]
+
+
+def test_read_result_csv_reads_no_records_body_as_empty():
+    assert list(read_result_csv(io.BytesIO(NO_RECORDS))) == []
+    assert concat_chunks(read_result_csv(io.BytesIO(NO_RECORDS))).empty
+
+
+def test_read_result_csv_reads_header_only_body_as_empty():
+    chunks = list(read_result_csv(io.BytesIO(b'"Id","Name"\n')))
+    assert sum(len(chunk) for chunk in chunks) == 0
+
+
+def test_read_result_csv_keeps_text_and_blanks_across_chunks():
+    body = b'"Id","Name","Amount"\n' + b''.join(
+        b'"001%03d","n,%d","%s"\n' % (i, i, b'' if i % 2 else b'01') for i in range(25))
+    chunks = list(read_result_csv(io.BytesIO(body), chunksize=10))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    df = concat_chunks(chunks)
+    assert list(df['Id'][:2]) == ['001000', '001001']
+    assert list(df['Name'][:2]) == ['n,0', 'n,1']
+    assert list(df['Amount'][:2]) == ['01', '']
+
+
+def test_read_result_csv_reads_a_body_shorter_than_no_records():
+    df = concat_chunks(read_result_csv(io.BytesIO(b'Id\n1\n')))
+    assert list(df['Id']) == ['1']
+
+
+def test_poller_reports_each_batch_once_and_skips_the_pk_chunking_original():
+    bulk = FakeBulk(batches('NotProcessed', 'InProgress', 'Completed'),
+                    batches('NotProcessed', 'Completed', 'Completed'), pk_chunked=True)
+    completed = []
+    poller = BulkPoller(bulk, min_interval=0)
+    poller.watch('750', on_complete=lambda job_id, batch_id, status: completed.append(batch_id))
+    poller.run()
+    assert completed == ['7512', '7511']
+
+
+def test_poller_backs_off_while_nothing_moves():
+    bulk = FakeBulk(batches('InProgress'))
+    poller = BulkPoller(bulk, min_interval=1, max_interval=8)
+    poller.watch('750')
+    intervals = []
+    for _ in range(5):
+        poller.watched['750']['next_poll'] = 0
+        poller.step()
+        intervals.append(poller.watched['750']['interval'])
+    assert intervals == [1, 2, 4, 8, 8]
+
+
+def test_poller_raises_for_a_failed_batch_without_on_error():
+    poller = BulkPoller(FakeBulk(batches('Completed', 'Failed')), min_interval=0)
+    poller.watch('750')
+    with pytest.raises(BulkBatchFailed):
+        poller.run()
+
+
+def test_iter_job_result_chunks_downloads_at_most_max_workers_ahead():
+    bulk = FakeBulk(batches(*['Completed'] * 20))
+    yielded = []
+    ahead = []
+    for chunk in bulk.iter_job_result_chunks('750', max_workers=3, min_interval=0):
+        time.sleep(0.01)
+        yielded.append(chunk['Id'][0])
+        ahead.append(len(bulk.downloads) - len(yielded))
+    assert sorted(yielded) == sorted('751%d' % i for i in range(20))
+    assert max(ahead) <= 3
+
+
+def lookupPages():
+    # a null Owner lookup on the first page, populated ones and a new field on the second
+    first = [{'Id': '1', 'Name': 'a', 'Owner': None}]
+    second = [{'Id': '2', 'Name': 'b', 'Owner': {'attributes': {}, 'Name': 'o'}, 'Phone': '555'}]
+    return [records_to_frame(first), records_to_frame(second, start=1)]
+
+
+def test_records_to_frame_drops_the_null_lookup_placeholder():
+    first, second = lookupPages()
+    assert list(first.columns) == ['Id', 'Name', 'Owner']
+    assert list(second.columns) == ['Id', 'Name', 'Owner.Name', 'Phone']
+
+
+def test_write_csv_chunks_keeps_every_column(tmp_path):
+    path = str(tmp_path / 'out.csv')
+    assert write_result_chunks(iter(lookupPages()), path) == 2
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    assert list(df.columns) == ['Id', 'Name', 'Owner.Name', 'Phone']
+    assert df.to_dict('records') == [{'Id': '1', 'Name': 'a', 'Owner.Name': '', 'Phone': ''},
+                                     {'Id': '2', 'Name': 'b', 'Owner.Name': 'o', 'Phone': '555'}]
+
+
+def test_write_parquet_chunks_keeps_every_column_and_types_late_values(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = str(tmp_path / 'out.parquet')
+    first = pd.DataFrame({'Id': ['1'], 'Amount': [None]})
+    second = pd.DataFrame({'Id': ['2'], 'Amount': [1.5], 'Phone': ['555']})
+    assert write_result_chunks(iter([first, second]), path) == 2
+    df = pd.read_parquet(path)
+    assert list(df.columns) == ['Id', 'Amount', 'Phone']
+    assert df['Amount'].tolist()[1] == 1.5
+    assert df['Phone'].isna().tolist() == [True, False]
+    assert df['Phone'].tolist()[1] == '555'
+
+
+class FakeUploadBulk(FakeBulk):
+    # posts batches into memory; batches holding a row named 'bad' fail
+    def __init__(self):
+        super(FakeUploadBulk, self).__init__([])
+        self.posted = {}
+        self.operations = []
+
+    def create_job(self, object_name=None, operation=None, **kwargs):
+        self.operations.append(operation)
+        return '750'
+
+    def close_job(self, job_id):
+        pass
+
+    def post_batch(self, job_id, data):
+        rows = concat_chunks(read_result_csv(io.BytesIO(data)))
+        with self.lock:
+            batch_id = '751%d' % len(self.posted)
+            self.posted[batch_id] = rows
+        return batch_id
+
+    def get_batch_list(self, job_id):
+        return [{'id': batch_id, 'state': 'Failed' if (rows['Name'] == 'bad').any() else 'Completed',
+                 'stateMessage': 'InvalidBatch'} for batch_id, rows in self.posted.items()]
+
+    def get_batch_results(self, job_id, batch_id):
+        rows = self.posted[batch_id]
+        return pd.DataFrame({'Id': ['001' + name for name in rows['Name']], 'Success': 'true',
+                             'Created': 'true', 'Error': ''})
+
+
+def test_csv_batches_stay_within_limits_and_cover_every_row():
+    df = pd.DataFrame({'Name': ['x' * (i % 50) for i in range(5000)]})
+    pieces = list(csv_batches(df, max_records=1000, max_bytes=20000))
+    assert pieces[0][0] == 0 and pieces[-1][1] == len(df)
+    assert all(stop == start for (_, stop, _), (start, _, _) in zip(pieces, pieces[1:]))
+    assert all(stop - start <= 1000 and len(data) <= 20000 for start, stop, data in pieces)
+    assert sum(len(concat_chunks(read_result_csv(io.BytesIO(data)))) for _, _, data in pieces) == len(df)
+
+
+def test_csv_batches_serializes_each_row_about_once(monkeypatch):
+    df = pd.DataFrame({'Name': ['name %d' % i for i in range(20000)]})
+    serialized = []
+    to_csv = pd.DataFrame.to_csv
+    monkeypatch.setattr(pd.DataFrame, 'to_csv', lambda self, *a, **k: serialized.append(len(self)) or to_csv(self, *a, **k))
+    list(csv_batches(df, max_records=10 ** 6, max_bytes=20000))
+    assert sum(serialized) < 1.2 * len(df)
+
+
+def test_bounded_map_reads_items_only_as_results_are_taken():
+    taken = []
+
+    def items():
+        for i in range(10):
+            taken.append(i)
+            yield i
+
+    results = bounded_map(lambda i: i * 2, items(), 2)
+    assert next(results) == 0
+    assert len(taken) == 2
+    assert list(results) == [2 * i for i in range(1, 10)]
+
+
+def test_upload_frame_lines_results_up_with_duplicate_labels_and_failed_batches():
+    bulk = FakeUploadBulk()
+    df = pd.DataFrame({'Name': ['a', 'b', 'bad', 'c']}, index=[7, 7, 8, 8])
+    results = bulk.upload_frame(df, 'Account', 'HardDelete', batch_size=2)
+    assert bulk.operations == ['hardDelete']
+    assert list(results.index) == [7, 7, 8, 8]
+    assert list(results['sf_id']) == ['001a', '001b', '', '']
+    assert list(results['sf_success']) == [True, True, False, False]
+    assert list(results['sf_error']) == ['', '', 'InvalidBatch', 'InvalidBatch']
+
+
+class FakeJobBulk(FakeBulk):
+    # a checkpointed bulk client whose earlier job is in the given state with the given batches
+    def __init__(self, store, state, batch_list):
+        super(FakeJobBulk, self).__init__(batch_list)
+        self.store = store
+        self.state = state
+
+    def job_status(self, job_id):
+        return {'id': job_id, 'state': self.state}
+
+    def create_job(self, object_name=None, operation=None, **kwargs):
+        self.store.record_job('750new', object_name, operation)
+        return '750new'
+
+    def post_batch(self, job_id, data):
+        return '751' + job_id
+
+    def close_job(self, job_id):
+        self.store.close_job(job_id)
+
+
+def checkpoint(tmp_path):
+    store = JobStore(str(tmp_path / 'checkpoint.db'))
+    store.record_job('750old', 'Account', 'query', query_key='key')
+    store.record_batch('750old', '751old', 'SELECT Id FROM Account')
+    store.close_job('750old')
+    return store
+
+
+def test_resumable_query_job_reattaches_to_a_running_job(tmp_path):
+    store = checkpoint(tmp_path)
+    bulk = FakeJobBulk(store, 'Closed', batches('InProgress'))
+    assert bulk.resumable_query_job('Account', ['SELECT Id FROM Account'], 'key') == '750old'
+
+
+@pytest.mark.parametrize('state, batch_state', [('Aborted', 'Completed'), ('Failed', 'Completed'),
+                                                ('Closed', 'Failed')])
+def test_resumable_query_job_replaces_a_dead_job(tmp_path, state, batch_state):
+    store = checkpoint(tmp_path)
+    bulk = FakeJobBulk(store, state, batches(batch_state))
+    assert bulk.resumable_query_job('Account', ['SELECT Id FROM Account'], 'key') == '750new'
+    assert store.job('750old')['finished'] == 1
+    assert store.find_job('key') == '750new'
+    assert store.job('750new')['closed'] == 1
+
+
+def test_download_job_results_finishes_a_job_whose_batch_fails(tmp_path):
+    store = checkpoint(tmp_path)
+    bulk = FakeJobBulk(store, 'Closed', batches('Failed'))
+    with pytest.raises(BulkBatchFailed):
+        bulk.download_job_results('750old', str(tmp_path / 'results'), min_interval=0)
+    assert store.find_job('key') is None
@@ -0,0 +1,78 @@
+import pytest
+import requests
+import urllib3
+
+from bulk_transport import RequestsTransport
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content=b''):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    # plays back responses or exceptions, one per request
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def request(self, method, url, **kwargs):
+        self.calls.append(method)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def transport(*outcomes):
+    return RequestsTransport(session=FakeSession(*outcomes), backoff=0)
+
+
+def refused():
+    reason = urllib3.exceptions.NewConnectionError(None, 'Connection refused')
+    return requests.ConnectionError(urllib3.exceptions.MaxRetryError(None, '/job', reason))
+
+
+@pytest.mark.parametrize('outcome', [FakeResponse(502), FakeResponse(500), requests.ReadTimeout()])
+def test_get_retries_server_errors_and_timeouts(outcome):
+    t = transport(outcome, FakeResponse(200))
+    assert t.request('GET', 'https://example.com/job/1').status_code == 200
+    assert t.session.calls == ['GET', 'GET']
+
+
+@pytest.mark.parametrize('outcome', [FakeResponse(502), FakeResponse(500), FakeResponse(504)])
+def test_post_is_not_resent_after_it_may_have_been_processed(outcome):
+    t = transport(outcome, FakeResponse(201))
+    assert t.request('POST', 'https://example.com/job', body='<jobInfo/>').status_code == outcome.status_code
+    assert t.session.calls == ['POST']
+
+
+def test_post_is_not_resent_after_a_read_timeout():
+    t = transport(requests.ReadTimeout(), FakeResponse(201))
+    with pytest.raises(requests.ReadTimeout):
+        t.request('POST', 'https://example.com/job', body='<jobInfo/>')
+    assert t.session.calls == ['POST']
+
+
+@pytest.mark.parametrize('outcome', [
+    FakeResponse(429), FakeResponse(503), FakeResponse(400, b'<exceptionCode>ExceededQuota</exceptionCode>'),
+    requests.ConnectTimeout(), refused(),
+])
+def test_post_retries_when_it_was_turned_away(outcome):
+    t = transport(outcome, FakeResponse(201))
+    assert t.request('POST', 'https://example.com/job', body='<jobInfo/>').status_code == 201
+    assert t.session.calls == ['POST', 'POST']
+
+
+def test_idempotent_post_keeps_the_full_retry_policy():
+    t = transport(FakeResponse(502), requests.ReadTimeout(), FakeResponse(200))
+    assert t.request('POST', 'https://example.com/job/1', body='<jobInfo/>', idempotent=True).status_code == 200
+    assert t.session.calls == ['POST', 'POST', 'POST']
@@ -0,0 +1,31 @@
+from describe_cache import DescribeCache
+
+
+class FakeSObject(object):
+    def __init__(self, org):
+        self.org = org
+
+    def describe(self):
+        return {'fields': [{'name': 'Name', 'org': self.org}]}
+
+
+class FakeOrg(object):
+    # one org on a shared pod host
+    sf_instance = 'na1.salesforce.com'
+
+    def __init__(self, org_id):
+        self.session_id = org_id + '!AQ0Ad'
+        self.Account = FakeSObject(org_id)
+
+
+def test_orgs_on_the_same_host_get_their_own_describes(tmp_path):
+    cache = DescribeCache(cache_dir=str(tmp_path))
+    assert cache.field(FakeOrg('00D000000000001'), 'Account', 'name')['org'] == '00D000000000001'
+    assert cache.field(FakeOrg('00D000000000002'), 'Account', 'name')['org'] == '00D000000000002'
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['00D000000000001', '00D000000000002']
+
+
+def test_org_key_falls_back_to_the_instance():
+    org = FakeOrg('x')
+    org.session_id = None
+    assert DescribeCache(cache_dir=None).org_key(org) == 'na1.salesforce.com'
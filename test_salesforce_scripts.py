@@ -0,0 +1,208 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+import SalesforceScripts as ss
+
+
+def test_upload_results_attach_by_position_with_duplicate_labels():
+    df = pd.DataFrame({'Name': ['a', 'b', 'c']}, index=[5, 5, 6])
+    results = pd.DataFrame({'sf_id': ['001a', '001b', ''], 'sf_success': [True, True, False],
+                            'sf_created': [True, False, False], 'sf_error': ['', '', 'x']}, index=[5, 5, 6])
+    uploaded = ss.uploadResults(df, results)
+    assert list(uploaded.index) == [5, 5, 6]
+    assert list(uploaded.columns) == ['Name'] + ss.RESULT_COLUMNS
+    assert list(uploaded['sf_id']) == ['001a', '001b', '']
+    assert list(uploaded['sf_success']) == [True, True, False]
+
+
+def test_sf_nulls_keeps_false_in_checkbox_columns():
+    df = pd.DataFrame({'IsActive': [True, False, True], 'Mixed': [False, 0, 'x'],
+                       'Amount': [0, 1.5, float('nan')], 'Name': ['a', None, 'c']})
+    ss.SFNulls(df)
+    assert list(df['IsActive']) == [True, False, True]
+    assert list(df['Mixed']) == [False, '#N/A', 'x']
+    assert list(df['Amount']) == ['#N/A', 1.5, '#N/A']
+    assert list(df['Name']) == ['a', '#N/A', 'c']
+
+
+class FakeDescribe(object):
+    # describes from a dict of object => [field names], every org the same
+    def __init__(self, objects):
+        self.objects = objects
+
+    def org_key(self, sf):
+        return 'org'
+
+    def field_index(self, sf, sobject):
+        return {name.lower(): {'name': name, 'type': 'string', 'relationshipName': None, 'referenceTo': []}
+                for name in self.objects[sobject]}
+
+    def field(self, sf, sobject, name):
+        return self.field_index(sf, sobject).get(name.lower())
+
+
+def fakeSync(monkeypatch, objects):
+    # routes SFSync's REST and bulk queries to lists of (soql, include deleted) and returns them
+    rest, bulk = [], []
+    monkeypatch.setattr(ss, 'describeCache', FakeDescribe(objects))
+
+    def pageFrames(SOQL, LowerHeaders=True, IncludeDeleted=False):
+        rest.append((SOQL, IncludeDeleted))
+        page = pd.DataFrame({'Id': ['005a'], 'Name': ['rest'], 'SystemModstamp': ['2024-01-02T00:00:00.000+0000']})
+        yield page.assign(IsDeleted=False) if 'IsDeleted' in SOQL else page
+
+    def SFBulkQuery(SObject, SOQL, IncludeDeleted=False, **kwargs):
+        bulk.append((SOQL, IncludeDeleted))
+        return pd.DataFrame({'id': ['005b'], 'name': ['bulk'], 'systemmodstamp': ['2024-01-01T00:00:00.000+0000']})
+
+    monkeypatch.setattr(ss, 'pageFrames', pageFrames)
+    monkeypatch.setattr(ss, 'SFBulkQuery', SFBulkQuery)
+    return rest, bulk
+
+
+def test_sf_sync_skips_deleted_rows_for_objects_without_is_deleted(monkeypatch, tmp_path):
+    pytest.importorskip('pyarrow')
+    rest, _ = fakeSync(monkeypatch, {'User': ['Id', 'Name', 'SystemModstamp']})
+    ss.SFSync("SELECT Name FROM User", CacheDir=str(tmp_path), SchemaTypes=False)
+    ss.SFSync("SELECT Name FROM User", CacheDir=str(tmp_path), SchemaTypes=False)
+    assert all('IsDeleted' not in soql and not includeDeleted for soql, includeDeleted in rest)
+    assert 'SystemModstamp >=' in rest[1][0]
+
+
+def test_sf_sync_adds_is_deleted_and_uses_query_all_when_it_exists(monkeypatch, tmp_path):
+    pytest.importorskip('pyarrow')
+    rest, _ = fakeSync(monkeypatch, {'Account': ['Id', 'Name', 'SystemModstamp', 'IsDeleted']})
+    ss.SFSync("SELECT Name FROM Account", CacheDir=str(tmp_path), SchemaTypes=False)
+    ss.SFSync("SELECT Name FROM Account", CacheDir=str(tmp_path), SchemaTypes=False)
+    assert 'IsDeleted' in rest[0][0]
+    assert [includeDeleted for _, includeDeleted in rest] == [False, True]
+
+
+def test_sf_sync_keeps_api_names_when_switching_bulk(monkeypatch, tmp_path):
+    pytest.importorskip('pyarrow')
+    fakeSync(monkeypatch, {'User': ['Id', 'Name', 'SystemModstamp']})
+    ss.SFSync("SELECT name FROM User", CacheDir=str(tmp_path), Bulk=True, SchemaTypes=False)
+    res = ss.SFSync("SELECT name FROM User", CacheDir=str(tmp_path), LowerHeaders=False, SchemaTypes=False)
+    assert sorted(res.columns) == ['Id', 'Name', 'SystemModstamp']
+    assert sorted(res['Name']) == ['bulk', 'rest']
+
+
+class FakeCheckpointBulk(object):
+    # saves one result file per batch for a job that already finished on the server
+    def __init__(self, store):
+        self.store = store
+
+    def resumable_query_job(self, object_name, soqls, query_key, **kwargs):
+        self.store.record_job('750', object_name, 'query', query_key=query_key)
+        return '750'
+
+    def download_job_results(self, job_id, directory, **kwargs):
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for batch in ('751a', '751b'):
+            paths.append(os.path.join(directory, batch + '.csv'))
+            with open(paths[-1], 'w') as f:
+                f.write('Id\n%s\n' % batch)
+        return paths
+
+
+@pytest.mark.parametrize('keep', [False, True])
+def test_checkpointed_bulk_query_deletes_files_once_read(monkeypatch, tmp_path, keep):
+    monkeypatch.setattr(ss, 'bulkClient', lambda store=None: FakeCheckpointBulk(store))
+    checkpoint = str(tmp_path / 'ck.sqlite')
+    res = ss.SFBulkQuery('Account', 'SELECT Id FROM Account', Checkpoint=checkpoint, SchemaTypes=False, KeepFiles=keep)
+    assert sorted(res['Id']) == ['751a', '751b']
+    assert os.path.exists(str(tmp_path / 'ck_results')) == keep
+    assert ss.JobStore(checkpoint).job('750')['finished'] == 1
+
+
+@pytest.mark.parametrize('option', [{'ChunkSize': 10}, {'Sink': 'out.csv'}, {'Shards': 4}])
+def test_inlist_query_refuses_options_it_cannot_honour(option):
+    with pytest.raises(ValueError):
+        ss.SFQuery("SELECT Id FROM Contact WHERE Id IN", InList=['1'], **option)
+
+
+def test_inlist_query_keeps_multi_index_keys_unique(monkeypatch):
+    def pageFrames(soql, *args):
+        # two records with a child each, numbered from 0 like every sub-query
+        index = pd.MultiIndex.from_tuples([(0, 0), (1, 0)])
+        yield pd.DataFrame({'Id': [soql[-6:-4], soql[-6:-4]]}, index=index)
+    monkeypatch.setattr(ss, 'pageFrames', pageFrames)
+    soql = "SELECT Id, (SELECT Id FROM Contacts) FROM Account WHERE Id IN"
+    df = ss.SFQuery(soql, InList=['a1', 'b2', 'c3'], MultiIndexChildren=True, SchemaTypes=False,
+                    MaxQueryLength=len(soql) + 12)
+    assert df.index.is_unique
+    assert list(df.index.get_level_values(0)) == [0, 1, 2, 3, 4, 5]
+
+
+class FakePages(object):
+    # a rest query answering with numbered pages, the page named fail raising
+    def __init__(self, pages, fail=None):
+        self.pages = pages
+        self.fail = fail
+        self.fetched = []
+
+    def page(self, n):
+        self.fetched.append(n)
+        if n == self.fail:
+            raise RuntimeError('query failed')
+        return {'records': [{'Id': str(n)}], 'done': n == self.pages - 1, 'nextRecordsUrl': '/query/01g-%d' % (n + 1)}
+
+    def query(self, soql, include_deleted=False):
+        return self.page(0)
+
+    def query_more(self, locator, include_deleted=False):
+        return self.page(int(locator.split('-')[1]))
+
+
+def fakePages(monkeypatch, pages, fail=None):
+    fake = FakePages(pages, fail)
+    monkeypatch.setattr(ss, 'sf', fake)
+    monkeypatch.setattr(ss, 'instrumentSession', lambda: None)
+    return fake
+
+
+def test_query_pages_fetches_the_next_page_while_this_one_is_used(monkeypatch):
+    fake = fakePages(monkeypatch, 5)
+    pages = iter(ss.queryPages("SELECT Id FROM Account"))
+    assert next(pages) == [{'Id': '0'}]
+    time.sleep(0.2)
+    assert fake.fetched == [0, 1, 2]
+    assert [page[0]['Id'] for page in pages] == ['1', '2', '3', '4']
+
+
+def test_query_pages_raises_errors_from_the_background_fetch(monkeypatch):
+    fakePages(monkeypatch, 5, fail=2)
+    pages = iter(ss.queryPages("SELECT Id FROM Account"))
+    assert next(pages) == [{'Id': '0'}]
+    assert next(pages) == [{'Id': '1'}]
+    with pytest.raises(RuntimeError):
+        next(pages)
+
+
+class FakeSession(object):
+    session_id = 'x'
+    sf_instance = 'example.com'
+
+
+@pytest.mark.parametrize('queries', [{'a': ('Account', 'SELECT Id FROM Account')}, [('Account', 'SELECT Id FROM Account')]])
+def test_sf_bulk_queries_sets_schema_types(monkeypatch, queries):
+    pytest.importorskip('aiohttp')
+    import AsyncSalesforceBulkQuery
+    results = {'a': pd.DataFrame({'Id': ['1']})} if isinstance(queries, dict) else [pd.DataFrame({'Id': ['1']})]
+    monkeypatch.setattr(AsyncSalesforceBulkQuery, 'run_bulk_queries', lambda *args, **kwargs: results)
+    monkeypatch.setattr(ss, 'sf', FakeSession())
+    monkeypatch.setattr(ss, 'schemaDtypes', lambda df, SObject: df.assign(typed=SObject))
+    first = lambda res: res['a'] if isinstance(res, dict) else res[0]
+    assert list(first(ss.SFBulkQueries(queries))['typed']) == ['Account']
+    assert 'typed' not in first(ss.SFBulkQueries(queries, SchemaTypes=False))
+
+
+def test_legacy_names_resolve_and_others_do_not():
+    assert ss.DataFrame is pd.DataFrame
+    assert ss.Salesforce.__name__ == 'Salesforce'
+    with pytest.raises(AttributeError):
+        ss.bulk
@@ -0,0 +1,33 @@
+import datetime
+import json
+
+import pandas as pd
+
+from sf_collections import collection_records, collection_results, json_value
+
+
+def test_collection_records_leave_out_blank_cells_and_clear_na():
+    df = pd.DataFrame({'Name': ['a', '', '#N/A'], 'Phone': [None, '555', float('nan')],
+                       'IsActive': [False, True, False]})
+    assert collection_records(df, 'Account') == [
+        {'attributes': {'type': 'Account'}, 'Name': 'a', 'IsActive': False},
+        {'attributes': {'type': 'Account'}, 'Phone': '555', 'IsActive': True},
+        {'attributes': {'type': 'Account'}, 'Name': None, 'IsActive': False},
+    ]
+
+
+def test_collection_records_send_dates_as_iso_text():
+    df = pd.DataFrame({'CloseDate': [datetime.date(2024, 1, 31)]})
+    record = collection_records(df, 'Opportunity')[0]
+    assert json.loads(json.dumps(record, default=json_value))['CloseDate'] == '2024-01-31'
+
+
+def test_collection_results_keep_the_index_and_format_errors():
+    results = [{'id': '001a', 'success': True, 'errors': []},
+               {'success': False, 'errors': [{'statusCode': 'REQUIRED_FIELD_MISSING', 'message': 'Name',
+                                              'fields': ['Name']}]}]
+    frame = collection_results(results, 'insert', pd.Index([3, 3]))
+    assert list(frame.index) == [3, 3]
+    assert list(frame['sf_id']) == ['001a', '']
+    assert list(frame['sf_created']) == [True, False]
+    assert list(frame['sf_error']) == ['', 'REQUIRED_FIELD_MISSING:Name:Name --']
@@ -0,0 +1,35 @@
+import pandas as pd
+
+from sf_schema import api_column_names, format_column
+
+
+def test_format_column_keeps_false_and_nulls_zeros():
+    result, error = format_column(pd.Series([True, False]))
+    assert error is None
+    assert list(result) == [True, False]
+
+    result, error = format_column(pd.Series([False, 0, 'x', None]))
+    assert list(result) == [False, '#N/A', 'x', '#N/A']
+
+
+def test_format_column_writes_checkboxes_as_true_false():
+    result, error = format_column(pd.Series([True, False, None]), {'type': 'boolean'})
+    assert error is None
+    assert list(result) == ['true', 'false', '#N/A']
+
+
+def test_format_column_keeps_zero_when_asked():
+    result, _ = format_column(pd.Series([0, 2]), {'type': 'double'}, zero_as_null=False)
+    assert list(result) == [0, 2]
+
+
+def test_api_column_names_follow_relationships():
+    describes = {
+        'Contact': {'id': {'name': 'Id'}, 'accountid': {'name': 'AccountId', 'relationshipName': 'Account',
+                                                        'referenceTo': ['Account']}},
+        'Account': {'name': {'name': 'Name'}, 'ownerid': {'name': 'OwnerId', 'relationshipName': 'Owner',
+                                                          'referenceTo': ['User']}},
+        'User': {'name': {'name': 'Name'}},
+    }
+    names = api_column_names(['id', 'account.owner.name', 'ACCOUNT.NAME', 'expr0'], 'Contact', describes.get)
+    assert names == {'id': 'Id', 'account.owner.name': 'Account.Owner.Name', 'ACCOUNT.NAME': 'Account.Name'}
@@ -0,0 +1,151 @@
+import re
+import time
+
+import pandas as pd
+import pytest
+
+import SalesforceScripts as ss
+
+
+class FakeQuery(object):
+    # answers shardSOQL's lowest and highest value probes from a list of records
+    def __init__(self, records, field='Id'):
+        self.records = records
+        self.field = field
+        self.soqls = []
+
+    def query(self, soql):
+        self.soqls.append(soql)
+        values = [r for r in self.records if r[self.field] is not None]
+        values.sort(key=lambda r: r[self.field], reverse=' DESC ' in soql)
+        return {'records': values[:1]}
+
+
+def shardRange(soql):
+    # the [low, high) Id range a shard's added condition covers, None for open ends
+    low = re.search(r"Id >= '(\w+)'", soql)
+    high = re.search(r"Id < '(\w+)'", soql)
+    return (ss.idNumber(low.group(1)) if low else None,
+            ss.idNumber(high.group(1)) if high else None)
+
+
+def test_soql_object_ignores_subqueries():
+    assert ss.soqlObject("SELECT Id, (SELECT Id FROM Contacts) FROM Account") == 'Account'
+
+
+@pytest.mark.parametrize('soql, expected', [
+    ("SELECT Id FROM Account LIMIT 5",
+     "SELECT Id FROM Account WHERE C = 3 LIMIT 5"),
+    ("SELECT Id FROM Account WHERE A = 1 ORDER BY Name LIMIT 5",
+     "SELECT Id FROM Account WHERE (A = 1) AND (C = 3) ORDER BY Name LIMIT 5"),
+    ("SELECT Id FROM KnowledgeArticleVersion WITH DATA CATEGORY Geo__c AT usa__c",
+     "SELECT Id FROM KnowledgeArticleVersion WHERE C = 3 WITH DATA CATEGORY Geo__c AT usa__c"),
+    ("SELECT Id FROM Account USING SCOPE mine ORDER BY Name",
+     "SELECT Id FROM Account USING SCOPE mine WHERE C = 3 ORDER BY Name"),
+])
+def test_add_soql_filter_goes_ahead_of_trailing_clauses(soql, expected):
+    assert ss.addSOQLFilter(soql, "C = 3") == expected
+
+
+def test_add_soql_filter_ignores_keywords_in_strings_and_subqueries():
+    soql = "SELECT Id, (SELECT Id FROM Contacts WHERE X = 1 LIMIT 2) FROM Account WHERE Name = 'where limit'"
+    assert ss.addSOQLFilter(soql, "C = 3") == \
+        "SELECT Id, (SELECT Id FROM Contacts WHERE X = 1 LIMIT 2) FROM Account WHERE (Name = 'where limit') AND (C = 3)"
+
+
+def test_id_number_round_trips_and_keeps_order():
+    ids = ['001000000000001', '0010000000000Az', '001000000000Aa0', '001zzzzzzzzzzzz']
+    numbers = [ss.idNumber(i) for i in ids]
+    assert numbers == sorted(numbers)
+    assert [ss.numberId(n) for n in numbers] == ids
+    assert ss.idNumber('001000000000001AAA') == ss.idNumber('001000000000001')
+
+
+def test_split_range_is_even_and_skips_empty_ranges():
+    assert ss.splitRange(0, 100, 4) == [25, 50, 75]
+    assert ss.splitRange(0, 2, 4) == [1]
+    assert ss.splitRange(5, 5, 4) == []
+
+
+def test_shard_soql_covers_every_id_once(monkeypatch):
+    ids = [ss.numberId(ss.idNumber('001000000000000') + n * 7919) for n in range(1000)]
+    monkeypatch.setattr(ss, 'sf', FakeQuery([{'Id': i + 'AAA'} for i in ids]))
+    soql = "SELECT Id FROM Account WHERE A = 1 OR B = 2"
+    shards = ss.shardSOQL(soql, 4)
+    assert len(shards) == 4
+    assert all(s.startswith("SELECT Id FROM Account WHERE (A = 1 OR B = 2) AND (") for s in shards)
+
+    ranges = [shardRange(s) for s in shards]
+    assert ranges[0][0] is None and ranges[-1][1] is None
+    for (_, high), (low, _) in zip(ranges, ranges[1:]):
+        assert high == low
+    for number in [ss.idNumber(i) for i in ids]:
+        assert sum((low is None or number >= low) and (high is None or number < high) for low, high in ranges) == 1
+
+
+def test_shard_soql_probes_with_the_same_filter(monkeypatch):
+    fake = FakeQuery([{'Id': '001000000000001AAA'}, {'Id': '001000000000zzzAAA'}])
+    monkeypatch.setattr(ss, 'sf', fake)
+    ss.shardSOQL("SELECT Id, Name FROM Account USING SCOPE mine WHERE A = 1", 2)
+    assert fake.soqls[0] == "SELECT Id FROM Account USING SCOPE mine WHERE A = 1 ORDER BY Id ASC NULLS LAST LIMIT 1"
+
+
+def test_shard_soql_by_date_keeps_nulls_in_last_shard(monkeypatch):
+    records = [{'CreatedDate': '2024-01-01T00:00:00.000+0000'}, {'CreatedDate': '2024-01-05T00:00:00.000+0000'},
+               {'CreatedDate': None}]
+    monkeypatch.setattr(ss, 'sf', FakeQuery(records, 'CreatedDate'))
+    shards = ss.shardSOQL("SELECT Id FROM Account", 2, ShardBy='CreatedDate')
+    assert shards == ["SELECT Id FROM Account WHERE CreatedDate < 2024-01-03T00:00:00Z",
+                      "SELECT Id FROM Account WHERE CreatedDate >= 2024-01-03T00:00:00Z OR CreatedDate = null"]
+
+
+@pytest.mark.parametrize('soql', [
+    "SELECT Id FROM Account LIMIT 10",
+    "SELECT Id FROM Account ORDER BY Name",
+    "SELECT Industry, COUNT(Id) FROM Account GROUP BY Industry",
+    "SELECT COUNT() FROM Account",
+])
+def test_shard_soql_leaves_unshardable_queries_whole(monkeypatch, soql):
+    fake = FakeQuery([{'Id': '001000000000001AAA'}, {'Id': '001000000000zzzAAA'}])
+    monkeypatch.setattr(ss, 'sf', fake)
+    assert ss.shardSOQL(soql, 4) is None
+    assert fake.soqls == []
+
+
+def test_shard_soql_leaves_single_record_whole(monkeypatch):
+    monkeypatch.setattr(ss, 'sf', FakeQuery([{'Id': '001000000000001AAA'}]))
+    assert ss.shardSOQL("SELECT Id FROM Account", 4) is None
+
+
+def fakeShards(monkeypatch, shards, pages):
+    # SFQuery over the given shard statements, each answering with its list of page frames
+    fetched = []
+
+    def pageFrames(soql, *args):
+        for frame in pages[soql]:
+            fetched.append(soql)
+            yield frame
+    monkeypatch.setattr(ss, 'shardSOQL', lambda soql, count, by='Id': shards)
+    monkeypatch.setattr(ss, 'pageFrames', pageFrames)
+    return fetched
+
+
+def test_sfquery_returns_none_when_every_shard_is_empty(monkeypatch):
+    fakeShards(monkeypatch, ['a', 'b'], {'a': [], 'b': [pd.DataFrame()]})
+    assert ss.SFQuery("SELECT Id FROM Account", Shards=2, SchemaTypes=False) is None
+
+
+def test_sfquery_streams_shards_in_order_a_few_pages_ahead(monkeypatch):
+    shards = ['s%d' % i for i in range(6)]
+    pages = {s: [pd.DataFrame({'Id': ['%s-%d' % (s, p)] * 2}, index=pd.RangeIndex(2 * p, 2 * p + 2))
+                 for p in range(5)] for s in shards}
+    fetched = fakeShards(monkeypatch, shards, pages)
+    ahead = []
+    ids = []
+    for chunk in ss.SFQuery("SELECT Id FROM Account", Shards=6, Workers=2, ChunkSize=2, SchemaTypes=False):
+        time.sleep(0.01)
+        ids += list(chunk['Id'])
+        ahead.append(len(fetched) - len(ids) // 2)
+        assert list(chunk.index) == [len(ids) - 2, len(ids) - 1]
+    assert ids == ['%s-%d' % (s, p) for s in shards for p in range(5) for _ in range(2)]
+    assert max(ahead) <= 2 * 3
@@ -0,0 +1,39 @@
+import SalesforceScripts as ss
+
+
+def test_mask_soql_blanks_quoted_strings():
+    soql = "SELECT Id FROM Account WHERE Name = 'it\\'s (a) Limit 5 test' LIMIT 10"
+    masked = ss.maskSOQL(soql)
+    assert len(masked) == len(soql)
+    assert "Limit 5" not in masked
+    assert masked.endswith("LIMIT 10")
+    assert masked.index("LIMIT 10") == soql.index("LIMIT 10")
+
+
+def test_mask_soql_blanks_subqueries():
+    soql = "SELECT Id, (SELECT Id FROM Contacts WHERE A = 1 ORDER BY Name) FROM Account"
+    masked = ss.maskSOQL(soql)
+    assert "Contacts" not in masked
+    assert "ORDER BY" not in masked
+    assert masked.index("FROM Account") == soql.index("FROM Account")
+
+
+def test_add_soql_filter_wraps_or_conditions():
+    soql = "SELECT Id FROM Account WHERE A = 1 OR B = 2"
+    assert ss.addSOQLFilter(soql, "C = 3") == "SELECT Id FROM Account WHERE (A = 1 OR B = 2) AND (C = 3)"
+
+
+def test_add_soql_filter_without_where():
+    assert ss.addSOQLFilter("SELECT Id FROM Account", "C = 3") == "SELECT Id FROM Account WHERE C = 3"
+
+
+def test_soql_fields_keeps_subqueries():
+    soql = "SELECT Id, Owner.Name, (SELECT Id, Name FROM Contacts) FROM Account"
+    assert ss.soqlFields(soql) == ['Id', 'Owner.Name', '(SELECT Id, Name FROM Contacts)']
+
+
+def test_add_soql_fields_adds_only_missing_fields():
+    soql = "SELECT id, (SELECT CreatedDate FROM Contacts) FROM Account"
+    assert ss.addSOQLFields(soql, ['Id', 'CreatedDate']) == \
+        "SELECT id, (SELECT CreatedDate FROM Contacts), CreatedDate FROM Account"
+    assert ss.addSOQLFields(soql, ['ID']) == soql